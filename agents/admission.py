@@ -0,0 +1,292 @@
+"""
+聊天请求的准入控制
+
+每个 worker 限制同时处理的 /chat、/chat/stream 请求与 /chat/batch 条目数，突发流量在入口排队或被拒绝，
+而不是全部堆积成并发的 LLM 调用、拖慢所有人：
+
+- 并发上限：按 LLM 调用耗时自适应调整(AIMD)。单次 LLM 耗时超过基线的 ADMISSION_LATENCY_TOLERANCE 倍时
+  乘以 0.9 下调(每个基线耗时周期内最多一次)，否则在上限被用到一半以上时每次加 1/上限，
+  约每处理"上限"个调用加 1；始终在 [ADMISSION_MIN_LIMIT, ADMISSION_MAX_LIMIT] 之间。
+  基线近似无排队时的耗时：遇到更快的调用立即下调，否则缓慢上移，以适应模型本身变慢
+- 排队：超过上限的请求进入有界队列，按会话轮转放行，一个会话连发的消息不会占满所有名额；
+  单个会话同时处理的请求数与排队数也有上限。/chat/batch 的所有条目以 batch:<批次 ID> 作为同一个会话参与轮转，
+  一个大批次不会被当作许多个会话挤占交互请求，其同时处理与排队的条目数以批次并发数为上限
+- 拒绝：队列已满、按当前吞吐预计排队时间超过 ADMISSION_QUEUE_TIMEOUT、或排队超时的请求返回 429，
+  Retry-After 为预计的等待时间
+"""
+import asyncio
+import collections
+import math
+import time
+from typing import Any, Deque, Dict, Optional
+
+from config.settings import settings
+from utils.logger import get_logger
+from utils.metrics import ADMISSION_LIMIT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_SHED
+from utils.tracing import add_span_listener
+
+logger = get_logger(__name__)
+
+# 基线上移与请求耗时的平滑系数
+BASELINE_ALPHA = 0.01
+SERVICE_TIME_ALPHA = 0.2
+DECREASE_FACTOR = 0.9
+
+
+class AdmissionRejected(Exception):
+    """请求未被接纳，由 api.main 转为 429 响应"""
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(f"服务繁忙({reason})，请 {math.ceil(retry_after)} 秒后重试")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Slot:
+    """一个处理名额，started 为放行时间；release 可重复调用"""
+
+    __slots__ = ("_controller", "session_id", "started")
+
+    def __init__(self, controller: Optional["AdmissionController"], session_id: str) -> None:
+        self._controller = controller
+        self.session_id = session_id
+        self.started = time.monotonic()
+
+    def release(self) -> None:
+        controller, self._controller = self._controller, None
+        if controller is not None:
+            controller._release(self)
+
+
+class AdaptiveLimit:
+    """按 LLM 调用耗时加性增、乘性减的并发上限"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, tolerance: float) -> None:
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.value = float(min(max(initial, minimum), maximum))
+        self.baseline: Optional[float] = None
+        self._decreased_at = 0.0
+        self.decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self.value)
+
+    def observe(self, seconds: float, in_flight: int) -> None:
+        if self.baseline is None:
+            self.baseline = seconds
+            return
+        now = time.monotonic()
+        if seconds > self.baseline * self.tolerance:
+            # 同一批慢请求只下调一次，避免上限被连续的慢样本压到最低
+            if now - self._decreased_at >= self.baseline:
+                self.value = max(self.minimum, self.value * DECREASE_FACTOR)
+                self._decreased_at = now
+                self.decreases += 1
+                logger.info("LLM 耗时 %.2fs 超过基线 %.2fs 的 %.1f 倍，并发上限下调为 %d",
+                            seconds, self.baseline, self.tolerance, self.limit)
+        elif in_flight * 2 >= self.value:
+            self.value = min(self.maximum, self.value + 1 / self.value)
+        self.baseline = min(seconds, self.baseline + (seconds - self.baseline) * BASELINE_ALPHA)
+        ADMISSION_LIMIT.set(self.limit)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        queue_size: int,
+        queue_timeout: float,
+        session_limit: int,
+        session_queue: int,
+        latency_tolerance: float,
+    ) -> None:
+        self.limiter = AdaptiveLimit(initial_limit, min_limit, max_limit, latency_tolerance)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.session_limit = session_limit
+        self.session_queue = session_queue
+        self.in_flight = 0
+        self._session_in_flight: Dict[str, int] = collections.Counter()
+        # 单独指定了同时处理数上限的会话(如批次)，没有处理中与排队的请求时移除
+        self._session_limits: Dict[str, int] = {}
+        # 每个会话一个等待队列，有等待者的会话按轮转顺序放行
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+        self._rotation: Deque[str] = collections.deque()
+        self.waiting = 0
+        # 单个请求的平均处理耗时，用于估计排队时间
+        self.service_time = 1.0
+        self.admitted = 0
+        self.queued = 0
+        self.shed: Dict[str, int] = collections.Counter()
+        ADMISSION_LIMIT.set(self.limiter.limit)
+
+    def observe_span(self, name: str, seconds: float, attributes: Dict[str, Any], error: Optional[str]) -> None:
+        # 只取非流式的 LLM 调用：流式 span 包含客户端读取的时间
+        if name == "llm" and error is None:
+            self.limiter.observe(seconds, self.in_flight)
+
+    def _session_limit(self, session_id: str) -> int:
+        return self._session_limits.get(session_id, self.session_limit)
+
+    def _admissible(self, session_id: str) -> bool:
+        return self.in_flight < self.limiter.limit and self._session_in_flight[session_id] < self._session_limit(session_id)
+
+    def _grant(self, session_id: str) -> Slot:
+        self.in_flight += 1
+        self._session_in_flight[session_id] += 1
+        self.admitted += 1
+        return Slot(self, session_id)
+
+    def _forget(self, session_id: str) -> None:
+        """会话没有处理中与排队的请求时清理其计数与单独的上限"""
+        if self._session_in_flight.get(session_id, 0) <= 0 and session_id not in self._waiters:
+            self._session_in_flight.pop(session_id, None)
+            self._session_limits.pop(session_id, None)
+
+    def _estimated_wait(self, position: int) -> float:
+        return position * self.service_time / max(self.limiter.limit, 1)
+
+    def _reject(self, reason: str, retry_after: float) -> AdmissionRejected:
+        self.shed[reason] += 1
+        logger.info("聊天请求被拒绝(%s)：处理中 %d，排队 %d，上限 %d", reason, self.in_flight, self.waiting, self.limiter.limit)
+        ADMISSION_SHED.labels(reason).inc()
+        return AdmissionRejected(reason, max(retry_after, 1.0))
+
+    def _dispatch(self) -> None:
+        """按会话轮转放行等待者，直到没有空闲名额或剩下的会话都已达到各自上限"""
+        skipped = 0
+        while self._rotation and self.in_flight < self.limiter.limit and skipped < len(self._rotation):
+            session_id = self._rotation[0]
+            self._rotation.rotate(-1)
+            if self._session_in_flight[session_id] >= self._session_limit(session_id):
+                skipped += 1
+                continue
+            skipped = 0
+            queue = self._waiters[session_id]
+            future = queue.popleft()
+            self.waiting -= 1
+            if not queue:
+                del self._waiters[session_id]
+                self._rotation.remove(session_id)
+            future.set_result(self._grant(session_id))
+        ADMISSION_QUEUE_DEPTH.set(self.waiting)
+
+    def _remove(self, session_id: str, future: asyncio.Future) -> None:
+        queue = self._waiters.get(session_id)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self.waiting -= 1
+        if not queue:
+            del self._waiters[session_id]
+            self._rotation.remove(session_id)
+            self._forget(session_id)
+        ADMISSION_QUEUE_DEPTH.set(self.waiting)
+
+    async def acquire(self, session_id: str, session_limit: Optional[int] = None) -> Slot:
+        """
+        获取处理名额，拿不到时抛出 AdmissionRejected
+
+        session_limit 单独指定该会话同时处理与排队的请求数上限，默认使用 ADMISSION_SESSION_LIMIT 与 ADMISSION_SESSION_QUEUE
+        """
+        if session_limit is not None:
+            self._session_limits[session_id] = session_limit
+        if not self._waiters and self._admissible(session_id):
+            return self._grant(session_id)
+
+        limit = self._session_limit(session_id)
+        queue_limit = self.session_queue if session_limit is None else session_limit
+        session_waiting = len(self._waiters.get(session_id, ()))
+        estimate = self._estimated_wait(self.waiting + 1)
+        try:
+            if self.waiting >= self.queue_size:
+                raise self._reject("queue_full", estimate)
+            if session_waiting >= queue_limit:
+                raise self._reject("session_queue_full", self.service_time * (session_waiting + 1) / limit)
+            if estimate > self.queue_timeout:
+                raise self._reject("deadline", estimate)
+        except AdmissionRejected:
+            self._forget(session_id)
+            raise
+
+        future = asyncio.get_running_loop().create_future()
+        if session_id not in self._waiters:
+            self._waiters[session_id] = collections.deque()
+            self._rotation.append(session_id)
+        self._waiters[session_id].append(future)
+        self.waiting += 1
+        self.queued += 1
+        self._dispatch()
+
+        start = time.monotonic()
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # 客户端在排队时断开；若恰好已被放行，归还放行时创建的名额(处理耗时按放行时间计算)
+            if future.done():
+                future.result().release()
+            else:
+                self._remove(session_id, future)
+            raise
+        ADMISSION_QUEUE_WAIT.observe(time.monotonic() - start)
+        # 超时后、本协程恢复前可能已被其他请求释放的名额放行，以 future 的状态为准
+        if not future.done():
+            self._remove(session_id, future)
+            raise self._reject("timeout", self._estimated_wait(self.waiting + 1))
+        return future.result()
+
+    def _release(self, slot: Slot) -> None:
+        self.in_flight -= 1
+        self._session_in_flight[slot.session_id] -= 1
+        self._forget(slot.session_id)
+        self.service_time += (time.monotonic() - slot.started - self.service_time) * SERVICE_TIME_ALPHA
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        baseline = self.limiter.baseline
+        return {
+            "limit": self.limiter.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": dict(self.shed),
+            "limit_decreases": self.limiter.decreases,
+            "llm_latency_baseline_ms": round(baseline * 1000, 2) if baseline is not None else None,
+            "service_time_ms": round(self.service_time * 1000, 2),
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """准入控制为可选功能，未开启时返回 None"""
+    global _controller
+    app = settings.app
+    if _controller is None and app.admission_enabled:
+        _controller = AdmissionController(
+            initial_limit=app.admission_initial_limit,
+            min_limit=app.admission_min_limit,
+            max_limit=app.admission_max_limit,
+            queue_size=app.admission_queue_size,
+            queue_timeout=app.admission_queue_timeout,
+            session_limit=app.admission_session_limit,
+            session_queue=app.admission_session_queue,
+            latency_tolerance=app.admission_latency_tolerance,
+        )
+        add_span_listener(_controller.observe_span)
+    return _controller
+
+
+async def admit(session_id: str, session_limit: Optional[int] = None) -> Slot:
+    """获取处理名额；未开启准入控制时返回不占名额的 Slot"""
+    controller = get_admission_controller()
+    if controller is None:
+        return Slot(None, session_id)
+    return await controller.acquire(session_id, session_limit)
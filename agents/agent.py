@@ -1,16 +1,97 @@
-from langchain_openai import ChatOpenAI
-from langchain.agents import create_agent
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Sequence, Tuple
 from config.settings import settings
 from pydantic import SecretStr
-from tools.lc_tools import weather_tool, news_tool
+from utils.http_client import get_http_client
+
+# langchain_openai(连带 openai、langsmith)导入耗时约 1 秒，推迟到首次构建模型时导入
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+DEFAULT_MODEL = "google/gemini-2.5-flash"
+AGENT_MODEL = "qwen/qwen-2.5-72b-instruct"
+
+
+class ModelRegistry:
+    """
+    进程级模型注册表
+
+    每个模型只构建一次 ChatOpenAI，请求走 utils.http_client 中按上游主机共享的 httpx 连接池，
+    每个 (模型, 工具列表) 组合只执行一次 bind_tools 的 schema 转换，
+    后续请求直接复用。
+    """
+
+    def __init__(self) -> None:
+        self._llms: Dict[str, "ChatOpenAI"] = {}
+        self._bindings: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _build_llm(self, model: str) -> "ChatOpenAI":
+        from langchain_openai import ChatOpenAI
+
+        base_url = settings.api.openrouter_base_url
+        return ChatOpenAI(
+            model=model,
+            temperature=0,
+            base_url=base_url,
+            api_key=SecretStr(settings.api.openrouter_api_key),
+            http_async_client=get_http_client(base_url),
+        )
+
+    def get_llm(self, model: str = DEFAULT_MODEL) -> "ChatOpenAI":
+        """获取未绑定工具的模型实例"""
+        with self._lock:
+            llm = self._llms.get(model)
+            if llm is None:
+                llm = self._build_llm(model)
+                self._llms[model] = llm
+            return llm
+
+    def get(self, model: str = DEFAULT_MODEL, tools: Sequence[Any] = ()) -> Any:
+        """获取绑定了指定工具的模型，命中缓存时不再重复构建"""
+        key = (model, tuple(tool.name for tool in tools))
+        with self._lock:
+            binding = self._bindings.get(key)
+            if binding is not None:
+                self.hits += 1
+                return binding
+            self.misses += 1
+
+        llm = self.get_llm(model)
+        binding = llm.bind_tools(list(tools)) if tools else llm
+        with self._lock:
+            # 并发构建时以先写入的为准，保证全进程只有一份
+            binding = self._bindings.setdefault(key, binding)
+        return binding
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "models": len(self._llms),
+                "bindings": len(self._bindings),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._llms.clear()
+            self._bindings.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# 全局模型注册表
+model_registry = ModelRegistry()
+
 
 def build_agent():
-    llm = ChatOpenAI(
-        model="qwen/qwen-2.5-72b-instruct",
-        temperature=0,
-        base_url=settings.api.openrouter_base_url,
-        api_key=SecretStr(settings.api.openrouter_api_key),
-    )
+    from langchain.agents import create_agent
+    from tools.lc_tools import weather_tool, news_tool
+
+    llm = model_registry.get_llm(AGENT_MODEL)
 
     tools = [
         weather_tool,
@@ -23,15 +104,10 @@ def build_agent():
     )
     return agent
 
-def build_llm_with_tools():
-    llm = ChatOpenAI(
-        model="google/gemini-2.5-flash",
-        temperature=0,
-        base_url=settings.api.openrouter_base_url,
-        api_key=SecretStr(settings.api.openrouter_api_key),
-    )
+def build_llm_with_tools(model: str = DEFAULT_MODEL):
+    from tools.lc_tools import weather_tool, news_tool
 
-    return llm.bind_tools([
+    return model_registry.get(model, [
         weather_tool,
         news_tool,
-    ])
\ No newline at end of file
+    ])
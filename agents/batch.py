@@ -0,0 +1,138 @@
+"""
+批量聊天
+
+- 多个相互独立的聊天请求由固定数量的 worker 处理(有界并发)，结果按完成顺序逐条产出
+- 同一批次内共享工具结果(ToolMemo)：参数相同的工具调用只请求一次上游
+- 批次内的上游请求走低优先级通道，不占用限流器为交互请求保留的令牌
+- 每条请求与 /chat 一样经过准入控制，多个批次并发时总处理数仍受自适应并发上限约束；
+  同一批次的条目以 batch:<批次 ID> 作为一个会话参与公平轮转，不会挤占交互请求；
+  被拒绝时按 Retry-After 退避重试，累计等待超过 BATCH_ADMISSION_MAX_WAIT 秒的条目返回 429
+- 单条请求失败不影响其他请求，错误作为该条的结果返回；输入无法解析的条目同样返回错误
+- 产出结果的队列有界，客户端读取变慢时 worker 随之暂停，不在内存中堆积结果
+"""
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Union
+
+from pydantic import ValidationError
+
+from agents.route import handle_message
+from agents.admission import AdmissionRejected, Slot, admit
+from config.settings import settings
+from schemas.chat import BatchChatItem
+from state.store import SessionConflictError, StateStore
+from tools.rate_limit import PRIORITY_BATCH, priority_scope
+from tools.registry import ToolMemo, tool_memo_scope
+from utils.logger import get_logger
+from utils.metrics import REQUEST_LATENCY
+
+logger = get_logger(__name__)
+
+
+def parse_item(data: Any, batch_id: str, index: int) -> Union[BatchChatItem, str]:
+    """
+    解析单条请求，失败时返回错误信息
+
+    兼容 request_id/title/body 格式的任务清单：body 作为消息，request_id 作为条目 ID 与会话 ID；
+    未指定 session_id 的条目使用独立的会话，互不影响
+    """
+    if not isinstance(data, dict):
+        return "每条请求必须是 JSON 对象"
+    data = dict(data)
+    if "message" not in data and "body" in data:
+        data["message"] = data.pop("body")
+    if data.get("request_id") is not None:
+        data.setdefault("id", str(data["request_id"]))
+        data.setdefault("session_id", str(data["request_id"]))
+    data.setdefault("session_id", f"batch-{batch_id}-{index}")
+    try:
+        return BatchChatItem.model_validate(data)
+    except ValidationError as e:
+        return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+
+async def _admit_item(admission_key: str, concurrency: int) -> Slot:
+    """获取处理名额；批量请求不急于返回，被拒绝时退避重试而不是立即失败"""
+    deadline = time.monotonic() + settings.app.batch_admission_max_wait
+    while True:
+        try:
+            return await admit(admission_key, session_limit=concurrency)
+        except AdmissionRejected as e:
+            if time.monotonic() + e.retry_after > deadline:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+
+async def _run_one(
+    index: int, item: Union[BatchChatItem, str], state_store: StateStore, admission_key: str, concurrency: int
+) -> Dict[str, Any]:
+    if isinstance(item, str):
+        return {"index": index, "id": None, "status": 422, "error": item}
+
+    result: Dict[str, Any] = {"index": index, "id": item.id, "session_id": item.session_id}
+    start = time.perf_counter()
+    route = "error"
+    try:
+        slot = await _admit_item(admission_key, concurrency)
+        try:
+            response = await handle_message(
+                item.session_id, item.message, item.output_format or "text", state_store, item.metadata, item.template_answer
+            )
+        finally:
+            slot.release()
+        route = response.state.get("route", "llm")
+        result.update(status=200, response=response.model_dump())
+    except AdmissionRejected as e:
+        route = "shed"
+        result.update(status=429, error=str(e))
+    except SessionConflictError as e:
+        result.update(status=409, error=str(e))
+    except Exception as e:
+        logger.exception("批量请求第 %d 条处理失败", index)
+        result.update(status=500, error=str(e))
+    elapsed = time.perf_counter() - start
+    REQUEST_LATENCY.labels("chat_batch", route).observe(elapsed)
+    result["elapsed_ms"] = round(elapsed * 1000, 2)
+    return result
+
+
+async def run_batch(
+    items: List[Union[BatchChatItem, str]], concurrency: int, state_store: StateStore, batch_id: str
+) -> AsyncIterator[Dict[str, Any]]:
+    """按完成顺序产出每条请求的结果，最后产出一条汇总"""
+    memo = ToolMemo()
+    admission_key = f"batch:{batch_id}"
+    results: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=concurrency * 2)
+    pending = iter(enumerate(items))
+    start = time.perf_counter()
+
+    async def worker() -> None:
+        with tool_memo_scope(memo), priority_scope(PRIORITY_BATCH):
+            # 所有 worker 共享同一个迭代器，谁空闲谁取下一条
+            for index, item in pending:
+                await results.put(await _run_one(index, item, state_store, admission_key, concurrency))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(items)))]
+    counts = {"succeeded": 0, "failed": 0}
+    try:
+        for _ in range(len(items)):
+            result = await results.get()
+            counts["succeeded" if result["status"] == 200 else "failed"] += 1
+            yield result
+    finally:
+        # 客户端中途断开时取消尚未完成的请求
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    elapsed = time.perf_counter() - start
+    logger.info("批量请求完成：%d 条，成功 %d，耗时 %.2fs", len(items), counts["succeeded"], elapsed)
+    yield {
+        "summary": {
+            "total": len(items),
+            **counts,
+            "concurrency": concurrency,
+            "tool_memo_hits": memo.hits,
+            "elapsed_ms": round(elapsed * 1000, 2),
+        }
+    }
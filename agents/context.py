@@ -0,0 +1,142 @@
+"""
+按 token 预算构建 LLM 上下文
+
+- 最近的消息原样保留，直到用完 token 预算(至少保留 min_recent_messages 条)
+- 滑出窗口的旧消息增量折叠进会话状态中的摘要(summary)
+- 摘要只在窗口滑动时重新计算；折叠时一次性把窗口压到低水位，
+  之后若干轮对话都不需要再次调用摘要模型
+
+消息使用绝对序号定位：message_count 为会话累计消息数，
+summary_upto 表示序号小于它的消息已折叠进摘要。
+"""
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from agents.agent import DEFAULT_MODEL, model_registry
+from config.settings import settings
+from utils.logger import get_logger
+from utils.tracing import span
+from utils.metrics import observe_llm_usage
+
+logger = get_logger(__name__)
+
+Summarizer = Callable[[str, List[Dict[str, Any]]], Awaitable[str]]
+
+_encoding: Any = None
+
+
+def count_tokens(text: str) -> int:
+    """用 tiktoken 统计 token 数；不可用(未安装或无法下载词表)时按字符数保守估算"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning("tiktoken 不可用，按字符数估算 token：%s", e)
+            _encoding = False
+    if _encoding is False:
+        return len(text)
+    return len(_encoding.encode(text))
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    # 每条消息额外约 4 个 token 的角色与分隔开销
+    return count_tokens(str(message.get("content", ""))) + 4
+
+
+@dataclass
+class Context:
+    """本轮要发送给 LLM 的上下文，以及需要写回会话状态的字段"""
+    recent: List[Dict[str, Any]]
+    summary: str
+    updates: Dict[str, Any] = field(default_factory=dict)
+
+
+class ContextWindow:
+    def __init__(
+        self,
+        token_budget: int,
+        min_recent_messages: int,
+        summarize: Summarizer,
+        low_watermark: float = 0.6,
+    ) -> None:
+        self.token_budget = token_budget
+        self.min_recent_messages = min_recent_messages
+        self.summarize = summarize
+        self.low_watermark = low_watermark
+
+    def _window_start(self, messages: List[Dict[str, Any]], budget: int) -> int:
+        """从最新消息往前累加，返回能放入预算的最早消息下标"""
+        used = 0
+        start = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            used += message_tokens(messages[i])
+            if used > budget and len(messages) - i > self.min_recent_messages:
+                break
+            start = i
+        return start
+
+    async def build(self, state: Dict[str, Any]) -> Context:
+        messages: List[Dict[str, Any]] = state.get("messages", [])
+        summary: str = state.get("summary", "")
+        # 计数异常(小于保存的条数)时以保存的条数为准，offset 不会为负，旧消息不会未经折叠就被丢弃
+        total = max(state.get("message_count", len(messages)), len(messages))
+        # messages[0] 对应的绝对序号(更早的消息已被存储层截断)
+        offset = total - len(messages)
+        summary_upto = min(max(state.get("summary_upto", 0), offset), total)
+
+        budget = self.token_budget - (count_tokens(summary) if summary else 0)
+        start = self._window_start(messages, budget)
+        # 已折叠进摘要的消息不再重复发送
+        start = max(start, summary_upto - offset)
+        if offset + start <= summary_upto:
+            return Context(recent=messages[start:], summary=summary)
+
+        # 窗口滑动：一次压到低水位，留出后续几轮的增长空间
+        start = max(start, self._window_start(messages, int(budget * self.low_watermark)))
+        to_fold = messages[summary_upto - offset:start]
+        logger.info("折叠 %d 条旧消息进会话摘要", len(to_fold))
+        summary = await self.summarize(summary, to_fold)
+        return Context(
+            recent=messages[start:],
+            summary=summary,
+            updates={"summary": summary, "summary_upto": offset + start},
+        )
+
+
+SUMMARY_PROMPT = (
+    "请把下面的对话压缩成简洁的中文摘要，保留后续对话需要的关键信息"
+    "(如涉及的城市、新闻主题、用户偏好和已给出的结论)，不要添加原文没有的内容。"
+)
+
+
+async def summarize_with_llm(previous: str, messages: List[Dict[str, Any]]) -> str:
+    """调用不绑定工具的模型，把旧摘要和新滑出窗口的消息合并为新摘要"""
+    from langchain.messages import HumanMessage, SystemMessage
+
+    lines = [f"{'用户' if msg['role'] == 'user' else '助手'}：{msg['content']}" for msg in messages]
+    content = "\n".join(lines)
+    if previous:
+        content = f"已有摘要：{previous}\n\n新增对话：\n{content}"
+    with span("llm.summary", messages=len(messages)):
+        result = await model_registry.get_llm(DEFAULT_MODEL).ainvoke([
+            SystemMessage(content=SUMMARY_PROMPT),
+            HumanMessage(content=content),
+        ])
+    observe_llm_usage(result)
+    return result.content if isinstance(result.content, str) else str(result.content)
+
+
+_window: Optional[ContextWindow] = None
+
+
+def get_context_window() -> ContextWindow:
+    global _window
+    if _window is None:
+        _window = ContextWindow(
+            token_budget=settings.app.context_token_budget,
+            min_recent_messages=settings.app.context_min_recent_messages,
+            summarize=summarize_with_llm,
+        )
+    return _window
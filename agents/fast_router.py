@@ -0,0 +1,125 @@
+"""
+确定性快速路由：明显的工具意图直接调用工具并用工具的模板渲染回答，不经过 LLM
+
+- 天气：天气关键词 + 城市名词典(预置城市与和风天气城市搜索缓存中的城市)
+- 新闻：新闻关键词 + 主题表，或"xx新闻"句式中提取的主题
+
+每个意图给出置信度，只有不低于阈值时才走快速路径；出现多个城市、
+同时包含天气与新闻关键词、或带有工具不支持的时间(如"明天")时
+置信度降低，交给 LLM 处理。按置信度分桶统计命中与回退次数，用于调整阈值。
+"""
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+WEATHER_KEYWORDS = re.compile(r"天气|气温|温度|下雨|下雪|冷不冷|热不热|几度")
+NEWS_KEYWORDS = re.compile(r"新闻|资讯|头条")
+# 天气工具只提供实况，其他时间交给 LLM 解释
+UNSUPPORTED_DATES = re.compile(r"明天|后天|昨天|下周|周末|未来|预报")
+NEWS_TOPICS = (
+    "科技", "体育", "财经", "娱乐", "国际", "国内", "军事", "汽车", "游戏",
+    "教育", "健康", "房产", "互联网", "人工智能", "AI",
+)
+NEWS_TOPIC_PATTERN = re.compile(r"([一-龥A-Za-z]{2,8}?)(?:的)?(?:新闻|资讯|头条)")
+# 去掉意图关键词、实体和这些口语词后若没有剩余内容，说明消息只表达了这一个意图
+FILLER_WORDS = re.compile(
+    r"请问|帮我|给我|查一下|查询|查查|看看|一下|今天|现在|目前|最新|最近|有什么|有哪些|"
+    r"怎么样|如何|多少|是什么|的|吗|呢|啊|吧|我想知道|告诉我|[\s，。！？、,.!?]"
+)
+
+
+@dataclass
+class Intent:
+    tool: str
+    args: Dict[str, Any]
+    confidence: float
+
+
+class FastRouter:
+    def __init__(self, known_cities: Callable[[], Iterable[str]], threshold: float) -> None:
+        self.known_cities = known_cities
+        self.threshold = threshold
+        self._city_pattern: Optional[re.Pattern] = None
+        self._city_names: frozenset = frozenset()
+        self._lock = threading.Lock()
+        self.routed: Counter = Counter()
+        # 置信度按 0.1 分桶，分别记录走快速路径与回退 LLM 的次数
+        self.buckets: Counter = Counter()
+
+    def _cities(self) -> Optional[re.Pattern]:
+        """城市索引增长后重新编译词典，长名优先匹配"""
+        names = frozenset(name for name in self.known_cities() if name)
+        with self._lock:
+            if names != self._city_names:
+                self._city_names = names
+                alternation = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+                self._city_pattern = re.compile(alternation) if alternation else None
+            return self._city_pattern
+
+    @staticmethod
+    def _residual(text: str, *patterns: re.Pattern) -> str:
+        for pattern in patterns:
+            text = pattern.sub("", text)
+        return FILLER_WORDS.sub("", text)
+
+    def _match_weather(self, text: str) -> Optional[Intent]:
+        pattern = self._cities()
+        cities = list(dict.fromkeys(pattern.findall(text))) if pattern else []
+        if not cities:
+            return None
+        confidence = 0.8 if len(cities) == 1 else 0.5
+        if not self._residual(text, WEATHER_KEYWORDS, pattern):
+            confidence += 0.15
+        if UNSUPPORTED_DATES.search(text):
+            confidence -= 0.4
+        return Intent("weather", {"city": cities[0], "date": "今天"}, round(confidence, 2))
+
+    def _match_news(self, text: str) -> Optional[Intent]:
+        topics = [topic for topic in NEWS_TOPICS if topic.casefold() in text]
+        if topics:
+            topic, confidence = topics[0], 0.75 if len(topics) == 1 else 0.5
+        else:
+            found = NEWS_TOPIC_PATTERN.search(FILLER_WORDS.sub("", text))
+            if not found:
+                return None
+            topic, confidence = found.group(1), 0.7
+        topic_pattern = re.compile("|".join(re.escape(t.casefold()) for t in topics or [topic]))
+        if not self._residual(text, NEWS_KEYWORDS, topic_pattern):
+            confidence += 0.15
+        return Intent("news", {"topic": topic}, round(confidence, 2))
+
+    def match(self, message: str) -> Optional[Intent]:
+        text = message.strip().casefold()
+        is_weather = bool(WEATHER_KEYWORDS.search(text))
+        is_news = bool(NEWS_KEYWORDS.search(text))
+        if is_weather == is_news:
+            # 没有工具意图，或同时涉及两个工具
+            return None
+        return self._match_weather(text) if is_weather else self._match_news(text)
+
+    def route(self, message: str) -> Optional[Intent]:
+        """返回可以直接执行的意图，置信度不足时返回 None"""
+        intent = self.match(message)
+        if intent is None:
+            self.routed["none"] += 1
+            return None
+        accepted = intent.confidence >= self.threshold
+        bucket = f"{min(int(intent.confidence * 10), 9) / 10:.1f}"
+        self.buckets[(bucket, "fast" if accepted else "llm")] += 1
+        self.routed[f"{intent.tool}:{'fast' if accepted else 'llm'}"] += 1
+        logger.info("快速路由 %s 置信度 %.2f，%s", intent.tool, intent.confidence, "直接调用工具" if accepted else "交给 LLM")
+        return intent if accepted else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "routed": dict(self.routed),
+            "confidence": {f"{bucket}:{path}": count for (bucket, path), count in sorted(self.buckets.items())},
+        }
+
@@ -0,0 +1,71 @@
+"""
+无状态问答的响应缓存
+
+按归一化后的消息文本(去除空白与标点、统一大小写)精确匹配。
+
+缓存有效期跟随工具数据的新鲜度：天气回答随实况刷新间隔过期，
+新闻回答使用更短的过期时间，不涉及工具的回答使用通用缓存时间。
+"""
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from config.settings import settings
+from utils.cache import TTLCache
+from utils.metrics import CACHE_REQUESTS
+
+_PUNCTUATION = re.compile(r"[\s，。！？、；：“”‘’（）《》【】…—,.!?;:'\"()\[\]<>~\-]+")
+
+
+def normalize_text(text: str) -> str:
+    """去除空白与标点并统一大小写"""
+    return _PUNCTUATION.sub("", text).casefold()
+
+
+@dataclass
+class CachedResponse:
+    answer: str
+    last_tool: Dict[str, Any]
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int) -> None:
+        # 命中率记录在 cache="response" 下，内部的 TTLCache 不单独计入指标
+        self._exact = TTLCache(maxsize, settings.app.cache_ttl)
+        self.lookups = 0
+        self.exact_hits = 0
+
+    @staticmethod
+    def ttl_for(tool_names: Iterable[str]) -> int:
+        """按本轮用到的工具中最短的数据新鲜度决定过期时间"""
+        app = settings.app
+        ttls = [app.cache_ttl]
+        for name in tool_names:
+            if name == "weather":
+                ttls.append(app.weather_obs_ttl)
+            elif name == "news":
+                ttls.append(app.response_cache_news_ttl)
+        return min(ttls)
+
+    def get(self, message: str) -> Tuple[Optional[CachedResponse], str]:
+        """返回 (缓存结果, 命中层级)，层级为 exact / miss"""
+        self.lookups += 1
+        cached = self._exact.get(normalize_text(message))
+        if cached is not None:
+            self.exact_hits += 1
+            CACHE_REQUESTS.labels("response", "exact").inc()
+            return cached, "exact"
+        CACHE_REQUESTS.labels("response", "miss").inc()
+        return None, "miss"
+
+    def put(self, message: str, answer: str, last_tool: Dict[str, Any], tool_names: Iterable[str]) -> None:
+        ttl = self.ttl_for(tool_names)
+        self._exact.set(normalize_text(message), CachedResponse(answer=answer, last_tool=last_tool), ttl=ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "hit_ratio": round(self.exact_hits / self.lookups, 4) if self.lookups else 0.0,
+            "entries": len(self._exact),
+        }
@@ -1,139 +1,190 @@
-from typing import Dict, Any
-from langchain.messages import HumanMessage, AIMessage, ToolMessage, SystemMessage
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Any, List, Optional, Tuple
+from config.settings import settings
 from state.store import StateStore
 from schemas.chat import ChatResponse, ToolCall
-from tools.registry import list_tools
+from tools.registry import Tool, get_weather_tool, list_tools
 from utils.logger import get_logger
-# from agents.agent import build_agent
-from agents.agent import build_llm_with_tools
+from utils.tracing import current_trace, span
+from utils.metrics import TOOL_CALLS, observe_llm_usage
+from agents.agent import build_llm_with_tools, model_registry, DEFAULT_MODEL
+from agents.context import Context, get_context_window
+from agents.fast_router import FastRouter, Intent
+import asyncio
 import json
-import re
+import time
+
+if TYPE_CHECKING:
+    from langchain.messages import ToolMessage
+    from agents.response_cache import ResponseCache
 
-_default_store = StateStore()
-MAX_HISTORY = 20
 logger = get_logger(__name__)
 
+# 默认会话存储，首次使用时创建
+_default_store: Optional[StateStore] = None
+_response_cache: Optional["ResponseCache"] = None
+_fast_router: Optional[FastRouter] = None
 
-# def extract_city(text: str) -> str:
-#     # 清理常见口语词，保留城市
-#     text = re.sub(r"(天气|怎么样|如何|气温|温度|查询|一下)", "", text)
-#     text = text.replace("在", "").replace("的", "").strip()
-#     return text
-
-# def extract_topic(text: str) -> str:
-#     # 清理常见口语词，保留主题
-#     text = re.sub(r"(新闻|最新|一下|关于|有关)", "", text)
-#     text = text.replace("的", "").strip()
-#     return text
-
-# def handle_weather_tool(message: str, tools: Dict[str, Any], tool_calls: int) -> tuple[str, Dict[str, Any]]:
-#     tool = tools["weather"]
-#     city = extract_city(message)
-#     if not city:
-#         return "请提供城市名称以查询天气。", {}
-#     tool_response = tool.handler(city=city, date="今天")
-#     answer = f"{city}的天气是{tool_response['temperature']}，{tool_response['condition']}。"
-#     last_tool = {
-#         "name": "weather",
-#         "parameters": {"city": city},
-#         "response": tool_response,
-#     }
-#     tool_calls += 1
-#     return answer, last_tool
-
-# def handle_news_tool(message: str, tools: Dict[str, Any], tool_calls: int) -> tuple[str, Dict[str, Any]]:
-#     tool = tools["news"]
-#     topic = extract_topic(message)
-#     if not topic:
-#         return "请提供新闻主题以获取新闻。", {}
-
-#     tool_response = tool.handler(topic=topic)
-#     items = tool_response.get("items", [])
-#     if not items:
-#         return "暂时没有找到相关新闻。", {}
-
-#     news_item = tool_response["items"][0]
-#     answer = f"最新的{topic}新闻：{news_item['title']}，来源：{news_item['source']}，日期：{news_item['ctime']}。"
-#     last_tool = {
-#         "name": "news",
-#         "parameters": {"topic": topic},
-#         "response": tool_response,
-#     }
-#     tool_calls += 1
-#     return answer, last_tool
-
-# ROUTES =  [
-#     ("天气", "weather", handle_weather_tool),
-#     ("新闻", "news", handle_news_tool),
-# ]
-
-def handle_message(
-    session_id: str, message: str, output_format: str = "text", state_store=_default_store
-) -> ChatResponse:
-    logger.info(f"开始处理会话 {session_id} 的消息：{message}")
-    # 获取当前会话状态
-    state = state_store.get_state(session_id)
+# 系统消息，设定助手角色
+SYSTEM_PROMPT = (
+    "你是中文问答助手。涉及天气或新闻查询时必须调用对应工具获取结果，"
+    "不要凭空编造。其他问题直接回答。"
+)
 
-    # 消息记录
-    messages = state.get("messages", [])
-    # 工具调用次数计数
-    # tool_calls = state.get("tool_calls", 0)
 
-    # 可用工具列表
-    tools = list_tools()
+async def _execute_tool_call(
+    call: Dict[str, Any], tools: Dict[str, Tool], semaphore: asyncio.Semaphore
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """执行单个工具调用，返回工具结果和耗时信息；异常转为错误结果交给 LLM 解释"""
+    tool_name = call["name"]
+    async with semaphore:
+        start = time.perf_counter()
+        tool = tools.get(tool_name)
+        if tool is None:
+            tool_result = {"error": f"未知工具：{tool_name}"}
+        else:
+            try:
+                with span(f"tool.{tool_name}"):
+                    tool_result = await tool.handler(**call["args"])
+            except Exception as e:
+                logger.exception("工具 %s 执行失败", tool_name)
+                tool_result = {"error": f"工具执行失败: {str(e)}"}
+        elapsed = time.perf_counter() - start
+    TOOL_CALLS.labels(tool_name, "error" if "error" in tool_result else "ok").inc()
+    return tool_result, {
+        "tool_call_id": call["id"],
+        "name": tool_name,
+        "parameters": call["args"],
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "ok": "error" not in tool_result,
+        "stale": bool(tool_result.get("stale")),
+    }
 
-    answer = ""
-    last_tool = {}
-
-    # 路由匹配：命中即处理，否则走兜底
-    # for route_keyword, tool_name, handler in ROUTES:
-    #     if route_keyword in message and tool_name in tools:
-    #         answer, last_tool = handler(message, tools, tool_calls)
-    #         logger.info(f"会话 {session_id} 将消息路由到工具 {tool_name}，消息内容为：{message}，回答为：{answer}")
-    #         break
-    # else:
-    #     answer = "抱歉，我无法处理您的请求。"
-
-    # 路由匹配：使用 Agent 处理
-    # lc_messages = []
-    # # 转换为 LangChain 消息格式
-    # for msg in messages:
-    #     if msg["role"] == "user":
-    #         lc_messages.append(HumanMessage(content=msg["content"]))
-    #     elif msg["role"] == "assistant":
-    #         lc_messages.append(AIMessage(content=msg["content"]))
-
-    # # 将用户新消息添加到消息列表
-    # lc_messages.append(HumanMessage(content=message))
-    # # 构建并调用 Agent
-    # agent = build_agent()
-    # result = agent.invoke({"messages": lc_messages})
-    # answer = result["messages"][-1].content
-
-    # # 提取使用的工具信息
-    # for msg in reversed(result["messages"]):
-    #   tool_calls = getattr(msg, "tool_calls", None)
-    #   if tool_calls:
-    #       last = tool_calls[-1]
-    #       last_tool = {
-    #           "name": last.get("name", ""),
-    #           "parameters": last.get("args", {}),
-    #       }
-    #       break
-
-    # 使用 LLM 结合工具处理
-    llm = build_llm_with_tools()
 
-    # 系统消息，设定助手角色
-    system_message = SystemMessage(content=(
-        "你是中文问答助手。涉及天气或新闻查询时必须调用对应工具获取结果，"
-        "不要凭空编造。其他问题直接回答。"
-    ))
+@dataclass
+class TurnResult:
+    """一轮对话的处理结果"""
+    answer: str
+    last_tool: Dict[str, Any] = field(default_factory=dict)
+    tool_timings: List[Dict[str, Any]] = field(default_factory=list)
+    tool_wall_time: float = 0.0
+    # 按模板渲染回答时保留工具的原始结果，json 输出中一并返回
+    tool_results: List[Dict[str, Any]] = field(default_factory=list)
+    # 本轮由哪条路径给出回答：llm / llm_template / fast / cache:exact
+    route: str = "llm"
+    # 快速路由给出的意图置信度，用于调整阈值
+    confidence: Optional[float] = None
+
+
+def get_default_store() -> StateStore:
+    """API 与未显式传入存储的调用共用的会话存储；配置了 REDIS_URL 时首次调用才导入 redis 客户端"""
+    global _default_store
+    if _default_store is None:
+        _default_store = StateStore(redis_url=settings.app.redis_url)
+    return _default_store
 
-    lc_messages = []
-    lc_messages.append(system_message)
-    # 转换为 LangChain 消息格式
-    for msg in messages:
+
+def get_response_cache() -> Optional["ResponseCache"]:
+    """响应缓存为可选功能，未开启时返回 None"""
+    global _response_cache
+    if _response_cache is None and settings.app.response_cache_enabled:
+        from agents.response_cache import ResponseCache
+
+        _response_cache = ResponseCache(maxsize=settings.app.response_cache_size)
+    return _response_cache
+
+
+def get_fast_router() -> Optional[FastRouter]:
+    """快速路由的城市词典来自天气工具的城市索引"""
+    global _fast_router
+    if _fast_router is None and settings.app.fast_router_enabled:
+        _fast_router = FastRouter(get_weather_tool().known_cities, settings.app.fast_router_threshold)
+    return _fast_router
+
+
+def _render_tool_results(
+    tool_calls: List[Dict[str, Any]], results: List[Dict[str, Any]], tools: Dict[str, Tool]
+) -> Optional[str]:
+    """本轮工具都执行成功且都提供了模板时直接渲染回答，否则返回 None 交给 LLM 组织语言"""
+    parts = []
+    for call, result in zip(tool_calls, results):
+        tool = tools.get(call["name"])
+        if tool is None or tool.renderer is None or "error" in result:
+            return None
+        parts.append(tool.renderer(result))
+    return "\n".join(parts)
+
+
+async def _answer_with_fast_path(session_id: str, intent: Intent, tools: Dict[str, Tool]) -> Optional[TurnResult]:
+    """直接执行意图对应的工具并按模板回答；工具没有模板或出错时返回 None，交给 LLM"""
+    tool = tools.get(intent.tool)
+    if tool is None or tool.renderer is None:
+        return None
+    call = {"id": f"fast_{intent.tool}", "name": intent.tool, "args": intent.args}
+    start = time.perf_counter()
+    tool_result, timing = await _execute_tool_call(call, tools, asyncio.Semaphore(1))
+    if not timing["ok"]:
+        logger.warning("会话 %s 快速路由调用工具 %s 失败，回退到 LLM：%s", session_id, intent.tool, tool_result)
+        return None
+    logger.info("会话 %s 快速路由直接调用工具 %s，参数：%s", session_id, intent.tool, intent.args)
+    return TurnResult(
+        answer=tool.renderer(tool_result),
+        last_tool={"name": intent.tool, "parameters": intent.args},
+        tool_timings=[timing],
+        tool_wall_time=time.perf_counter() - start,
+        tool_results=[tool_result],
+        route="fast",
+        confidence=intent.confidence,
+    )
+
+def _use_cache(state: Dict[str, Any], metadata: Dict[str, Any]) -> bool:
+    """响应缓存只用于无上下文的一次性问题，metadata 中 cache=False 可跳过"""
+    return (
+        get_response_cache() is not None
+        and metadata.get("cache", True)
+        and (not state.get("messages") or metadata.get("stateless", False))
+    )
+
+
+async def _answer_without_llm(
+    session_id: str, message: str, state: Dict[str, Any], metadata: Dict[str, Any], tools: Dict[str, Tool]
+) -> Tuple[bool, Optional[TurnResult]]:
+    """
+    /chat 与 /chat/stream 共用的免 LLM 路径：先查响应缓存，再尝试快速路由。
+    返回 (本轮是否使用响应缓存, 回答)，回答为 None 时交给 LLM
+    """
+    use_cache = _use_cache(state, metadata)
+    if use_cache:
+        with span("cache.lookup"):
+            cached, tier = get_response_cache().get(message)
+        if cached is not None:
+            logger.info("会话 %s 命中响应缓存(%s)", session_id, tier)
+            return use_cache, TurnResult(answer=cached.answer, last_tool=dict(cached.last_tool), route=f"cache:{tier}")
+
+    # 明显的单工具意图直接调用工具，metadata 中 fast_path=False 可跳过
+    router = get_fast_router()
+    if router is not None and metadata.get("fast_path", True):
+        with span("fast_route"):
+            intent = router.route(message)
+        if intent is not None:
+            return use_cache, await _answer_with_fast_path(session_id, intent, tools)
+    return use_cache, None
+
+
+def _cache_answer(message: str, turn: TurnResult) -> None:
+    """工具出错或返回陈旧数据的回答不缓存"""
+    if all(timing["ok"] and not timing["stale"] for timing in turn.tool_timings):
+        get_response_cache().put(message, turn.answer, turn.last_tool, [timing["name"] for timing in turn.tool_timings])
+
+
+def _build_lc_messages(context: Context, message: str) -> List[Any]:
+    """把上下文窗口(摘要 + 最近消息)和新消息转换为 LangChain 消息格式"""
+    from langchain.messages import AIMessage, HumanMessage, SystemMessage
+
+    lc_messages: List[Any] = [SystemMessage(content=SYSTEM_PROMPT)]
+    if context.summary:
+        lc_messages.append(SystemMessage(content=f"之前对话的摘要：{context.summary}"))
+    for msg in context.recent:
         if msg["role"] == "user":
             lc_messages.append(HumanMessage(content=msg["content"]))
         elif msg["role"] == "assistant":
@@ -141,59 +192,209 @@ def handle_message(
 
     # 将用户新消息添加到消息列表
     lc_messages.append(HumanMessage(content=message))
-    # 调用 LLM 处理
-    result = llm.invoke(lc_messages)
-    tool_calls = getattr(result, "tool_calls", None)
-    if not tool_calls:
-        logger.info(f"会话 {session_id} LLM 无需调用工具，直接回答。")
-        answer = result.content
-        last_tool = {}
-    else:
-        # 提取本次对话需要用的工具
-        call = tool_calls[0]
-        tool_name =  call["name"]
-        tool_args = call["args"]
-        tool_result = tools[tool_name].handler(**tool_args)
-        logger.info(f"会话 {session_id} LLM 调用工具 {tool_name}，参数：{tool_args}，结果：{tool_result}")
-
-        # 把工具结果传给 LLM 生成最终回答
-        lc_messages.append(AIMessage(content=result.content))
-        lc_messages.append(ToolMessage(
-            tool_name=tool_name,
-            content=json.dumps(tool_result),
+    return lc_messages
+
+
+async def _run_tool_round(
+    session_id: str, tool_calls: List[Dict[str, Any]], tools: Dict[str, Tool], semaphore: asyncio.Semaphore
+) -> Tuple[List["ToolMessage"], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """并发执行一轮工具调用，按 tool_call_id 一一返回 ToolMessage、耗时与原始结果"""
+    from langchain.messages import ToolMessage
+
+    outcomes = await asyncio.gather(*(
+        _execute_tool_call(call, tools, semaphore) for call in tool_calls
+    ))
+    tool_messages = []
+    timings = []
+    results = []
+    for call, (tool_result, timing) in zip(tool_calls, outcomes):
+        logger.info("会话 %s LLM 调用工具 %s，参数：%s，结果：%s", session_id, call['name'], call['args'], tool_result)
+        tool_messages.append(ToolMessage(
+            name=call["name"],
+            content=json.dumps(tool_result, ensure_ascii=False),
             tool_call_id=call["id"],
         ))
+        timings.append(timing)
+        results.append(tool_result)
+    return tool_messages, timings, results
 
-        final_result = llm.invoke(lc_messages)
-        answer = final_result.content
-        last_tool = {
-            "name": tool_name,
-            "parameters": tool_args,
-        }
+
+async def _save_turn(
+    state_store: StateStore,
+    session_id: str,
+    state: Dict[str, Any],
+    context: Optional[Context],
+    message: str,
+    answer: str,
+    last_tool: Dict[str, Any],
+) -> Dict[str, Any]:
+    """把本轮问答写入会话状态，返回新状态；未经过 LLM 的回答没有上下文(context 为 None)"""
+    # 更新消息记录
+    turn = [
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": answer},
+    ]
+    logger.debug("会话 %s 更新消息记录：%s", session_id, turn)
+    max_history = settings.app.max_conversation_history
+    messages = state.get("messages", [])
+
+    # 标量状态：摘要字段只在窗口滑动时变化；累计消息数由存储层原子递增
+    fields = {"last_tool": last_tool}
+    if context is not None:
+        fields.update(context.updates)
+
+    # 更新状态，保持消息记录在最大限制内
+    new_state = dict(state)
+    new_state.update(fields)
+    new_state["messages"] = (messages + turn)[-max_history:]
+    # 只追加本轮消息，存储层负责截断到最大条数；带上读取时的版本号检测并发写入。
+    # 版本号、累计消息数与更新时间以写入后的值为准
+    new_state.update(await state_store.append_turn(
+        session_id, turn, fields, max_history, expected_version=state.get("version", 0)
+    ))
+    logger.debug("会话 %s 更新状态：%s", session_id, new_state)
+    return new_state
+
+
+def _response_state(new_state: Dict[str, Any], turn: TurnResult, include_timings: bool = False) -> Dict[str, Any]:
+    """处理路径与耗时只在响应中返回，不写入会话状态"""
+    response_state = dict(new_state)
+    response_state["route"] = turn.route
+    if turn.confidence is not None:
+        response_state["route_confidence"] = turn.confidence
+    if turn.tool_timings:
+        response_state["tool_timings"] = turn.tool_timings
+        response_state["tool_wall_time_ms"] = round(turn.tool_wall_time * 1000, 2)
+    trace = current_trace() if include_timings else None
+    if trace is not None:
+        response_state["timings"] = trace.timings()
+    return response_state
+
+
+def _last_tool(tool_calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+    last_call = tool_calls[-1]
+    return {
+        "name": last_call["name"],
+        "parameters": last_call["args"],
+    }
+
+
+async def handle_message(
+    session_id: str,
+    message: str,
+    output_format: str = "text",
+    state_store: Optional[StateStore] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    template_answer: Optional[bool] = None,
+) -> ChatResponse:
+    # 未指定时 json 输出默认按模板渲染工具结果，text 输出跟随配置
+    if template_answer is None:
+        template_answer = output_format == "json" or settings.app.template_answers
+    if state_store is None:
+        state_store = get_default_store()
+    # 同一会话的并发消息按存储的并发策略排队、拒绝或合并
+    async with state_store.session(session_id):
+        return await _handle_message(
+            session_id, message, output_format, state_store, metadata or {}, template_answer
+        )
+
+
+async def _answer_with_llm(
+    session_id: str, context: Context, message: str, tools: Dict[str, Tool], template_answer: bool = False
+) -> TurnResult:
+    """
+    使用 LLM 结合工具处理，模型可能在一次回复中请求多个工具，逐轮执行直到给出最终回答。
+    template_answer 为 True 时，工具结果都能按模板渲染就直接返回，省去第二次 LLM 调用。
+    """
+    llm = build_llm_with_tools()
+    semaphore = asyncio.Semaphore(settings.app.max_parallel_tool_calls)
+    lc_messages = _build_lc_messages(context, message)
+
+    turn = TurnResult(answer="")
+    with span("llm", iteration=0):
+        result = await llm.ainvoke(lc_messages)
+    observe_llm_usage(result)
+    iterations = 0
+    while getattr(result, "tool_calls", None) and iterations < settings.app.max_tool_iterations:
+        iterations += 1
+        # 保留带 tool_calls 的 AIMessage，后续 ToolMessage 需要与之对应
+        lc_messages.append(result)
+
+        start = time.perf_counter()
+        tool_messages, timings, results = await _run_tool_round(session_id, result.tool_calls, tools, semaphore)
+        turn.tool_wall_time += time.perf_counter() - start
+        lc_messages.extend(tool_messages)
+        turn.tool_timings.extend(timings)
+        turn.last_tool = _last_tool(result.tool_calls)
+
+        rendered = _render_tool_results(result.tool_calls, results, tools) if template_answer else None
+        if rendered is not None:
+            logger.info("会话 %s 工具结果按模板渲染，跳过 LLM 组织回答", session_id)
+            turn.answer = rendered
+            turn.tool_results = results
+            turn.route = "llm_template"
+            return turn
+
+        # 把工具结果传给 LLM，生成最终回答或继续请求工具
+        with span("llm", iteration=iterations):
+            result = await llm.ainvoke(lc_messages)
+        observe_llm_usage(result)
+
+    if getattr(result, "tool_calls", None):
+        # 达到最大轮数仍在请求工具，改用不绑定工具的模型强制给出回答
+        logger.warning("会话 %s 工具调用达到最大轮数 %s", session_id, settings.app.max_tool_iterations)
+        with span("llm", iteration=iterations, forced=True):
+            result = await model_registry.get_llm(DEFAULT_MODEL).ainvoke(lc_messages)
+        observe_llm_usage(result)
+
+    if not turn.tool_timings:
+        logger.info("会话 %s LLM 无需调用工具，直接回答。", session_id)
+    answer = result.content
 
     # 确保 answer 是字符串类型
     if not isinstance(answer, str):
         answer = str(answer)
+    turn.answer = answer
+    return turn
 
-    # 更新消息记录
-    messages.append({"role": "user", "content": message})
-    messages.append({"role": "assistant", "content": answer})
-    logger.info(f"会话 {session_id} 更新消息记录：{messages[-2:]}")
-
-    # 保持消息记录在最大限制内
-    messages = messages[-MAX_HISTORY:]
-
-    # 更新状态
-    new_state = {
-        "messages": messages,
-        "last_tool": last_tool,
-        # "tool_calls": tool_calls,
-    }
-    state_store.set_state(session_id, new_state)
-    logger.info(f"会话 {session_id} 更新状态：{new_state}")
+
+async def _handle_message(
+    session_id: str,
+    message: str,
+    output_format: str,
+    state_store: StateStore,
+    metadata: Dict[str, Any],
+    template_answer: bool,
+) -> ChatResponse:
+    logger.info("开始处理会话 %s 的消息：%s", session_id, message)
+    # 获取当前会话状态
+    state = await state_store.get_state(session_id)
+    # 可用工具列表
+    tools = list_tools()
+
+    use_cache, turn = await _answer_without_llm(session_id, message, state, metadata, tools)
+
+    context = None
+    if turn is None:
+        # 按 token 预算截取上下文，旧消息折叠进摘要；只在需要调用 LLM 时构建，
+        # 命中缓存或快速路由的回答不会触发摘要模型调用
+        with span("context"):
+            context = await get_context_window().build(state)
+        turn = await _answer_with_llm(session_id, context, message, tools, template_answer)
+        if use_cache:
+            _cache_answer(message, turn)
+
+    answer = turn.answer
+    last_tool = turn.last_tool
+    new_state = await _save_turn(state_store, session_id, state, context, message, answer, last_tool)
+    # metadata 中 timings=True 时返回本次请求各阶段的耗时明细
+    response_state = _response_state(new_state, turn, metadata.get("timings", settings.app.trace_include_timings))
 
     if output_format == "json":
-        answer = json.dumps({"text": answer, "state": new_state})
+        payload: Dict[str, Any] = {"text": answer, "state": response_state}
+        if turn.tool_results:
+            payload["tool_results"] = turn.tool_results
+        answer = json.dumps(payload)
 
     # 构建响应
     response = ChatResponse(
@@ -202,7 +403,126 @@ def handle_message(
         tool_used=ToolCall(
             tool_name=last_tool["name"], parameters=last_tool["parameters"]
         ) if last_tool else None,
-        state=new_state,
+        state=response_state,
     )
 
     return response
+
+
+async def _stream_with_llm(
+    session_id: str,
+    context: Context,
+    message: str,
+    tools: Dict[str, Tool],
+    turn: TurnResult,
+    template_answer: bool = False,
+) -> AsyncIterator[Dict[str, Any]]:
+    """流式调用 LLM 并执行其请求的工具，产出事件的同时把结果写入 turn"""
+    from langchain.messages import AIMessage
+
+    llm = build_llm_with_tools()
+    semaphore = asyncio.Semaphore(settings.app.max_parallel_tool_calls)
+    lc_messages = _build_lc_messages(context, message)
+
+    answer_parts: List[str] = []
+    iterations = 0
+    while True:
+        # 达到最大轮数后改用不绑定工具的模型，强制给出回答
+        forced = iterations >= settings.app.max_tool_iterations
+        stream_llm = model_registry.get_llm(DEFAULT_MODEL) if forced else llm
+
+        gathered = None
+        # 生成器在 yield 处挂起，span 记录的是包含客户端消费时间在内的整段流式耗时
+        with span("llm.stream", iteration=iterations):
+            async for chunk in stream_llm.astream(lc_messages):
+                gathered = chunk if gathered is None else gathered + chunk
+                # 工具调用阶段的分片不作为回答输出
+                if isinstance(chunk.content, str) and chunk.content and not gathered.tool_call_chunks:
+                    answer_parts.append(chunk.content)
+                    yield {"event": "token", "data": {"content": chunk.content}}
+
+        observe_llm_usage(gathered)
+        tool_calls = [] if forced or gathered is None else gathered.tool_calls
+        if not tool_calls:
+            break
+
+        iterations += 1
+        for call in tool_calls:
+            yield {"event": "tool_call", "data": {"tool_call_id": call["id"], "name": call["name"], "parameters": call["args"]}}
+
+        lc_messages.append(AIMessage(content=gathered.content, tool_calls=tool_calls))
+        start = time.perf_counter()
+        tool_messages, timings, results = await _run_tool_round(session_id, tool_calls, tools, semaphore)
+        turn.tool_wall_time += time.perf_counter() - start
+        lc_messages.extend(tool_messages)
+        turn.tool_timings.extend(timings)
+        turn.last_tool = _last_tool(tool_calls)
+        for timing in timings:
+            yield {"event": "tool_result", "data": timing}
+
+        rendered = _render_tool_results(tool_calls, results, tools) if template_answer else None
+        if rendered is not None:
+            answer_parts.append(rendered)
+            turn.tool_results = results
+            turn.route = "llm_template"
+            yield {"event": "token", "data": {"content": rendered}}
+            break
+
+    turn.answer = "".join(answer_parts)
+
+
+async def stream_message(
+    session_id: str,
+    message: str,
+    state_store: Optional[StateStore] = None,
+    template_answer: Optional[bool] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    流式处理消息，依次产出事件：
+    - tool_call: 模型请求的工具及参数
+    - tool_result: 工具执行耗时
+    - token: 回答的增量文本
+    - done: 完整回答与会话状态
+
+    只有正常结束时才写入会话状态；调用方提前关闭生成器(如客户端断开)时，
+    正在进行的上游流式请求随之取消，本轮不落库。
+    metadata 的 cache / stateless / fast_path / timings 开关与 handle_message 一致。
+    """
+    metadata = metadata or {}
+    if state_store is None:
+        state_store = get_default_store()
+    async with state_store.session(session_id):
+        logger.info("开始流式处理会话 %s 的消息：%s", session_id, message)
+        state = await state_store.get_state(session_id)
+        tools = list_tools()
+
+        use_cache, turn = await _answer_without_llm(session_id, message, state, metadata, tools)
+        if turn is not None:
+            for timing in turn.tool_timings:
+                yield {"event": "tool_call", "data": {"tool_call_id": timing["tool_call_id"], "name": timing["name"], "parameters": timing["parameters"]}}
+                yield {"event": "tool_result", "data": timing}
+            yield {"event": "token", "data": {"content": turn.answer}}
+        context = None
+        if turn is None:
+            with span("context"):
+                context = await get_context_window().build(state)
+            turn = TurnResult(answer="")
+            if template_answer is None:
+                template_answer = settings.app.template_answers
+            async for event in _stream_with_llm(session_id, context, message, tools, turn, template_answer):
+                yield event
+            if use_cache:
+                _cache_answer(message, turn)
+
+        last_tool = turn.last_tool
+        new_state = await _save_turn(state_store, session_id, state, context, message, turn.answer, last_tool)
+        yield {
+            "event": "done",
+            "data": {
+                "session_id": session_id,
+                "answer": turn.answer,
+                "tool_used": {"tool_name": last_tool["name"], "parameters": last_tool["parameters"]} if last_tool else None,
+                "state": _response_state(new_state, turn, metadata.get("timings", settings.app.trace_include_timings)),
+            },
+        }
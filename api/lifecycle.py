@@ -0,0 +1,145 @@
+"""
+服务生命周期：启动预热与优雅停机
+
+- 预热(lifespan 启动阶段，完成后 uvicorn 才开始处理请求)：
+  1. 检查会话存储后端的连通性
+  2. 导入推迟到首次使用的重依赖(LangChain、langchain_openai)，在线程中执行
+  3. 构建 LLM 实例与工具绑定，加载 tiktoken 词表、快速路由词典与响应缓存
+  4. 可选(WARMUP_UPSTREAM)：为 LLM 与各工具上游各建立若干条连接放入共享连接池，首批请求不再承担 DNS/TCP/TLS 握手；
+     会向上游发送 HEAD 请求，默认关闭
+  每一步失败只记录日志，不阻止服务启动；整体耗时不超过 WARMUP_TIMEOUT
+- 停机：收到 SIGTERM/SIGINT 后标记为 draining，/ready 返回 503 以便负载均衡摘除本实例；
+  uvicorn 停止接受新连接，等待进行中的请求(含 LLM 调用与流式响应)完成，
+  最长 SERVER_GRACEFUL_TIMEOUT 秒，之后 lifespan 关闭会话存储与连接池
+"""
+import asyncio
+import importlib
+import signal
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+import httpx
+
+from config.settings import settings
+from state.store import StateStore
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 导入 api.main 时不加载的模块，预热时提前导入，首个请求不再承担导入耗时
+LAZY_MODULES = ("langchain_openai", "langchain.messages", "tools.lc_tools", "agents.response_cache")
+
+
+class Lifecycle:
+    def __init__(self) -> None:
+        self.ready = False
+        self.draining = False
+        self.warmup: Dict[str, Any] = {}
+
+    def status(self) -> Dict[str, Any]:
+        return {"ready": self.ready and not self.draining, "draining": self.draining, "warmup": self.warmup}
+
+
+lifecycle = Lifecycle()
+
+
+async def _open_connections(client: httpx.AsyncClient, url: str, count: int) -> None:
+    """并发发出 count 个轻量请求，让连接池中保持 count 条已建立的连接；响应状态码无关紧要"""
+    async def touch() -> None:
+        try:
+            await client.head(url)
+        except httpx.HTTPError as e:
+            logger.warning("预热连接 %s 失败：%s", url, e)
+
+    await asyncio.gather(*(touch() for _ in range(count)))
+
+
+async def _warm_imports() -> None:
+    for module in LAZY_MODULES:
+        await asyncio.to_thread(importlib.import_module, module)
+
+
+async def _warm_llm() -> None:
+    from agents.agent import build_llm_with_tools
+
+    build_llm_with_tools()
+
+
+async def _warm_upstreams(count: int) -> None:
+    from utils.http_client import get_http_client
+
+    # LLM 与工具共用 utils.http_client 按上游主机划分的连接池
+    api = settings.api
+    for base_url in (api.openrouter_base_url, api.qweather_base_url, api.tian_api_base_url):
+        await _open_connections(get_http_client(base_url), base_url, count)
+
+
+async def _warm_local() -> None:
+    from agents.context import count_tokens
+    from agents.route import get_fast_router, get_response_cache
+
+    count_tokens("预热")
+    router = get_fast_router()
+    if router is not None:
+        router.match("北京天气")
+    get_response_cache()
+
+
+async def warm_up(state_store: StateStore) -> Dict[str, Any]:
+    """依次执行各预热步骤，返回每一步的耗时与结果"""
+    app = settings.app
+    count = app.warmup_connections
+    steps: List[tuple] = [
+        ("store", lambda: state_store.ping()),
+        ("imports", _warm_imports),
+        ("local", _warm_local),
+        ("llm", _warm_llm),
+    ]
+    if app.warmup_upstream:
+        steps.append(("upstreams", lambda: _warm_upstreams(count)))
+    report: Dict[str, Any] = {}
+    deadline = time.monotonic() + app.warmup_timeout
+    for name, step in steps:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            report[name] = {"ok": False, "error": "timeout"}
+            continue
+        report[name] = await _run_step(name, step, remaining)
+    logger.info("预热完成：%s", report)
+    return report
+
+
+async def _run_step(name: str, step: Callable[[], Awaitable[Any]], timeout: float) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(step(), timeout)
+        ok = result is not False
+        error = None if ok else "unavailable"
+    except Exception as e:
+        logger.warning("预热步骤 %s 失败：%r", name, e)
+        ok, error = False, type(e).__name__
+    entry: Dict[str, Any] = {"ok": ok, "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)}
+    if error:
+        entry["error"] = error
+    return entry
+
+
+def install_drain_handler() -> None:
+    """
+    在 uvicorn 的信号处理之前标记 draining；
+    需在 lifespan 启动阶段调用，此时 uvicorn 已安装自己的处理函数
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        previous = signal.getsignal(sig)
+
+        def handler(signum: int, frame: Any, previous: Any = previous) -> None:
+            if not lifecycle.draining:
+                logger.info("收到信号 %s，停止接收新请求，等待进行中的请求完成", signal.Signals(signum).name)
+            lifecycle.draining = True
+            if callable(previous):
+                previous(signum, frame)
+
+        signal.signal(sig, handler)
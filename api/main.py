@@ -1,36 +1,305 @@
-from fastapi import FastAPI
-from typing import Dict, Any
-from state.store import StateStore
-from agents.route import handle_message
-from schemas.chat import ChatResponse, ChatRequest, HistoryResponse
-from utils.logger import get_logger
-
-state_store = StateStore()
+import hashlib
+import json
+import math
+import time
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Dict, Any, Optional
+from config.settings import settings
+from state.store import HistoryPage, SessionConflictError
+from agents.route import get_default_store, get_fast_router, get_response_cache, handle_message, stream_message
+from agents.batch import parse_item, run_batch
+from agents.admission import AdmissionRejected, admit, get_admission_controller
+from api.lifecycle import install_drain_handler, lifecycle, warm_up
+from agents.agent import model_registry
+from tools.registry import tool_stats
+from schemas.chat import BatchChatRequest, ChatResponse, ChatRequest, HistoryResponse
+from utils.logger import get_logger, logging_stats, stop_logging
+from utils.http_client import close_http_clients
+from tools.rate_limit import close_rate_limiters
+from utils.tracing import FileSpanExporter, TracingMiddleware
+from utils import metrics
+
 logger = get_logger(__name__)
+trace_exporter = (
+    FileSpanExporter(settings.app.trace_export_path, settings.app.app_name)
+    if settings.app.tracing_enabled and settings.app.trace_export_path
+    else None
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 会话存储在首次使用时创建，导入 api.main 时不加载 redis 客户端
+    state_store = get_default_store()
+    # 预热完成后 uvicorn 才开始处理请求；预热包含会话存储连通性检查
+    if settings.app.warmup_enabled:
+        lifecycle.warmup = await warm_up(state_store)
+        store_ok = lifecycle.warmup["store"]["ok"]
+    else:
+        store_ok = await state_store.ping()
+    if not store_ok:
+        logger.error("会话存储不可用，将在请求时按退避策略重连")
+    state_store.start_sweeper()
+    install_drain_handler()
+    lifecycle.ready = True
+    yield
+    # uvicorn 已等待进行中的请求完成(最长 SERVER_GRACEFUL_TIMEOUT 秒)，再释放共享资源
+    lifecycle.ready = False
+    logger.info("进行中的请求已处理完毕，关闭会话存储与连接池")
+    await state_store.close()
+    # 关闭上游共享连接池
+    await close_http_clients()
+    # 已构建的模型持有关闭的连接池，再次启动时重新构建
+    model_registry.clear()
+    await close_rate_limiters()
+    if trace_exporter is not None:
+        trace_exporter.shutdown()
+    metrics.mark_process_dead()
+    # uvicorn 排空后会以默认处理函数重新触发 SIGTERM，进程直接退出不执行 atexit，这里先写完队列中的日志
+    stop_logging()
+
 
 app = FastAPI(
     title="AI 助手 API",
     description="这是一个基于 FastAPI 的 AI 助手服务，支持聊天和工具调用。",
     version="1.0.0",
+    lifespan=lifespan,
 )
+if settings.app.tracing_enabled:
+    app.add_middleware(TracingMiddleware, exporter=trace_exporter)
+
+@app.exception_handler(SessionConflictError)
+async def session_conflict_handler(request: Request, exc: SessionConflictError) -> JSONResponse:
+    # reject 策略下同一会话并发请求返回 409，由客户端决定是否重试
+    logger.warning("会话并发冲突：%s", exc)
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected) -> JSONResponse:
+    # 过载时尽早拒绝，客户端按 Retry-After 退避重试
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "reason": exc.reason},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
 
 @app.get("/")
 async def read_root():
     logger.info("健康检查请求")
     return {"Hello": "World"}
 
+@app.get("/health")
+async def health_endpoint() -> Dict[str, Any]:
+    """健康检查：包含会话存储后端的连通性"""
+    store_ok = await get_default_store().ping()
+    return {"status": "ok" if store_ok else "degraded", "store": store_ok}
+
+@app.get("/ready")
+async def ready_endpoint() -> JSONResponse:
+    """就绪检查：预热完成前与停机排空期间返回 503，供负载均衡摘除实例"""
+    status = lifecycle.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/stats")
+async def stats_endpoint() -> Dict[str, Any]:
+    """运行时统计：会话存储、模型注册表、工具缓存、快速路由、响应缓存、准入控制与日志队列"""
+    response_cache = get_response_cache()
+    fast_router = get_fast_router()
+    admission = get_admission_controller()
+    return {
+        "store": get_default_store().stats(),
+        "models": model_registry.stats(),
+        "tools": tool_stats(),
+        "router": fast_router.stats() if fast_router else None,
+        "response_cache": response_cache.stats() if response_cache else None,
+        "admission": admission.stats() if admission else None,
+        "logging": logging_stats(),
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint() -> Response:
+    """Prometheus 指标；多 worker 部署时需设置 PROMETHEUS_MULTIPROC_DIR"""
+    if not metrics.PROMETHEUS_AVAILABLE:
+        return Response("prometheus_client 未安装\n", status_code=503, media_type="text/plain")
+    body, content_type = metrics.render_metrics()
+    return Response(body, media_type=content_type)
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest) -> ChatResponse:
     logger.info("收到聊天请求")
     session_id = request.session_id
     message = request.message
     output_format = request.output_format or "text"
-    response = handle_message(session_id, message, output_format, state_store)
-    return response
+    # 超过并发上限时排队，排不上返回 429
+    slot = await admit(session_id)
+    metrics.REQUESTS_IN_FLIGHT.labels("chat").inc()
+    start = time.perf_counter()
+    route = "error"
+    try:
+        response = await handle_message(
+            session_id, message, output_format, get_default_store(), request.metadata, request.template_answer
+        )
+        route = response.state.get("route", "llm")
+        return response
+    finally:
+        slot.release()
+        metrics.REQUESTS_IN_FLIGHT.labels("chat").dec()
+        metrics.REQUEST_LATENCY.labels("chat", route).observe(time.perf_counter() - start)
+
+def _format_sse(event: str, data: Any) -> str:
+    """按 Server-Sent Events 格式编码单个事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, raw_request: Request) -> StreamingResponse:
+    logger.info("收到流式聊天请求")
+    # 在返回响应前获取名额，排不上时仍能返回 429 状态码；名额在流结束时归还
+    slot = await admit(request.session_id)
 
-@app.get("/history/{session_id}", response_model=HistoryResponse)
-async def get_history(session_id: str) -> HistoryResponse:
+    async def event_source():
+        events = stream_message(
+            request.session_id, request.message, get_default_store(), request.template_answer, request.metadata
+        )
+        metrics.REQUESTS_IN_FLIGHT.labels("chat_stream").inc()
+        start = time.perf_counter()
+        route = "error"
+        try:
+            async for event in events:
+                # 客户端断开后停止迭代，关闭生成器会取消上游 LLM 调用
+                if await raw_request.is_disconnected():
+                    logger.info("会话 %s 客户端已断开，取消流式请求", request.session_id)
+                    route = "disconnected"
+                    break
+                if event["event"] == "done":
+                    route = event["data"]["state"].get("route", "llm")
+                yield _format_sse(event["event"], event["data"])
+        except SessionConflictError as e:
+            yield _format_sse("error", {"code": 409, "message": str(e)})
+        except Exception as e:
+            logger.exception("会话 %s 流式处理失败", request.session_id)
+            yield _format_sse("error", {"code": 500, "message": str(e)})
+        finally:
+            await events.aclose()
+            slot.release()
+            metrics.REQUESTS_IN_FLIGHT.labels("chat_stream").dec()
+            metrics.REQUEST_LATENCY.labels("chat_stream", route).observe(time.perf_counter() - start)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # 生成器未开始迭代时客户端就断开的情况下，由后台任务归还名额(release 可重复调用)
+        background=BackgroundTask(slot.release),
+    )
+
+# 按行分隔的 JSON 请求体，每行一条请求
+JSONL_CONTENT_TYPES = {"application/x-ndjson", "application/jsonl", "application/x-jsonlines", "application/json-lines"}
+
+@app.post(
+    "/chat/batch",
+    openapi_extra={"requestBody": {"content": {
+        "application/json": {"schema": BatchChatRequest.model_json_schema()},
+        "application/x-ndjson": {"schema": {"type": "string", "description": "每行一条 BatchChatItem"}},
+    }}},
+)
+async def chat_batch_endpoint(raw_request: Request, concurrency: Optional[int] = None) -> Response:
+    """
+    批量聊天：请求体为 JSON({"requests": [...], "concurrency": n} 或数组)，
+    或 Content-Type 为 application/x-ndjson 的 JSONL；结果按完成顺序以 NDJSON 流式返回，最后一行为汇总
+    """
+    batch_id = uuid.uuid4().hex[:12]
+    body = await raw_request.body()
+    content_type = raw_request.headers.get("content-type", "").split(";")[0].strip().lower()
+    items = []
+    try:
+        if content_type in JSONL_CONTENT_TYPES:
+            for line in body.decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    items.append(parse_item(json.loads(line), batch_id, len(items)))
+                except ValueError as e:
+                    items.append(f"JSON 解析失败: {e}")
+        else:
+            data = json.loads(body)
+            if isinstance(data, dict):
+                concurrency = concurrency or data.get("concurrency")
+                data = data.get("requests")
+            if not isinstance(data, list):
+                return JSONResponse(status_code=422, content={"detail": "请求体必须是 {\"requests\": [...]} 或数组"})
+            items = [parse_item(entry, batch_id, i) for i, entry in enumerate(data)]
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={"detail": f"请求体解析失败: {e}"})
+
+    limit = settings.app.batch_max_size
+    if len(items) > limit:
+        return JSONResponse(status_code=413, content={"detail": f"单个批次最多 {limit} 条请求"})
+    if not isinstance(concurrency, int) or concurrency <= 0:
+        concurrency = settings.app.batch_concurrency
+    concurrency = min(concurrency, settings.app.batch_concurrency)
+    logger.info("收到批量聊天请求 %s：%d 条，并发 %d", batch_id, len(items), concurrency)
+
+    async def result_lines():
+        metrics.REQUESTS_IN_FLIGHT.labels("chat_batch").inc()
+        try:
+            async for result in run_batch(items, concurrency, get_default_store(), batch_id):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.labels("chat_batch").dec()
+
+    return StreamingResponse(
+        result_lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-ID": batch_id, "X-Accel-Buffering": "no"},
+    )
+
+def _history_etag(page: HistoryPage, limit: int, cursor: Optional[int], since: Optional[int]) -> str:
+    """同一会话不同页的内容不同，ETag 同时包含会话版本、更新时间与归一化后的分页参数"""
+    digest = hashlib.sha1(f"{limit}:{cursor}:{since}".encode()).hexdigest()[:12]
+    return f'"{page.version}-{page.updated_at}-{digest}"'
+
+def _etag_matches(if_none_match: str, etag: str, exists: bool) -> bool:
+    """If-None-Match 按弱比较匹配(忽略 W/ 前缀)；* 只匹配存在的会话"""
+    if if_none_match.strip() == "*":
+        return exists
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+@app.get("/history/{session_id}", response_model=HistoryResponse, responses={304: {"description": "历史记录未变化"}})
+async def get_history(
+    session_id: str,
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(default=None, ge=1, description="每页消息数，默认 HISTORY_PAGE_SIZE"),
+    cursor: Optional[int] = Query(default=None, ge=0, description="返回绝对序号小于 cursor 的最近消息(向前翻页)"),
+    since: Optional[int] = Query(default=None, ge=0, description="返回绝对序号不小于 since 的消息(轮询新消息)"),
+):
+    """
+    分页获取会话历史
+
+    消息按绝对序号定位，不受早期消息被截断的影响：不带参数返回最近一页，
+    cursor 向前翻页，since 只取新消息。ETag 由会话版本号、更新时间与分页参数生成，
+    If-None-Match 匹配时返回 304，轮询的客户端无需重复下载未变化的历史。
+    """
     logger.info("收到历史记录请求")
-    state = state_store.get_state(session_id)
-    messages = state.get("messages", [])
-    return HistoryResponse(session_id=session_id, messages=messages)
+    if cursor is not None and since is not None:
+        return JSONResponse(status_code=422, content={"detail": "cursor 与 since 不能同时指定"})
+    limit = min(limit or settings.app.history_page_size, settings.app.history_max_page_size)
+    page = await get_default_store().get_history(session_id, limit, since=since, before=cursor)
+
+    etag = _history_etag(page, limit, cursor, since)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match", ""), etag, page.exists):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return HistoryResponse(
+        session_id=session_id,
+        messages=page.messages,
+        offset=page.offset,
+        total=page.total,
+        next_cursor=page.offset if page.offset > page.first else None,
+        next_since=page.offset + len(page.messages),
+    )
@@ -0,0 +1,180 @@
+"""
+准入控制压测
+
+桩服务模拟处理能力有限的 LLM 提供方(STUB_LLM_CONCURRENCY 个请求同时处理，其余排队)，
+应用通过 ASGITransport 在进程内调用，客户端超时 5 秒，对比：
+
+1. 不做准入控制：突发请求全部进入应用，在提供方排队，延迟随排队线性增长，大量请求超时
+2. 准入控制：超出的请求在入口排队或立即返回 429(带 Retry-After)，被接纳的请求延迟有界
+3. 会话公平：一个会话连发大量消息时，其他会话的请求不受影响
+4. 批量请求：多个 /chat/batch 同时运行时，批量条目同样受并发上限约束，被拒绝的条目退避重试后完成
+
+检查预期行为，不符合时以非 0 状态码退出。
+
+运行：python -m benchmarks.bench_admission [突发请求数]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+os.environ.setdefault("STUB_LLM_LATENCY", "0.2")
+os.environ.setdefault("STUB_LLM_CONCURRENCY", "8")
+
+from benchmarks.stub_server import configure_env, start_stub_server  # noqa: E402
+
+configure_env()
+
+import httpx  # noqa: E402
+
+from agents import admission  # noqa: E402
+from agents.admission import AdmissionController  # noqa: E402
+from api.main import app  # noqa: E402
+from config.settings import settings  # noqa: E402
+from utils.tracing import add_span_listener  # noqa: E402
+
+CLIENT_TIMEOUT = 5.0
+failures: List[str] = []
+
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        failures.append(message)
+
+
+async def use_admission(client: httpx.AsyncClient, enabled: bool, **overrides: Any) -> None:
+    """切换准入控制；开启时先以低负载发几个请求，让控制器学到无排队时的 LLM 耗时与处理耗时"""
+    settings.app.admission_enabled = enabled
+    admission._controller = None
+    if enabled:
+        options: Dict[str, Any] = dict(
+            initial_limit=32, min_limit=4, max_limit=128, queue_size=64, queue_timeout=2.0,
+            session_limit=2, session_queue=4, latency_tolerance=2.0,
+        )
+        options.update(overrides)
+        admission._controller = AdmissionController(**options)
+        add_span_listener(admission._controller.observe_span)
+        for i in range(5):
+            await send(client, f"warm-{i}", "介绍一下你自己")
+
+
+async def send(client: httpx.AsyncClient, session_id: str, message: str) -> Tuple[int, float, str]:
+    start = time.perf_counter()
+    try:
+        # ASGITransport 不执行 httpx 的超时设置，在客户端按超时放弃等待
+        response = await asyncio.wait_for(
+            client.post("/chat", json={"session_id": session_id, "message": message}), CLIENT_TIMEOUT
+        )
+        status, retry_after = response.status_code, response.headers.get("retry-after", "")
+    except asyncio.TimeoutError:
+        status, retry_after = 0, ""
+    return status, time.perf_counter() - start, retry_after
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)] * 1000
+
+
+def report(name: str, results: List[Tuple[int, float, str]], elapsed: float) -> Dict[str, Any]:
+    ok = [latency for status, latency, _ in results if status == 200]
+    shed = [latency for status, latency, _ in results if status == 429]
+    timeouts = sum(1 for status, _, _ in results if status == 0)
+    print(
+        f"{name:<18} | 请求 {len(results):>4} | 成功 {len(ok):>4} | 429 {len(shed):>4} | 超时 {timeouts:>4} | "
+        f"成功 p50 {percentile(ok, 0.5):7.1f}ms p99 {percentile(ok, 0.99):7.1f}ms | "
+        f"429 p99 {percentile(shed, 0.99):6.1f}ms | 吞吐 {len(ok) / elapsed:5.1f} req/s"
+    )
+    return {"ok": ok, "shed": shed, "timeouts": timeouts}
+
+
+async def burst(client: httpx.AsyncClient, name: str, requests: List[Tuple[str, str]]) -> Tuple[Dict[str, Any], List[Tuple[int, float, str]]]:
+    start = time.perf_counter()
+    results = await asyncio.gather(*(send(client, session_id, message) for session_id, message in requests))
+    return report(name, results, time.perf_counter() - start), results
+
+
+async def main() -> None:
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    requests = [(f"burst-{i}", f"第 {i} 个问题：介绍一下你自己") for i in range(total)]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await use_admission(client, False)
+        await burst(client, "预热", requests[:8])
+        print("-" * 130)
+
+        without, _ = await burst(client, "不做准入控制", [(f"off-{s}", m) for s, m in requests])
+        await asyncio.sleep(1)
+
+        await use_admission(client, True)
+        controlled, results = await burst(client, "准入控制", [(f"on-{s}", m) for s, m in requests])
+        stats = admission._controller.stats()
+        print(f"{'':<18} | 并发上限 {stats['limit']} | 下调 {stats['limit_decreases']} 次 | 拒绝 {stats['shed']}")
+        check(controlled["timeouts"] == 0, f"准入控制下仍有 {controlled['timeouts']} 个请求超时")
+        check(percentile(controlled["ok"], 0.99) < 3500, "被接纳请求的 p99 应受排队时间上限约束")
+        check(percentile(controlled["shed"], 0.99) < 2500, "被拒绝的请求应在排队时间上限内返回")
+        check(all(retry for status, _, retry in results if status == 429), "429 响应应带 Retry-After")
+        check(without["timeouts"] > 0, "不做准入控制时突发请求应在提供方排队超时")
+        await asyncio.sleep(1)
+
+        # 一个会话连发 40 条，同时 40 个会话各发 1 条
+        await use_admission(client, True, initial_limit=8, min_limit=8, max_limit=8, queue_timeout=5.0)
+        chatty = [("chatty", f"第 {i} 条：介绍一下你自己") for i in range(40)]
+        others = [(f"other-{i}", "介绍一下你自己") for i in range(40)]
+        start = time.perf_counter()
+        chatty_results, other_results = await asyncio.gather(
+            asyncio.gather(*(send(client, s, m) for s, m in chatty)),
+            asyncio.gather(*(send(client, s, m) for s, m in others)),
+        )
+        elapsed = time.perf_counter() - start
+        report("公平 / 连发会话", chatty_results, elapsed)
+        fair = report("公平 / 其他会话", other_results, elapsed)
+        check(len(fair["ok"]) == len(others), "其他会话的请求应全部成功")
+        check(percentile(fair["ok"], 0.99) < 2500, "连发会话不应拖慢其他会话")
+        await asyncio.sleep(1)
+
+        # 4 个批次各 16 条、并发 8，共 32 个 worker，并发上限固定为 8
+        await use_admission(client, True, initial_limit=8, min_limit=8, max_limit=8, queue_size=8, queue_timeout=1.0)
+        controller = admission._controller
+        peak = 0
+
+        async def sample() -> None:
+            nonlocal peak
+            while True:
+                peak = max(peak, controller.in_flight)
+                await asyncio.sleep(0.005)
+
+        async def run_batch(b: int) -> List[int]:
+            body = {"requests": [{"message": f"批次 {b} 第 {i} 条：介绍一下你自己"} for i in range(16)], "concurrency": 8}
+            response = await client.post("/chat/batch", json=body, timeout=60)
+            lines = [json.loads(line) for line in response.text.splitlines() if line]
+            return [line["status"] for line in lines if "status" in line]
+
+        sampler = asyncio.create_task(sample())
+        start = time.perf_counter()
+        batches = await asyncio.gather(*(run_batch(b) for b in range(4)))
+        sampler.cancel()
+        statuses = [status for batch in batches for status in batch]
+        print(f"{'批量 4×16':<18} | 条目 {len(statuses):>4} | 成功 {statuses.count(200):>4} | "
+              f"处理中峰值 {peak} | 上限 8 | 耗时 {time.perf_counter() - start:.2f}s | 拒绝 {dict(controller.shed)}")
+        check(peak <= 8, f"批量条目处理中峰值 {peak} 超过并发上限")
+        check(statuses.count(200) == 64, "被拒绝的批量条目应退避重试后完成")
+
+    if failures:
+        print("\n未通过：")
+        for message in failures:
+            print(f"- {message}")
+        sys.exit(1)
+    print("\n全部检查通过")
+
+
+if __name__ == "__main__":
+    server = start_stub_server()
+    try:
+        asyncio.run(main())
+    finally:
+        server.should_exit = True
@@ -0,0 +1,109 @@
+"""
+批量接口吞吐压测
+
+上游 LLM 与工具指向本地桩服务(假 LLM，默认延迟 0.2s)，应用通过 ASGITransport 在进程内调用，对比：
+- 逐条调用 /chat(夜间任务原来的做法)
+- 一次调用 /chat/batch，不同并发度
+
+同时统计工具接口收到的上游请求数：批次内参数相同的工具调用共享结果，新闻等无缓存的工具请求数明显减少。
+
+运行：python -m benchmarks.bench_batch [请求数] [并发度...]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+# 请求中指定的并发度不能超过服务端上限
+os.environ.setdefault("BATCH_CONCURRENCY", "64")
+
+from benchmarks import stub_server  # noqa: E402
+from benchmarks.stub_server import configure_env, start_stub_server  # noqa: E402
+
+configure_env()
+
+from api.main import app  # noqa: E402
+
+TOPICS = ["科技", "体育", "财经", "娱乐"]
+CITIES = ["北京", "上海", "深圳", "广州", "杭州"]
+
+
+def build_prompts(total: int) -> List[Dict[str, Any]]:
+    """一次性问题：快速路由可处理的工具问题、需要 LLM 的多城市问题与闲聊"""
+    prompts = []
+    for i in range(total):
+        kind = i % 4
+        if kind == 0:
+            message = f"最新{TOPICS[i % len(TOPICS)]}新闻"
+        elif kind == 1:
+            message = f"{CITIES[i % len(CITIES)]}天气怎么样"
+        elif kind == 2:
+            message = f"帮我对比一下{CITIES[i % len(CITIES)]}和{CITIES[(i + 1) % len(CITIES)]}的天气"
+        else:
+            message = f"第 {i} 个问题：介绍一下你自己"
+        prompts.append({"id": str(i), "message": message})
+    return prompts
+
+
+def tool_requests() -> int:
+    return sum(stub_server.REQUEST_COUNTS.values())
+
+
+async def run_sequential(client: httpx.AsyncClient, prompts: List[Dict[str, Any]]) -> None:
+    before = tool_requests()
+    start = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        response = await client.post("/chat", json={"session_id": f"seq-{i}", "message": prompt["message"]})
+        response.raise_for_status()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{'逐条 /chat':<16} | 请求 {len(prompts):>5} | 耗时 {elapsed:7.2f}s | "
+        f"吞吐 {len(prompts) / elapsed:7.1f} req/s | 工具上游请求 {tool_requests() - before:>5}"
+    )
+
+
+async def run_batch(client: httpx.AsyncClient, prompts: List[Dict[str, Any]], concurrency: int) -> None:
+    before = tool_requests()
+    body = "\n".join(json.dumps(prompt, ensure_ascii=False) for prompt in prompts)
+    start = time.perf_counter()
+    summary: Dict[str, Any] = {}
+    async with client.stream(
+        "POST", f"/chat/batch?concurrency={concurrency}",
+        content=body.encode("utf-8"), headers={"content-type": "application/x-ndjson"},
+    ) as response:
+        async for line in response.aiter_lines():
+            if line:
+                result = json.loads(line)
+                summary = result.get("summary", summary)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{f'/chat/batch x{concurrency}':<16} | 请求 {len(prompts):>5} | 耗时 {elapsed:7.2f}s | "
+        f"吞吐 {len(prompts) / elapsed:7.1f} req/s | 工具上游请求 {tool_requests() - before:>5} | "
+        f"成功 {summary.get('succeeded')} | 共享工具结果 {summary.get('tool_memo_hits')} 次"
+    )
+
+
+async def main() -> None:
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    levels = [int(arg) for arg in sys.argv[2:]] or [8, 32]
+    prompts = build_prompts(total)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # 预热：建立连接、构建模型与工具绑定
+        await run_batch(client, prompts[:8], 8)
+        print("-" * 100)
+        await run_sequential(client, prompts)
+        for concurrency in levels:
+            await run_batch(client, prompts, concurrency)
+
+
+if __name__ == "__main__":
+    server = start_stub_server()
+    try:
+        asyncio.run(main())
+    finally:
+        server.should_exit = True
@@ -0,0 +1,58 @@
+"""
+/chat 处理链路并发压测
+
+在同一个事件循环内以不同并发度调用 handle_message，
+上游 LLM 与工具全部指向本地桩服务，观察吞吐是否随并发线性提升。
+
+运行：python -m benchmarks.bench_concurrency
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from benchmarks.stub_server import configure_env, start_stub_server
+
+configure_env()
+
+from agents.route import handle_message  # noqa: E402
+from state.store import StateStore  # noqa: E402
+
+MESSAGES = ["北京天气怎么样", "最新科技新闻", "你好"]
+
+
+async def run(concurrency: int, total: int) -> None:
+    store = StateStore()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await handle_message(f"bench-{i}", MESSAGES[i % len(MESSAGES)], state_store=store)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"并发 {concurrency:>4} | 请求 {total:>4} | 耗时 {elapsed:6.2f}s | "
+        f"吞吐 {total / elapsed:7.1f} req/s | "
+        f"p50 {statistics.median(latencies) * 1000:7.1f}ms | "
+        f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f}ms"
+    )
+
+
+async def main() -> None:
+    levels = [int(arg) for arg in sys.argv[1:]] or [1, 10, 50, 200]
+    for concurrency in levels:
+        await run(concurrency, total=max(concurrency * 2, 20))
+
+
+if __name__ == "__main__":
+    server = start_stub_server()
+    try:
+        asyncio.run(main())
+    finally:
+        server.should_exit = True
@@ -0,0 +1,77 @@
+"""
+上下文窗口 token 对比：全量回放历史 vs 预算窗口 + 滚动摘要
+
+用 50 轮脚本对话模拟一个会话，统计每轮发送给 LLM 的历史 token 数。
+摘要模型用截断拼接代替，不访问任何上游，只关注 token 规模和摘要调用次数。
+
+运行：python -m benchmarks.bench_context_tokens [轮数]
+"""
+import asyncio
+import sys
+
+from benchmarks.stub_server import configure_env
+
+configure_env()
+
+from agents.context import ContextWindow, count_tokens, message_tokens  # noqa: E402
+from config.settings import settings  # noqa: E402
+
+CITIES = ["北京", "上海", "深圳", "广州", "杭州"]
+
+
+def scripted_turn(i: int):
+    city = CITIES[i % len(CITIES)]
+    return [
+        {"role": "user", "content": f"{city}今天天气怎么样？适合户外跑步吗？顺便推荐一下附近的公园。"},
+        {"role": "assistant", "content": f"{city}今天多云，气温 22°C 到 28°C，湿度 60%，东南风 2 级，适合户外跑步。"
+                                         f"建议傍晚出门，附近可以去城市中心公园或者滨江绿道，注意补充水分。"},
+    ]
+
+
+async def main(turns: int) -> None:
+    summary_calls = 0
+
+    async def fake_summarize(previous: str, messages) -> str:
+        nonlocal summary_calls
+        summary_calls += 1
+        text = previous + "".join(msg["content"][:20] for msg in messages)
+        return text[-200:]
+
+    window = ContextWindow(
+        token_budget=settings.app.context_token_budget,
+        min_recent_messages=settings.app.context_min_recent_messages,
+        summarize=fake_summarize,
+    )
+    max_history = settings.app.max_conversation_history
+
+    full_history = []
+    state = {"messages": [], "message_count": 0}
+    full_total = window_total = 0
+    print(f"{'轮次':>4} | {'全量回放':>8} | {'预算窗口':>8}")
+    for i in range(1, turns + 1):
+        turn = scripted_turn(i)
+        question = turn[0]
+
+        full_tokens = sum(message_tokens(m) for m in full_history[-max_history:]) + message_tokens(question)
+
+        context = await window.build(state)
+        window_tokens = (
+            sum(message_tokens(m) for m in context.recent)
+            + (count_tokens(context.summary) if context.summary else 0)
+            + message_tokens(question)
+        )
+        full_total += full_tokens
+        window_total += window_tokens
+        if i == 1 or i % 10 == 0:
+            print(f"{i:>4} | {full_tokens:>8} | {window_tokens:>8}")
+
+        full_history.extend(turn)
+        state.update(context.updates)
+        state["messages"] = (state["messages"] + turn)[-max_history:]
+        state["message_count"] += len(turn)
+
+    print(f"合计 | {full_total:>8} | {window_total:>8}  (摘要调用 {summary_calls} 次)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
@@ -0,0 +1,130 @@
+"""
+/history 分页与条件请求检查
+
+向一个会话追加多轮对话(超过最大历史条数，早期消息被截断)，通过 ASGITransport 在进程内调用 /history，
+对比轮询方式的响应字节数，并检查预期行为，不符合时以非 0 状态码退出：
+
+1. 全量：每次不带参数拉取最近一页
+2. 条件请求：带 If-None-Match，历史未变化时返回 304 空响应
+3. 增量：带 since 只取新消息
+4. 分页：沿 next_cursor 向前翻页，拼起来与完整状态中保存的消息一致
+5. 并发追加：merge 策略下多轮并发写入后，累计消息数(分页序号的依据)与实际追加的条数一致
+
+未配置 REDIS_URL 时使用内存存储；配置后验证 Redis 后端(只读取请求的区间)。
+
+运行：python -m benchmarks.bench_history [轮数]
+"""
+import asyncio
+import sys
+from typing import Any, Dict, List
+
+from benchmarks.stub_server import configure_env
+
+configure_env()
+
+import httpx  # noqa: E402
+
+from agents.route import get_default_store  # noqa: E402
+from api.main import app  # noqa: E402
+from config.settings import settings  # noqa: E402
+from state.store import StateStore  # noqa: E402
+
+SESSION_ID = "bench-history"
+state_store = get_default_store()
+failures: List[str] = []
+
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        failures.append(message)
+
+
+def turn_messages(i: int) -> List[Dict[str, Any]]:
+    return [
+        {"role": "user", "content": f"第 {i} 轮：北京今天天气怎么样？"},
+        {"role": "assistant", "content": f"第 {i} 轮：北京今天晴，气温 25°C，适合出行。"},
+    ]
+
+
+async def append_turn(i: int, store: StateStore = state_store, expected_version: Any = None) -> None:
+    await store.append_turn(
+        SESSION_ID, turn_messages(i), {}, settings.app.max_conversation_history, expected_version=expected_version
+    )
+
+
+async def main() -> None:
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    max_history = settings.app.max_conversation_history
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await state_store._store.set(SESSION_ID, {}, 60)
+        full_bytes = conditional_bytes = since_bytes = 0
+        etag, since = "", 0
+        for i in range(turns):
+            await append_turn(i)
+            # 每轮对话之间客户端轮询 3 次
+            for _ in range(3):
+                full = await client.get(f"/history/{SESSION_ID}")
+                full_bytes += len(full.content)
+                conditional = await client.get(f"/history/{SESSION_ID}", headers={"If-None-Match": etag})
+                conditional_bytes += len(conditional.content)
+                etag = conditional.headers.get("etag", etag)
+                incremental = await client.get(f"/history/{SESSION_ID}", params={"since": since})
+                since_bytes += len(incremental.content)
+                since = incremental.json()["next_since"]
+        polls = turns * 3
+        print(f"{'全量轮询':<10} | 平均每次 {full_bytes / polls:8.0f} B")
+        print(f"{'If-None-Match':<10} | 平均每次 {conditional_bytes / polls:8.0f} B")
+        print(f"{'since':<10} | 平均每次 {since_bytes / polls:8.0f} B")
+        check(conditional_bytes < full_bytes / 2, "条件请求应在历史未变化时省去响应体")
+        check(since_bytes < full_bytes / 5, "增量轮询应只返回新消息")
+        check(since == 2 * turns, f"增量轮询结束时 next_since 为 {since}，预期 {2 * turns}")
+
+        latest = await client.get(f"/history/{SESSION_ID}")
+        not_modified = await client.get(f"/history/{SESSION_ID}", headers={"If-None-Match": latest.headers["etag"]})
+        check(not_modified.status_code == 304 and not not_modified.content, "ETag 未变化时应返回 304")
+        await append_turn(turns)
+        modified = await client.get(f"/history/{SESSION_ID}", headers={"If-None-Match": latest.headers["etag"]})
+        check(modified.status_code == 200 and modified.headers["etag"] != latest.headers["etag"], "追加消息后 ETag 应变化")
+
+        # 沿 next_cursor 向前翻页
+        pages: List[Dict[str, Any]] = []
+        params: Dict[str, Any] = {"limit": 7}
+        while True:
+            body = (await client.get(f"/history/{SESSION_ID}", params=params)).json()
+            pages = body["messages"] + pages
+            if body["next_cursor"] is None:
+                break
+            params["cursor"] = body["next_cursor"]
+        state = await state_store.get_state(SESSION_ID)
+        check(pages == state["messages"], "翻页拼接的消息应与保存的历史一致")
+        check(len(pages) == min(max_history, 2 * (turns + 1)), f"翻页共取到 {len(pages)} 条消息")
+        check(body["offset"] == 2 * (turns + 1) - len(pages), "第一页的 offset 应为最早保存的消息序号")
+
+        truncated = (await client.get(f"/history/{SESSION_ID}", params={"since": 0, "limit": 3})).json()
+        check(truncated["offset"] == body["offset"], "since 早于已截断的消息时应从最早保存的消息开始")
+        conflict = await client.get(f"/history/{SESSION_ID}", params={"since": 0, "cursor": 10})
+        check(conflict.status_code == 422, "cursor 与 since 同时指定时应返回 422")
+        missing = (await client.get("/history/bench-history-missing")).json()
+        check(missing["messages"] == [] and missing["next_cursor"] is None, "不存在的会话应返回空历史")
+
+        # 5 轮并发写入都基于同一个旧版本(merge 策略不校验版本)
+        merge_store = StateStore(redis_url=settings.app.redis_url, concurrency_policy="merge")
+        merge_store._store = state_store._store
+        await state_store._store.set(SESSION_ID, {}, 60)
+        await asyncio.gather(*(append_turn(i, merge_store, expected_version=0) for i in range(5)))
+        merged = (await client.get(f"/history/{SESSION_ID}")).json()
+        check(merged["total"] == 10 and len(merged["messages"]) == 10 and merged["offset"] == 0,
+              f"并发追加 10 条消息后累计消息数为 {merged['total']}")
+
+    await state_store.close()
+    if failures:
+        print("\n未通过：")
+        for message in failures:
+            print(f"- {message}")
+        sys.exit(1)
+    print("\n全部检查通过")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
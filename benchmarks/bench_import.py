@@ -0,0 +1,134 @@
+"""
+启动耗时基准与回归检查
+
+在独立的子进程中多次执行 python -X importtime -c "import api.main"，统计：
+- 导入 api.main 的累计耗时(取中位数)，超过预算视为回归
+- 累计耗时最高的顶层导入，便于定位新引入的重依赖
+- 导入 api.main 后不应加载的重依赖(LangChain、openai、numpy、redis 等)，它们应推迟到首次使用或启动预热时导入
+- 导入 api.main 不应启动后台线程(日志、trace 导出)或创建日志与 trace 文件
+
+按生产配置测量：设置 REDIS_URL(只导入、不连接)并开启 trace 导出，日志与 trace 写到临时目录。
+
+每次都是全新的进程，但操作系统的文件缓存是热的，测得的是"热"冷启动耗时。
+检查失败时以非 0 状态码退出；同样的检查也在 tests/test_import_budget.py 中由 pytest 执行。
+
+运行：python -m benchmarks.bench_import [次数] [预算 ms]
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.stub_server import configure_env
+
+# 本机(1 核)延迟导入前约 2000ms，之后约 400~550ms；预算留出机器差异的余量
+DEFAULT_BUDGET_MS = 1000
+FORBIDDEN = ("langchain", "langchain_core", "langchain_openai", "openai", "langsmith", "numpy", "redis", "tiktoken")
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def app_env(workdir: str) -> Dict[str, str]:
+    """子进程的环境变量，需先调用 configure_env 指向桩服务；不修改当前进程的环境变量"""
+    env = dict(os.environ)
+    # 只测量导入，不连接任何上游；REDIS_URL 指向不存在的实例，导入时不应加载 redis 客户端
+    env.setdefault("REDIS_URL", "redis://127.0.0.1:6399/15")
+    env["TRACING_ENABLED"] = "true"
+    env["TRACE_EXPORT_PATH"] = os.path.join(workdir, "traces.jsonl")
+    env["LOG_FILE"] = os.path.join(workdir, "logs", "app.log")
+    return env
+
+
+def measure(env: Dict[str, str]) -> Tuple[float, List[Tuple[str, float]]]:
+    """返回 api.main 的累计导入耗时(ms)与各顶层导入的累计耗时"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api.main"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    total = 0.0
+    top: List[Tuple[str, float]] = []
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if match is None:
+            continue
+        cumulative_ms = int(match.group(2)) / 1000
+        depth = len(match.group(3)) // 2
+        module = match.group(4)
+        if module == "api.main":
+            total = cumulative_ms
+        # api.main 直接触发的导入缩进一级
+        elif depth == 1:
+            top.append((module, cumulative_ms))
+    return total, top
+
+
+PROBE = """
+import json, sys, threading
+import api.main
+print(json.dumps({
+    "modules": sorted({m.split('.')[0] for m in sys.modules}),
+    "threads": sorted(t.name for t in threading.enumerate() if t is not threading.main_thread()),
+}))
+"""
+
+
+def import_side_effects(env: Dict[str, str], workdir: str) -> Dict[str, Any]:
+    """导入 api.main 后加载的重依赖、启动的线程与创建的文件"""
+    proc = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, check=True)
+    probe = json.loads(proc.stdout.strip().splitlines()[-1])
+    files = [os.path.relpath(os.path.join(root, name), workdir) for root, _, names in os.walk(workdir) for name in names]
+    return {
+        "forbidden": sorted(set(probe["modules"]).intersection(FORBIDDEN)),
+        "threads": probe["threads"],
+        "files": sorted(files),
+    }
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BUDGET_MS
+    workdir = tempfile.mkdtemp(prefix="bench-import-")
+    configure_env()
+    env = app_env(workdir)
+
+    totals: List[float] = []
+    tops: Dict[str, List[float]] = {}
+    for _ in range(runs):
+        total, top = measure(env)
+        totals.append(total)
+        for module, elapsed in top:
+            tops.setdefault(module, []).append(elapsed)
+
+    median = statistics.median(totals)
+    print(f"import api.main：中位数 {median:7.1f}ms | 最小 {min(totals):7.1f}ms | 最大 {max(totals):7.1f}ms | 预算 {budget:.0f}ms")
+    print("-" * 60)
+    ranked = sorted(((statistics.median(v), k) for k, v in tops.items()), reverse=True)
+    for elapsed, module in ranked[:10]:
+        print(f"{module:<40} {elapsed:8.1f}ms")
+    print("-" * 60)
+
+    effects = import_side_effects(env, workdir)
+    ok = True
+    if median > budget:
+        print(f"❌ 导入耗时 {median:.1f}ms 超过预算 {budget:.0f}ms")
+        ok = False
+    if effects["forbidden"]:
+        print(f"❌ 导入 api.main 时加载了应延迟导入的模块：{', '.join(effects['forbidden'])}")
+        ok = False
+    if effects["threads"]:
+        print(f"❌ 导入 api.main 时启动了后台线程：{', '.join(effects['threads'])}")
+        ok = False
+    if effects["files"]:
+        print(f"❌ 导入 api.main 时创建了文件：{', '.join(effects['files'])}")
+        ok = False
+    if ok:
+        print("✅ 导入耗时在预算内，重依赖均未在导入时加载，没有启动线程或创建文件")
+    else:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+日志开销压测
+
+同一个事件循环内以固定并发调用 handle_message，对比三种日志配置下的吞吐：
+- off:   关闭日志
+- sync:  原来的同步 FileHandler(在事件循环线程中格式化并写盘)
+- async: QueueHandler + 后台线程写 JSON(当前配置)
+
+另外单独测量记录一条普通日志和一条大会话状态日志的总开销(async 模式包含后台线程写完队列的时间；
+大对象日志在默认 INFO 级别下已不会输出，这里按 INFO 记录以测量最坏情况)。
+桩服务延迟默认设为 0，放大日志在请求处理中的占比。
+
+运行：python -m benchmarks.bench_logging [并发] [请求数]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("STUB_LLM_LATENCY", "0")
+os.environ.setdefault("STUB_TOOL_LATENCY", "0")
+
+from benchmarks.stub_server import configure_env, start_stub_server  # noqa: E402
+
+configure_env()
+
+from agents.route import handle_message  # noqa: E402
+from state.store import StateStore  # noqa: E402
+from utils import logger as app_logger  # noqa: E402
+
+MESSAGES = ["北京天气怎么样", "最新科技新闻", "你好"]
+LARGE_STATE = {"messages": [{"role": "user", "content": "北京天气怎么样" * 20}] * 50, "last_tool": {"name": "weather"}}
+
+
+def drain() -> None:
+    """等待后台线程写完队列中的日志"""
+    listener = app_logger._listener
+    while listener is not None and listener.queue:
+        time.sleep(0.001)
+
+
+def configure(mode: str, async_handlers: list) -> None:
+    root = logging.getLogger()
+    logging.disable(logging.NOTSET)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if mode == "off":
+        logging.disable(logging.CRITICAL)
+    elif mode == "sync":
+        handler = logging.FileHandler(os.path.join(tempfile.gettempdir(), "bench_logging_sync.log"), encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s"))
+        root.addHandler(handler)
+    else:
+        for handler in async_handlers:
+            root.addHandler(handler)
+
+
+async def run(mode: str, concurrency: int, total: int) -> None:
+    store = StateStore()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            await handle_message(f"bench-{mode}-{i}", MESSAGES[i % len(MESSAGES)], state_store=store)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+
+    logger = logging.getLogger("bench")
+    records = 2000
+
+    def measure(*args) -> float:
+        drain()
+        log_start = time.perf_counter()
+        for i in range(records):
+            logger.info(*args)
+        drain()
+        return (time.perf_counter() - log_start) / records
+
+    small = measure("会话 %s 调用工具 %s，参数：%s", 1, "weather", {"city": "北京"})
+    large = measure("会话 %s 更新状态：%s", 1, LARGE_STATE)
+    print(
+        f"{mode:>5} | 请求 {total:>5} | 吞吐 {total / elapsed:7.1f} req/s | "
+        f"普通日志 {small * 1e6:6.1f}us/条 | 大对象日志 {large * 1e6:6.1f}us/条"
+    )
+
+
+async def main() -> None:
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 600
+    app_logger.setup_logging()
+    async_handlers = list(logging.getLogger().handlers)
+    # 预热：建立连接、构建模型与工具绑定
+    configure("off", async_handlers)
+    await run("warm", concurrency, concurrency * 2)
+    for mode in ("off", "sync", "async"):
+        configure(mode, async_handlers)
+        await run(mode, concurrency, total)
+    configure("async", async_handlers)
+
+
+if __name__ == "__main__":
+    server = start_stub_server()
+    try:
+        asyncio.run(main())
+    finally:
+        server.should_exit = True
@@ -0,0 +1,145 @@
+"""
+上游限流与每日配额测试
+
+在同一进程内启动桩服务，为 WeathorTool 的上游挂上不同配置的限流器，突发地发出请求，
+输出每个场景放行、排队与拒绝的数量以及上游实际收到的请求速率，并检查预期行为，不符合时以非 0 状态码退出：
+
+1. 不限流：突发请求全部直达上游
+2. fail_fast：超出令牌桶容量的请求立即失败，不等待
+3. queue：令牌不足时排队，等待超过上限的请求失败；上游收到的请求速率不超过限额
+4. 优先通道：批量请求耗尽可用令牌后，交互请求仍能使用保留的令牌
+5. 每日配额：用量达到降级比例后有缓存的请求直接返回缓存，配额用尽后返回陈旧数据或失败
+
+只覆盖进程内令牌桶；配置 REDIS_URL 后各 worker 共享令牌桶，运行本脚本即可验证 Redis 后端。
+
+运行：python -m benchmarks.bench_rate_limit [突发请求数]
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+os.environ.setdefault("STUB_TOOL_LATENCY", "0.01")
+
+from benchmarks import stub_server  # noqa: E402
+from benchmarks.stub_server import configure_env, start_stub_server  # noqa: E402
+
+configure_env()
+
+from tools import rate_limit, resilience  # noqa: E402
+from tools.rate_limit import PRIORITY_BATCH, QUOTA_EXHAUSTED, RATE_LIMITED, UpstreamLimiter, priority_scope  # noqa: E402
+from tools.weathor_tool import WeathorTool  # noqa: E402
+
+LOCATION_ID = "101010100"
+failures: List[str] = []
+
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        failures.append(message)
+
+
+def fresh_tool(**limits: Any) -> WeathorTool:
+    resilience._budget = None
+    tool = WeathorTool()
+    tool.upstream.limiter = (
+        UpstreamLimiter("qweather", client=rate_limit._shared_client(), **limits) if limits else None
+    )
+    return tool
+
+
+def upstream_requests() -> int:
+    return stub_server.REQUEST_COUNTS["weather_now"]
+
+
+async def burst(tool: WeathorTool, total: int) -> Tuple[List[Dict[str, Any]], List[float], float]:
+    """同时发出 total 个请求，返回结果、各请求耗时与总耗时"""
+    latencies: List[float] = []
+
+    async def one() -> Dict[str, Any]:
+        start = time.perf_counter()
+        result = await tool.request("v7/weather/now", {"location": LOCATION_ID})
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(total)))
+    return results, latencies, time.perf_counter() - start
+
+
+def report(name: str, results: List[Dict[str, Any]], latencies: List[float], elapsed: float, requests: int) -> int:
+    ok = sum(1 for r in results if r["success"])
+    limited = sum(1 for r in results if r.get("code") == RATE_LIMITED)
+    print(
+        f"{name:<20} | 请求 {len(results):>4} | 成功 {ok:>4} | 限流拒绝 {limited:>4} | 上游请求 {requests:>4} | "
+        f"上游速率 {requests / elapsed:6.1f}/s | 最长耗时 {max(latencies) * 1000:7.1f}ms"
+    )
+    return ok
+
+
+async def scenario(name: str, tool: WeathorTool, total: int) -> Tuple[int, List[float], float, int]:
+    before = upstream_requests()
+    results, latencies, elapsed = await burst(tool, total)
+    requests = upstream_requests() - before
+    return report(name, results, latencies, elapsed, requests), latencies, elapsed, requests
+
+
+async def main() -> None:
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    ok, _, _, requests = await scenario("不限流", fresh_tool(), total)
+    check(ok == total and requests == total, "不限流时请求应全部直达上游")
+
+    # 容量 5、每秒 20 个：fail_fast 只放行桶中已有的令牌，其余立即失败
+    tool = fresh_tool(rate=20, burst=5, daily_quota=0, mode="fail_fast")
+    ok, latencies, elapsed, requests = await scenario("fail_fast", tool, total)
+    check(ok <= 5 + 20 * elapsed + 1 and requests == ok, f"fail_fast 放行了 {ok} 个请求，超过令牌桶容量")
+    check(min(latencies) < 0.005, "fail_fast 被拒绝的请求不应等待")
+
+    # queue：最多等待 1 秒，放行数约为 5 + 20 × 1
+    tool = fresh_tool(rate=20, burst=5, daily_quota=0, mode="queue", max_wait=1.0)
+    ok, latencies, elapsed, requests = await scenario("queue / 最长等 1s", tool, total)
+    rate = (requests - 5) / elapsed
+    check(20 <= ok <= 27, f"queue 模式放行了 {ok} 个请求，预期约 25 个")
+    check(rate <= 22, f"上游收到的请求速率 {rate:.1f}/s 超过限额")
+    check(max(latencies) < 1.2, "排队时间不应超过等待上限")
+
+    # 优先通道：容量 10，保留 30% 给交互请求
+    tool = fresh_tool(rate=1, burst=10, daily_quota=0, mode="fail_fast", reserve=0.3)
+    with priority_scope(PRIORITY_BATCH):
+        batch_ok, *_ = await scenario("优先通道 / 批量", tool, 20)
+    interactive_ok, *_ = await scenario("优先通道 / 交互", tool, 5)
+    check(batch_ok == 7, f"批量请求放行了 {batch_ok} 个，预期为未保留的 7 个")
+    check(interactive_ok >= 3, f"批量请求之后交互请求只放行了 {interactive_ok} 个")
+
+    # 每日配额 10，用量达到 80% 后有缓存的请求直接返回缓存
+    tool = fresh_tool(rate=0, burst=0, daily_quota=10, degrade_ratio=0.8)
+    for _ in range(8):
+        await tool.request("v7/weather/now", {"location": LOCATION_ID})
+    tool.obs_cache.set(LOCATION_ID, {"obsTime": "2024-01-01T00:00+08:00", "temp": "20", "text": "晴"}, expires_at=time.time() - 60)
+    before = upstream_requests()
+    degraded = await tool.get_current_weather(LOCATION_ID)
+    check(bool(degraded and degraded.get("stale")) and upstream_requests() == before, "配额将尽时应直接返回缓存数据")
+    codes = [(await tool.request("v7/weather/now", {"location": LOCATION_ID})).get("code") for _ in range(4)]
+    exhausted = await tool.get_current_weather("101020100")
+    stats = tool.upstream.limiter.stats()
+    print(f"{'每日配额 10':<20} | 配额 {stats['quota']} | 降级 {stats['degraded']} | 后续请求 {codes}")
+    check(codes.count(QUOTA_EXHAUSTED) == 2, "配额用尽后的请求应直接失败")
+    check(exhausted is None, "配额用尽且没有缓存时应返回 None")
+
+    await rate_limit.close_rate_limiters()
+    if failures:
+        print("\n未通过：")
+        for message in failures:
+            print(f"- {message}")
+        sys.exit(1)
+    print("\n全部检查通过")
+
+
+if __name__ == "__main__":
+    server = start_stub_server()
+    try:
+        asyncio.run(main())
+    finally:
+        server.should_exit = True
@@ -0,0 +1,91 @@
+"""
+Redis 会话存储结构对比：整段 JSON 重写 vs 列表追加 + 哈希
+
+模拟一个会话连续进行多轮对话，统计每轮读写的网络字节数(取自 redis INFO stats)
+和延迟。需要本地运行 redis-server，默认使用 redis://localhost:6379/15。
+
+运行：REDIS_URL=redis://localhost:6379/15 python -m benchmarks.bench_redis_layout [轮数]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+import redis
+
+from benchmarks.stub_server import configure_env
+
+configure_env()
+
+from state.store import StateStore  # noqa: E402
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/15")
+MAX_HISTORY = 50
+TTL = 3600
+
+
+def net_bytes(client: redis.Redis) -> int:
+    info = client.info("stats")
+    return info["total_net_input_bytes"] + info["total_net_output_bytes"]
+
+
+def turn_messages(i: int):
+    return [
+        {"role": "user", "content": f"第 {i} 轮：北京今天天气怎么样？" * 3},
+        {"role": "assistant", "content": f"第 {i} 轮：北京今天晴，气温 25°C，适合出行。" * 3},
+    ]
+
+
+def report(name: str, samples) -> None:
+    total_bytes = sum(b for b, _ in samples)
+    total_time = sum(t for _, t in samples)
+    tail = samples[-10:]
+    print(
+        f"{name:<8} | 平均每轮 {total_bytes / len(samples):9.0f} B, {total_time / len(samples) * 1000:6.2f} ms | "
+        f"最后 10 轮平均 {sum(b for b, _ in tail) / len(tail):9.0f} B"
+    )
+
+
+def bench_legacy(client: redis.Redis, turns: int):
+    """改造前：GET 整段 JSON，修改后 SETEX 整段写回"""
+    key = "bench-legacy"
+    client.delete(key)
+    samples = []
+    for i in range(turns):
+        before, start = net_bytes(client), time.perf_counter()
+        raw = client.get(key)
+        state = json.loads(raw) if raw else {}
+        messages = state.get("messages", []) + turn_messages(i)
+        state = {"messages": messages[-MAX_HISTORY:], "last_tool": {"name": "weather", "parameters": {"city": "北京"}}}
+        client.setex(key, TTL, json.dumps(state))
+        samples.append((net_bytes(client) - before, time.perf_counter() - start))
+    return samples
+
+
+async def bench_append(client: redis.Redis, turns: int):
+    """改造后：读取列表 + 哈希，仅追加本轮消息"""
+    store = StateStore(redis_url=REDIS_URL, ttl_seconds=TTL)
+    session_id = "bench-append"
+    await store.set_state(session_id, {})
+    samples = []
+    for i in range(turns):
+        before, start = net_bytes(client), time.perf_counter()
+        await store.get_state(session_id)
+        await store.append_turn(
+            session_id, turn_messages(i), {"last_tool": {"name": "weather", "parameters": {"city": "北京"}}}, MAX_HISTORY
+        )
+        samples.append((net_bytes(client) - before, time.perf_counter() - start))
+    return samples
+
+
+def main() -> None:
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    client = redis.Redis.from_url(REDIS_URL)
+    # INFO 命令本身也计入流量，两种结构的统计口径一致
+    report("legacy", bench_legacy(client, turns))
+    report("append", asyncio.run(bench_append(client, turns)))
+
+
+if __name__ == "__main__":
+    main()
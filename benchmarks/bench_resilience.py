@@ -0,0 +1,174 @@
+"""
+上游弹性策略的故障注入测试
+
+在同一进程内启动桩服务，按场景修改故障注入的环境变量，直接调用 WeathorTool，
+输出每个场景的成功率、上游请求数与延迟，并检查预期行为，不符合时以非 0 状态码退出：
+
+1. 健康：不重试、不熔断
+2. 10% 返回 503：关闭重试与开启重试的成功率对比
+3. 10% 超时：超时后重试
+4. 全部 503：熔断器打开后直接失败，不再等待上游；实况缓存已过期时返回陈旧数据
+5. 恢复：冷却期结束后探测请求成功，熔断器关闭
+6. 全部 503 且不熔断：重试预算限制了重试放大的上游流量
+7. 3% 长尾请求：关闭与开启对冲时的 p99 对比
+
+运行：python -m benchmarks.bench_resilience [每个场景的调用数]
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+os.environ.setdefault("STUB_TOOL_LATENCY", "0.02")
+os.environ.setdefault("STUB_FAULT_TIMEOUT", "2")
+os.environ.setdefault("STUB_FAULT_SLOW_LATENCY", "0.5")
+os.environ.setdefault("HTTP_READ_TIMEOUT", "0.3")
+os.environ.setdefault("UPSTREAM_BREAKER_RESET_TIMEOUT", "1")
+
+from benchmarks import stub_server  # noqa: E402
+from benchmarks.stub_server import configure_env, start_stub_server  # noqa: E402
+
+configure_env()
+
+from tools import resilience  # noqa: E402
+from tools.weathor_tool import WeathorTool  # noqa: E402
+
+LOCATION_ID = "101010100"
+CONCURRENCY = 20
+FAULT_VARS = ("STUB_FAULT_ERROR_RATE", "STUB_FAULT_TIMEOUT_RATE", "STUB_FAULT_SLOW_RATE")
+failures: List[str] = []
+
+
+def set_faults(**rates: float) -> None:
+    for name in FAULT_VARS:
+        os.environ.pop(name, None)
+    for name, value in rates.items():
+        os.environ[f"STUB_FAULT_{name.upper()}_RATE"] = str(value)
+
+
+def fresh_tool(**overrides: Any) -> WeathorTool:
+    """每个场景使用新的熔断器、重试预算与耗时窗口"""
+    resilience._budget = None
+    tool = WeathorTool()
+    for name, value in overrides.items():
+        setattr(tool.upstream, name, value)
+    return tool
+
+
+async def run_calls(tool: WeathorTool, total: int) -> Tuple[List[Dict[str, Any]], List[float]]:
+    """绕过实况缓存，直接经弹性策略请求天气实况接口"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies: List[float] = []
+
+    async def one() -> Dict[str, Any]:
+        async with semaphore:
+            start = time.perf_counter()
+            result = await tool.request("v7/weather/now", {"location": LOCATION_ID})
+            latencies.append(time.perf_counter() - start)
+            return result
+
+    results = await asyncio.gather(*(one() for _ in range(total)))
+    return results, latencies
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)] * 1000
+
+
+def report(name: str, tool: WeathorTool, results: List[Dict[str, Any]], latencies: List[float], requests: int) -> float:
+    success = sum(1 for r in results if r["success"]) / len(results)
+    stats = tool.upstream.stats()
+    print(
+        f"{name:<22} | 调用 {len(results):>4} | 成功率 {success:6.1%} | 上游请求 {requests:>4} | "
+        f"重试 {stats['retries']:>3} | 对冲 {stats['hedges']:>3} | "
+        f"p50 {percentile(latencies, 0.5):6.1f}ms | p99 {percentile(latencies, 0.99):6.1f}ms | "
+        f"熔断器 {stats['breaker']['state']}"
+    )
+    return success
+
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        failures.append(message)
+
+
+async def scenario(name: str, tool: WeathorTool, total: int, **rates: float) -> Tuple[float, List[float]]:
+    set_faults(**rates)
+    before = sum(stub_server.REQUEST_COUNTS.values())
+    results, latencies = await run_calls(tool, total)
+    requests = sum(stub_server.REQUEST_COUNTS.values()) - before
+    return report(name, tool, results, latencies, requests), latencies
+
+
+async def main() -> None:
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+
+    tool = fresh_tool()
+    success, _ = await scenario("健康", tool, total)
+    check(success == 1.0 and tool.upstream.retries == 0, "健康场景不应失败或重试")
+
+    no_retry, _ = await scenario("10% 503 / 不重试", fresh_tool(max_retries=0), total, error=0.1)
+    with_retry, _ = await scenario("10% 503 / 重试", fresh_tool(), total, error=0.1)
+    check(with_retry >= 0.98 and with_retry > no_retry, f"重试后成功率 {with_retry:.1%} 未达到 98%")
+
+    timeout_retry, _ = await scenario("10% 超时 / 重试", fresh_tool(), total // 4, timeout=0.1)
+    check(timeout_retry >= 0.95, f"超时重试后成功率 {timeout_retry:.1%} 未达到 95%")
+
+    # 全部失败：熔断器打开后直接失败，上游请求数与调用数无关
+    tool = fresh_tool()
+    before = sum(stub_server.REQUEST_COUNTS.values())
+    _, latencies = await scenario("全部 503", tool, total, error=1.0)
+    requests = sum(stub_server.REQUEST_COUNTS.values()) - before
+    check(tool.upstream.breaker.state == "open", "全部失败时熔断器应打开")
+    check(requests < total // 4, f"熔断后上游仍收到 {requests} 个请求")
+    check(percentile(latencies, 0.5) < 5, "熔断期间的请求应直接失败")
+
+    # 实况缓存已过期：返回陈旧数据
+    tool.obs_cache.set(LOCATION_ID, {"obsTime": "2024-01-01T00:00+08:00", "temp": "20", "text": "晴"}, expires_at=time.time() - 60)
+    stale = await tool.get_current_weather(LOCATION_ID)
+    print(f"{'全部 503 / 陈旧数据':<22} | {stale}")
+    check(bool(stale and stale.get("stale")), "熔断期间应返回陈旧的实况数据")
+
+    # 冷却期结束后探测成功，熔断器关闭
+    set_faults()
+    await asyncio.sleep(tool.upstream.breaker.reset_timeout + 0.1)
+    recovered = await tool.request("v7/weather/now", {"location": LOCATION_ID})
+    print(f"{'恢复':<22} | 探测成功 {recovered['success']} | 熔断器 {tool.upstream.breaker.state}")
+    check(recovered["success"] and tool.upstream.breaker.state == "closed", "恢复后熔断器应关闭")
+
+    # 不熔断时，重试预算限制上游请求的放大倍数
+    tool = fresh_tool()
+    tool.upstream.breaker.failure_threshold = total * 10
+    before = sum(stub_server.REQUEST_COUNTS.values())
+    await scenario("全部 503 / 不熔断", tool, total, error=1.0)
+    amplification = (sum(stub_server.REQUEST_COUNTS.values()) - before) / total
+    budget = resilience.get_retry_budget()
+    print(f"{'':<22} | 上游请求放大 {amplification:.2f} 倍(不限预算时为 {tool.upstream.max_retries + 1} 倍)，预算拒绝 {budget.rejected} 次")
+    check(amplification < 1.5, f"重试预算未生效，上游请求放大 {amplification:.2f} 倍")
+
+    # 长尾：对冲请求需要先积累耗时样本
+    for hedge in (False, True):
+        tool = fresh_tool(hedge_enabled=hedge)
+        set_faults()
+        await run_calls(tool, 100)
+        _, latencies = await scenario(f"3% 长尾 / {'对冲' if hedge else '不对冲'}", tool, total, slow=0.03)
+        if hedge:
+            check(percentile(latencies, 0.99) < 250, "开启对冲后 p99 应明显低于长尾延迟")
+
+    set_faults()
+    if failures:
+        print("\n未通过：")
+        for message in failures:
+            print(f"- {message}")
+        sys.exit(1)
+    print("\n全部检查通过")
+
+
+if __name__ == "__main__":
+    server = start_stub_server()
+    try:
+        asyncio.run(main())
+    finally:
+        server.should_exit = True
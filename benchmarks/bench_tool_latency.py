@@ -0,0 +1,67 @@
+"""
+工具上游请求延迟对比：每次新建连接 vs 共享连接池
+
+"before" 模拟改造前的行为，每次调用都新建客户端(重新建立 TCP 连接)；
+"after" 走 WeathorTool.request，复用 utils.http_client 的共享连接池。
+
+运行：python -m benchmarks.bench_tool_latency [请求数] [并发]
+"""
+import asyncio
+import sys
+import time
+
+import httpx
+
+from benchmarks.stub_server import configure_env, start_stub_server
+
+configure_env()
+
+from tools.weathor_tool import WeathorTool  # noqa: E402
+from utils.http_client import close_http_clients  # noqa: E402
+
+
+def percentile(values, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))] * 1000
+
+
+async def measure(name: str, call, total: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(total)))
+    print(f"{name:<8} | p50 {percentile(latencies, 0.5):7.2f}ms | p99 {percentile(latencies, 0.99):7.2f}ms")
+
+
+async def main(total: int, concurrency: int) -> None:
+    tool = WeathorTool()
+    url = f"{tool.base_url}/v7/weather/now"
+
+    async def before() -> None:
+        async with httpx.AsyncClient() as client:
+            await client.get(url, params={"location": "101010100", "key": tool.api_key})
+
+    async def after() -> None:
+        await tool.request("v7/weather/now", {"location": "101010100"})
+
+    await measure("before", before, total, concurrency)
+    await measure("after", after, total, concurrency)
+    await close_http_clients()
+
+
+if __name__ == "__main__":
+    import os
+    os.environ.setdefault("STUB_TOOL_LATENCY", "0.005")
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    server = start_stub_server()
+    try:
+        asyncio.run(main(total, concurrency))
+    finally:
+        server.should_exit = True
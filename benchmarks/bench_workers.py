@@ -0,0 +1,164 @@
+"""
+多 worker 吞吐压测
+
+桩服务与应用各自运行在独立进程中(python main.py serve --workers N)，压测客户端通过 HTTP 调用 /chat：
+- 依次以 1/2/4/8 个 worker 启动服务，等待 /ready 返回 200(预热完成)后以固定并发压测
+- 最后验证优雅停机：请求进行中发送 SIGTERM，所有请求仍应返回 200
+
+桩服务的 LLM 延迟默认设为 0.05s，使应用自身的 CPU 开销成为瓶颈；吞吐随 worker 数的提升受限于本机 CPU 核数。
+
+运行：python -m benchmarks.bench_workers [并发] [请求数] [worker 数...]
+"""
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from typing import List
+
+import httpx
+
+from benchmarks.stub_server import BENCH_LOG_FILE
+
+STUB_PORT = 18081
+APP_PORT = 18600
+MESSAGES = ["你好", "北京天气怎么样", "帮我对比一下北京和上海的天气"]
+
+
+def app_env() -> dict:
+    base = f"http://127.0.0.1:{STUB_PORT}"
+    env = dict(os.environ)
+    env.update({
+        "QWEATHER_API_KEY": "stub",
+        "QWEATHER_BASE_URL": base,
+        "TIAN_API_KEY": "stub",
+        "TIAN_API_BASE_URL": base,
+        "OPENROUTER_API_KEY": "stub",
+        "OPENROUTER_BASE_URL": base,
+        "STUB_PORT": str(STUB_PORT),
+    })
+    env.setdefault("LOG_FILE", BENCH_LOG_FILE)
+    env.setdefault("STUB_LLM_LATENCY", "0.05")
+    env.setdefault("STUB_TOOL_LATENCY", "0.01")
+    env.setdefault("STUB_TOKEN_LATENCY", "0")
+    return env
+
+
+async def wait_ready(http: httpx.AsyncClient, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await http.get("/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("服务未在限定时间内就绪")
+
+
+def client(**limits: int) -> httpx.AsyncClient:
+    # 客户端空闲连接的保持时间短于服务端的 keep-alive(默认 5s)，避免复用服务端正在关闭的连接
+    return httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{APP_PORT}", timeout=60,
+        limits=httpx.Limits(keepalive_expiry=2, **limits),
+    )
+
+
+def start_app(workers: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "main.py", "serve", "--workers", str(workers), "--port", str(APP_PORT)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def stop_app(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=60)
+
+
+async def load(http: httpx.AsyncClient, concurrency: int, total: int, tag: str) -> List[int]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    statuses: List[int] = []
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await http.post("/chat", json={"session_id": f"{tag}-{i}", "message": MESSAGES[i % len(MESSAGES)]})
+                statuses.append(response.status_code)
+            except httpx.HTTPError:
+                statuses.append(0)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{tag:>10} | 请求 {total:>5} | 吞吐 {total / elapsed:7.1f} req/s | "
+        f"p50 {statistics.median(latencies) * 1000:7.1f}ms | p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f}ms | "
+        f"非 200 {sum(1 for s in statuses if s != 200)}"
+    )
+    return statuses
+
+
+async def run_level(workers: int, concurrency: int, total: int, env: dict) -> None:
+    process = start_app(workers, env)
+    try:
+        async with client(max_connections=concurrency) as http:
+            await wait_ready(http)
+            await load(http, concurrency, concurrency * 2, f"warm-{workers}")
+            await load(http, concurrency, total, f"workers={workers}")
+    finally:
+        stop_app(process)
+
+
+async def check_drain(env: dict) -> bool:
+    """请求进行中发送 SIGTERM：已接受的请求应全部完成"""
+    env = dict(env, STUB_LLM_LATENCY="1.0")
+    stub = subprocess.Popen([sys.executable, "-m", "benchmarks.stub_server"], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    process = start_app(2, env)
+    try:
+        async with client() as http:
+            await wait_ready(http)
+            task = asyncio.ensure_future(load(http, 20, 20, "drain"))
+            await asyncio.sleep(0.3)
+            process.send_signal(signal.SIGTERM)
+            statuses = await task
+        process.wait(timeout=60)
+        return all(status == 200 for status in statuses)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        stub.terminate()
+
+
+async def main() -> None:
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    levels = [int(arg) for arg in sys.argv[3:]] or [1, 2, 4, 8]
+    env = app_env()
+    print(f"CPU 核数 {os.cpu_count()}，并发 {concurrency}")
+
+    stub = subprocess.Popen([sys.executable, "-m", "benchmarks.stub_server"], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await asyncio.sleep(1)
+        for workers in levels:
+            await run_level(workers, concurrency, total, env)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    drained = await check_drain(env)
+    print(f"优雅停机：{'进行中的请求全部完成' if drained else '有请求在停机时失败'}")
+    if not drained:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,216 @@
+"""
+本地压测用的上游桩服务
+
+同时模拟以下三个上游，延迟可通过环境变量配置：
+1. OpenRouter / OpenAI 兼容的 /chat/completions 接口
+2. 和风天气的城市搜索与天气实况接口
+3. 天行数据的综合新闻接口
+
+环境变量：
+- STUB_LLM_LATENCY: LLM 接口延迟（秒），默认 0.2
+- STUB_TOOL_LATENCY: 工具接口延迟（秒），默认 0.05
+- STUB_TOKEN_LATENCY: 流式输出时每个 token 的间隔（秒），默认 0.01
+- STUB_LLM_CONCURRENCY: LLM 接口同时处理的最大请求数，超出的请求排队，模拟提供方过载，默认 0 不限制
+
+故障注入（只作用于天气与新闻接口，每次请求时读取，运行中修改环境变量即可切换场景）：
+- STUB_FAULT_ERROR_RATE: 返回 HTTP 503 的比例，默认 0
+- STUB_FAULT_TIMEOUT_RATE: 挂起 STUB_FAULT_TIMEOUT 秒(默认 30)不响应的比例，默认 0
+- STUB_FAULT_SLOW_RATE: 额外延迟 STUB_FAULT_SLOW_LATENCY 秒(默认 0.5)的比例，用于模拟长尾，默认 0
+"""
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CITIES = {
+    "北京": "101010100",
+    "上海": "101020100",
+    "深圳": "101280601",
+    "广州": "101280101",
+    "杭州": "101210101",
+}
+
+app = FastAPI(title="stub upstreams")
+
+
+# 各工具接口收到的请求数(含注入故障的请求)，压测脚本与桩服务同进程时可直接读取
+REQUEST_COUNTS: Counter = Counter()
+
+
+def _latency(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+
+
+async def _llm_wait() -> None:
+    global _llm_semaphore
+    capacity = int(os.getenv("STUB_LLM_CONCURRENCY", "0"))
+    if capacity <= 0:
+        await asyncio.sleep(_latency("STUB_LLM_LATENCY", 0.2))
+        return
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(capacity)
+    async with _llm_semaphore:
+        await asyncio.sleep(_latency("STUB_LLM_LATENCY", 0.2))
+
+
+async def _tool_request(endpoint: str) -> Optional[JSONResponse]:
+    """模拟工具接口的延迟并按配置注入故障；返回非 None 时直接作为响应"""
+    REQUEST_COUNTS[endpoint] += 1
+    await asyncio.sleep(_latency("STUB_TOOL_LATENCY", 0.05))
+    roll = random.random()
+    error_rate = _latency("STUB_FAULT_ERROR_RATE", 0)
+    if roll < error_rate:
+        return JSONResponse({"code": "503", "message": "injected fault"}, status_code=503)
+    if roll < error_rate + _latency("STUB_FAULT_TIMEOUT_RATE", 0):
+        await asyncio.sleep(_latency("STUB_FAULT_TIMEOUT", 30))
+    elif random.random() < _latency("STUB_FAULT_SLOW_RATE", 0):
+        await asyncio.sleep(_latency("STUB_FAULT_SLOW_LATENCY", 0.5))
+    return None
+
+
+def _plan_tool_calls(text: str) -> List[Dict[str, Any]]:
+    """根据用户消息模拟 LLM 的工具调用决策"""
+    calls = []
+    if "天气" in text:
+        cities = [city for city in CITIES if city in text] or ["北京"]
+        for city in cities:
+            calls.append({"name": "weather", "args": {"city": city}})
+    if "新闻" in text:
+        calls.append({"name": "news", "args": {"topic": "科技"}})
+    return calls
+
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await _llm_wait()
+
+    messages = body.get("messages", [])
+    last = messages[-1] if messages else {}
+    message: Dict[str, Any] = {"role": "assistant", "content": ""}
+    finish_reason = "stop"
+
+    calls = _plan_tool_calls(last.get("content") or "") if last.get("role") == "user" else []
+    if calls:
+        message["tool_calls"] = [
+            {
+                "id": f"call_{i}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call["args"], ensure_ascii=False)},
+            }
+            for i, call in enumerate(calls)
+        ]
+        finish_reason = "tool_calls"
+    else:
+        message["content"] = "这是来自桩服务的回答。"
+
+    if body.get("stream"):
+        return StreamingResponse(_stream_chunks(body.get("model", "stub"), message, finish_reason), media_type="text/event-stream")
+
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in messages)
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": prompt_chars, "completion_tokens": 10, "total_tokens": prompt_chars + 10},
+    }
+
+
+async def _stream_chunks(model: str, message: Dict[str, Any], finish_reason: str):
+    """按 OpenAI 流式格式逐字输出回答或一次性输出工具调用"""
+    def chunk(delta: Dict[str, Any], finish: Any = None) -> str:
+        payload = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+    if message.get("tool_calls"):
+        for i, call in enumerate(message["tool_calls"]):
+            yield chunk({"tool_calls": [dict(call, index=i)]})
+    else:
+        for char in message["content"]:
+            await asyncio.sleep(_latency("STUB_TOKEN_LATENCY", 0.01))
+            yield chunk({"content": char})
+    yield chunk({}, finish_reason)
+    yield "data: [DONE]\n\n"
+
+
+@app.get("/geo/v2/city/lookup")
+async def city_lookup(location: str = "", range: str = "cn"):
+    fault = await _tool_request("city_lookup")
+    if fault is not None:
+        return fault
+    location_id = CITIES.get(location)
+    if not location_id:
+        return {"code": "404"}
+    return {"code": "200", "location": [{"name": location, "id": location_id, "adm1": location, "adm2": location, "country": "中国"}]}
+
+
+@app.get("/v7/weather/now")
+async def weather_now(location: str = ""):
+    fault = await _tool_request("weather_now")
+    if fault is not None:
+        return fault
+    obs_time = time.strftime("%Y-%m-%dT%H:%M+08:00", time.localtime())
+    return {"code": "200", "now": {"obsTime": obs_time, "temp": "25", "text": "晴"}}
+
+
+@app.get("/generalnews/index")
+async def general_news(word: str = ""):
+    fault = await _tool_request("general_news")
+    if fault is not None:
+        return fault
+    items = [{"title": f"{word}新闻 {i}", "source": "桩服务", "ctime": "2024-01-01 00:00"} for i in range(3)]
+    return {"code": 200, "msg": "success", "result": {"newslist": items}}
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 18080) -> uvicorn.Server:
+    """在后台线程启动桩服务，返回 server 以便调用方停止"""
+    config = uvicorn.Config(app, host=host, port=port, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+# 压测产生的应用日志写到临时目录，不写入仓库下的 logs/
+BENCH_LOG_FILE = os.path.join(tempfile.gettempdir(), "smart-agent-bench", "app.log")
+
+
+def configure_env(host: str = "127.0.0.1", port: int = 18080) -> None:
+    """把应用的上游地址指向桩服务、日志写到临时目录，需在导入应用模块之前调用"""
+    base = f"http://{host}:{port}"
+    os.environ.setdefault("LOG_FILE", BENCH_LOG_FILE)
+    os.environ.update({
+        "QWEATHER_API_KEY": "stub",
+        "QWEATHER_BASE_URL": base,
+        "TIAN_API_KEY": "stub",
+        "TIAN_API_BASE_URL": base,
+        "OPENROUTER_API_KEY": "stub",
+        "OPENROUTER_BASE_URL": base,
+    })
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("STUB_PORT", "18080")))
@@ -1,4 +1,5 @@
 import os
+from typing import Literal
 from pydantic_settings import BaseSettings
 from pydantic import Field, field_validator, ValidationInfo
 
@@ -25,6 +26,42 @@ class APISettings(BaseSettings):
     openrouter_api_key: str = Field(default_factory=lambda: os.getenv("OPENROUTER_API_KEY", ""), description="OpenRouter API Key")
     openrouter_base_url: str = Field(default_factory=lambda: os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"), description="OpenRouter API 基础 URL")
 
+    # 上游 HTTP 连接池配置
+    http_connect_timeout: float = Field(default=3.0, description="上游 HTTP 连接超时(秒)")
+    http_read_timeout: float = Field(default=10.0, description="上游 HTTP 读取超时(秒)")
+    http_max_connections: int = Field(default=50, description="每个上游主机的最大连接数")
+    http_max_keepalive_connections: int = Field(default=20, description="每个上游主机保持的最大空闲连接数")
+    http_keepalive_expiry: float = Field(default=30.0, description="空闲连接保活时间(秒)")
+    http2_enabled: bool = Field(default=False, description="是否启用 HTTP/2(需安装 h2)")
+
+    # 上游弹性策略配置
+    upstream_max_retries: int = Field(default=2, description="可恢复错误(超时、网络、429、5xx)的最大重试次数")
+    upstream_retry_backoff: float = Field(default=0.1, description="重试退避的基准时间(秒)，按指数增长并加全抖动")
+    upstream_retry_backoff_cap: float = Field(default=1.0, description="重试退避的最长等待(秒)")
+    upstream_retry_budget_ratio: float = Field(default=0.2, description="重试(含对冲)请求占首次请求的最大比例，所有上游共享")
+    upstream_retry_min_per_second: float = Field(default=1.0, description="重试预算每秒保底补充的令牌数")
+    upstream_breaker_failures: int = Field(default=5, description="连续失败多少次后打开熔断器")
+    upstream_breaker_reset_timeout: float = Field(default=30.0, description="熔断器打开后多久放行探测请求(秒)")
+    upstream_hedge_enabled: bool = Field(default=False, description="是否在请求超过近期 p95 耗时后发送对冲请求")
+    upstream_hedge_percentile: float = Field(default=0.95, description="对冲延迟取近期成功请求耗时的分位数")
+    upstream_hedge_min_delay: float = Field(default=0.05, description="对冲延迟的下限(秒)")
+    upstream_stale_fallback: bool = Field(default=True, description="上游不可用时是否返回已过期的缓存数据")
+    upstream_stale_max_age: int = Field(default=6 * 3600, description="过期多久以内的缓存数据仍可作为陈旧数据返回(秒)")
+
+    # 上游限流与配额配置(0 表示不限制)；配置了 REDIS_URL 时多个 worker 共享令牌桶与配额计数
+    qweather_rate_limit: float = Field(default=0, description="和风天气每秒最多请求数")
+    qweather_rate_burst: int = Field(default=0, description="和风天气令牌桶容量(允许的突发请求数)，0 表示与每秒请求数相同")
+    qweather_daily_quota: int = Field(default=0, description="和风天气每日请求配额")
+    tian_api_rate_limit: float = Field(default=0, description="天行数据每秒最多请求数")
+    tian_api_rate_burst: int = Field(default=0, description="天行数据令牌桶容量(允许的突发请求数)，0 表示与每秒请求数相同")
+    tian_api_daily_quota: int = Field(default=0, description="天行数据每日请求配额")
+    upstream_rate_limit_mode: Literal["queue", "fail_fast"] = Field(
+        default="queue", description="令牌不足时的处理方式：queue 排队等待(最长 UPSTREAM_RATE_LIMIT_MAX_WAIT 秒)、fail_fast 直接失败"
+    )
+    upstream_rate_limit_max_wait: float = Field(default=1.0, description="queue 模式下等待令牌的最长时间(秒)")
+    upstream_rate_limit_reserve: float = Field(default=0.2, description="令牌桶中为交互请求保留的比例，批量请求不能使用这部分令牌")
+    upstream_quota_degrade_ratio: float = Field(default=0.9, description="当日配额用量达到该比例后，有陈旧缓存数据的请求不再调用上游")
+
     @field_validator("qweather_api_key", "qweather_base_url", "tian_api_key", "tian_api_base_url", "openrouter_api_key", "openrouter_base_url")
     @classmethod
     def validate_not_empty(cls, v: str, info: ValidationInfo) -> str:
@@ -32,6 +69,37 @@ class APISettings(BaseSettings):
             raise ValueError(f"字段 {info.field_name} 不能为空")
         return v.strip()
 
+    @field_validator("upstream_max_retries", "upstream_retry_backoff", "upstream_retry_backoff_cap",
+                     "upstream_retry_budget_ratio", "upstream_retry_min_per_second", "upstream_hedge_min_delay",
+                     "qweather_rate_limit", "qweather_rate_burst", "qweather_daily_quota",
+                     "tian_api_rate_limit", "tian_api_rate_burst", "tian_api_daily_quota", "upstream_rate_limit_max_wait")
+    @classmethod
+    def validate_non_negative(cls, v: float) -> float:
+        if v < 0:
+            raise ValueError("值不能小于0")
+        return v
+
+    @field_validator("upstream_breaker_failures", "upstream_breaker_reset_timeout", "upstream_stale_max_age")
+    @classmethod
+    def validate_positive(cls, v: float) -> float:
+        if v <= 0:
+            raise ValueError("值必须大于0")
+        return v
+
+    @field_validator("upstream_hedge_percentile")
+    @classmethod
+    def validate_percentile(cls, v: float) -> float:
+        if not 0 < v < 1:
+            raise ValueError("分位数必须在 (0, 1) 之间")
+        return v
+
+    @field_validator("upstream_rate_limit_reserve", "upstream_quota_degrade_ratio")
+    @classmethod
+    def validate_ratio(cls, v: float) -> float:
+        if not 0 <= v <= 1:
+            raise ValueError("比例必须在 [0, 1] 之间")
+        return v
+
     class Config:
         env_prefix = ""
         case_sensitive = False
@@ -42,9 +110,94 @@ class AppSettings(BaseSettings):
     app_name: str = Field(default="MultiTaskQAAssistant", description="应用名称")
     app_version: str = Field(default="1.0.0", description="应用版本")
     log_level: str = Field(default="INFO", description="日志级别")
+    log_file: str = Field(default="logs/app.log", description="日志文件路径")
+    log_max_bytes: int = Field(default=10 * 1024 * 1024, description="单个日志文件的最大字节数，超出后轮转")
+    log_backup_count: int = Field(default=5, description="保留的轮转日志文件数")
+    log_json: bool = Field(default=True, description="是否以 JSON 格式输出日志")
+    log_max_field_length: int = Field(default=512, description="单个日志参数格式化后的最大长度，超出部分截断")
+    log_sample_rate: float = Field(default=1.0, description="INFO 及以下级别日志的采样比例，WARNING 及以上始终记录")
+    log_queue_size: int = Field(default=100000, description="日志队列的最大记录数，写盘跟不上时丢弃最旧的记录")
+
+    # 链路追踪配置
+    tracing_enabled: bool = Field(default=True, description="是否记录请求各阶段耗时并返回 Server-Timing 响应头")
+    trace_export_path: str = Field(default="", description="OTLP JSON 格式的 trace 导出文件，为空则不导出")
+    trace_include_timings: bool = Field(default=False, description="是否默认在响应 state 中返回耗时明细")
     max_conversation_history: int = Field(default=50, description="最大对话历史记录数")
+    history_page_size: int = Field(default=50, description="/history 未指定 limit 时每页返回的消息数")
+    history_max_page_size: int = Field(default=200, description="/history 的 limit 参数上限")
     cache_ttl: int = Field(default=3600, description="缓存过期时间(秒)")
 
+    # 服务进程配置(python main.py serve)
+    server_host: str = Field(default="0.0.0.0", description="监听地址")
+    server_port: int = Field(default=8000, description="监听端口")
+    server_workers: int = Field(default=0, description="worker 进程数，0 表示与 CPU 核数相同")
+    server_graceful_timeout: int = Field(default=30, description="停机时等待进行中请求完成的最长时间(秒)")
+    server_keepalive_timeout: int = Field(default=5, description="HTTP keep-alive 空闲连接的保持时间(秒)")
+    server_backlog: int = Field(default=2048, description="监听套接字的连接队列长度")
+    warmup_enabled: bool = Field(default=True, description="启动时是否预热 LLM、工具连接池与会话存储")
+    warmup_upstream: bool = Field(default=False, description="预热时是否向 LLM 与工具上游发送 HEAD 请求建立连接")
+    warmup_connections: int = Field(default=2, description="预热时为每个上游建立的连接数")
+    warmup_timeout: float = Field(default=10.0, description="预热的最长时间(秒)，超时后直接开始服务")
+
+    # 会话存储配置
+    redis_url: str = Field(default="", description="Redis 连接地址，为空则使用内存存储")
+    redis_max_connections: int = Field(default=50, description="Redis 连接池最大连接数(每个 worker)")
+    redis_socket_timeout: float = Field(default=5.0, description="Redis 连接与读写超时(秒)")
+    redis_retry_attempts: int = Field(default=3, description="Redis 断线后的重试次数")
+    redis_retry_backoff_cap: float = Field(default=2.0, description="Redis 重连退避的最长等待(秒)")
+    redis_health_check_interval: int = Field(default=30, description="Redis 空闲连接健康检查间隔(秒)")
+    session_ttl: int = Field(default=3600, description="会话过期时间(秒)")
+    max_sessions: int = Field(default=100000, description="内存存储的最大会话数，0 表示不限制")
+    max_session_bytes: int = Field(default=256 * 1024 * 1024, description="内存存储的最大总字节数，0 表示不限制")
+    store_sweep_interval: int = Field(default=60, description="后台清理过期会话的间隔(秒)")
+    session_concurrency_policy: Literal["queue", "reject", "merge"] = Field(
+        default="queue", description="同一会话并发消息的处理策略：queue 排队、reject 拒绝(409)、merge 合并"
+    )
+    session_lock_timeout: float = Field(default=60.0, description="queue 策略下等待会话锁的最长时间(秒)")
+
+    # 上下文窗口配置
+    context_token_budget: int = Field(default=3000, description="发送给 LLM 的历史消息 token 预算(不含摘要)")
+    context_min_recent_messages: int = Field(default=4, description="无论预算多少都原样保留的最近消息数")
+
+    # 工具调用配置
+    max_parallel_tool_calls: int = Field(default=4, description="单次回复中并发执行的最大工具调用数")
+    max_tool_iterations: int = Field(default=3, description="单条消息最多进行的工具调用轮数")
+    template_answers: bool = Field(default=False, description="text 输出时工具结果是否直接按模板渲染回答，跳过第二次 LLM 调用")
+
+    # 准入控制配置(/chat 与 /chat/stream，每个 worker 独立)
+    admission_enabled: bool = Field(default=True, description="是否限制同时处理的聊天请求数，超出时排队或返回 429")
+    admission_initial_limit: int = Field(default=32, description="同时处理的聊天请求数的初始上限，之后按 LLM 耗时自适应调整")
+    admission_min_limit: int = Field(default=4, description="自适应并发上限的下限")
+    admission_max_limit: int = Field(default=128, description="自适应并发上限的上限")
+    admission_queue_size: int = Field(default=256, description="等待处理的聊天请求的最大排队数")
+    admission_queue_timeout: float = Field(default=10.0, description="排队的最长时间(秒)，预计等不到时直接返回 429")
+    admission_session_limit: int = Field(default=2, description="单个会话同时处理的最大请求数")
+    admission_session_queue: int = Field(default=4, description="单个会话的最大排队请求数")
+    admission_latency_tolerance: float = Field(default=2.0, description="LLM 耗时超过长期均值的多少倍时下调并发上限")
+
+    # 批量接口配置
+    batch_concurrency: int = Field(default=8, description="/chat/batch 单个批次的默认并发数，也是请求可指定的上限")
+    batch_max_size: int = Field(default=10000, description="/chat/batch 单个批次的最大请求数")
+    batch_admission_max_wait: float = Field(
+        default=60.0, description="批量条目被准入控制拒绝后退避重试的最长累计等待时间(秒)，超出后该条返回 429"
+    )
+
+    # 快速路由配置
+    fast_router_enabled: bool = Field(default=True, description="明显的工具意图是否跳过 LLM 直接调用工具")
+    fast_router_threshold: float = Field(default=0.85, description="快速路由直接调用工具所需的最低置信度")
+
+    # 响应缓存配置(仅用于无上下文的一次性问题)
+    response_cache_enabled: bool = Field(default=False, description="是否启用问答响应缓存")
+    response_cache_size: int = Field(default=4096, description="响应缓存的最大条目数")
+    response_cache_news_ttl: int = Field(default=300, description="涉及新闻工具的回答的缓存时间(秒)")
+
+    # 天气工具缓存配置
+    weather_city_cache_size: int = Field(default=4096, description="城市 ID 索引的最大条目数")
+    weather_city_cache_ttl: int = Field(default=30 * 24 * 3600, description="城市 ID 索引的过期时间(秒)")
+    weather_city_cache_path: str = Field(default="", description="城市 ID 索引的持久化文件路径，为空则仅保存在内存")
+    weather_obs_cache_size: int = Field(default=1024, description="天气实况缓存的最大条目数")
+    weather_obs_ttl: int = Field(default=600, description="天气实况的刷新间隔(秒)，以 obsTime 为起点计算")
+
     @field_validator('log_level')
     def validate_log_level(cls, v):
         """验证日志级别"""
@@ -53,13 +206,52 @@ class AppSettings(BaseSettings):
             raise ValueError(f"日志级别必须是以下之一: {valid_levels}")
         return v.upper()
 
-    @field_validator('max_conversation_history', 'cache_ttl')
+    @field_validator('log_sample_rate')
+    def validate_sample_rate(cls, v):
+        """验证采样比例"""
+        if not 0 <= v <= 1:
+            raise ValueError("采样比例必须在 [0, 1] 之间")
+        return v
+
+    @field_validator('max_conversation_history', 'history_page_size', 'history_max_page_size', 'cache_ttl', 'max_parallel_tool_calls', 'max_tool_iterations',
+                     'session_ttl', 'store_sweep_interval', 'redis_max_connections',
+                     'context_token_budget', 'context_min_recent_messages',
+                     'weather_city_cache_size', 'weather_city_cache_ttl',
+                     'weather_obs_cache_size', 'weather_obs_ttl',
+                     'response_cache_size', 'response_cache_news_ttl',
+                     'batch_concurrency', 'batch_max_size', 'batch_admission_max_wait',
+                     'admission_initial_limit', 'admission_min_limit', 'admission_max_limit',
+                     'admission_queue_size', 'admission_queue_timeout', 'admission_session_limit', 'admission_session_queue',
+                     'server_port', 'server_graceful_timeout', 'server_keepalive_timeout', 'server_backlog',
+                     'warmup_connections',
+                     'log_max_bytes', 'log_backup_count', 'log_max_field_length', 'log_queue_size')
     def validate_positive_int(cls, v):
         """验证正整数"""
         if v <= 0:
             raise ValueError("值必须大于0")
         return v
 
+    @field_validator('fast_router_threshold')
+    def validate_threshold(cls, v):
+        """验证置信度阈值"""
+        if not 0 < v <= 1:
+            raise ValueError("阈值必须在 (0, 1] 之间")
+        return v
+
+    @field_validator('admission_latency_tolerance')
+    def validate_tolerance(cls, v):
+        """验证耗时容忍倍数"""
+        if v <= 1:
+            raise ValueError("容忍倍数必须大于1")
+        return v
+
+    @field_validator('max_sessions', 'max_session_bytes', 'server_workers')
+    def validate_non_negative_int(cls, v):
+        """验证非负整数(0 表示不限制)"""
+        if v < 0:
+            raise ValueError("值不能小于0")
+        return v
+
     class Config:
         env_prefix = ""
         case_sensitive = False
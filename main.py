@@ -1,5 +1,100 @@
+"""
+服务入口
+
+- python main.py dev     开发模式：单进程，代码变更后自动重载(不带子命令时的默认行为)
+- python main.py serve   生产模式：多 worker，uvloop + httptools，启动预热，SIGTERM 后优雅停机
+
+serve 的参数默认值来自 AppSettings(SERVER_* 环境变量)，命令行参数优先。
+"""
+import argparse
+import glob
+import importlib.util
+import os
+import sys
+import tempfile
+
 import uvicorn
 
-if __name__ == "__main__" :
-    # print("Hello, World!")
-    uvicorn.run("api.main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+APP = "api.main:app"
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def _prepare_metrics_dir(workers: int) -> None:
+    """
+    多 worker 时 Prometheus 指标需要共享目录；未指定时使用临时目录。
+    目录中上次运行留下的数据在启动前清空，需在 worker 进程启动前设置
+    """
+    if workers <= 1 or not _available("prometheus_client"):
+        return
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        path = tempfile.mkdtemp(prefix="smart-agent-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    os.makedirs(path, exist_ok=True)
+    for leftover in glob.glob(os.path.join(path, "*.db")):
+        os.remove(leftover)
+
+
+def serve(args: argparse.Namespace) -> None:
+    from config.settings import settings
+
+    app = settings.app
+    workers = args.workers if args.workers is not None else app.server_workers
+    workers = workers or os.cpu_count() or 1
+    loop = args.loop if args.loop != "auto" else ("uvloop" if _available("uvloop") else "asyncio")
+    http = args.http if args.http != "auto" else ("httptools" if _available("httptools") else "h11")
+
+    if workers > 1 and not app.redis_url:
+        print("⚠️  未配置 REDIS_URL，会话保存在各 worker 的内存中，同一会话的请求可能落到不同 worker", file=sys.stderr)
+    _prepare_metrics_dir(workers)
+
+    print(f"🚀 启动 {APP}：{workers} 个 worker，loop={loop}，http={http}", file=sys.stderr)
+    uvicorn.run(
+        APP,
+        host=args.host or app.server_host,
+        port=args.port or app.server_port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        lifespan="on",
+        backlog=app.server_backlog,
+        timeout_keep_alive=app.server_keepalive_timeout,
+        timeout_graceful_shutdown=args.graceful_timeout or app.server_graceful_timeout,
+        access_log=args.access_log,
+    )
+
+
+def dev(args: argparse.Namespace) -> None:
+    uvicorn.run(APP, host=args.host or "127.0.0.1", port=args.port or 8000, reload=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Smart Agent API 服务入口")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="生产模式：多 worker 运行")
+    serve_parser.add_argument("--host", help="监听地址，默认 SERVER_HOST")
+    serve_parser.add_argument("--port", type=int, help="监听端口，默认 SERVER_PORT")
+    serve_parser.add_argument("--workers", type=int, help="worker 进程数，0 表示与 CPU 核数相同，默认 SERVER_WORKERS")
+    serve_parser.add_argument("--loop", choices=["auto", "uvloop", "asyncio"], default="auto", help="事件循环实现")
+    serve_parser.add_argument("--http", choices=["auto", "httptools", "h11"], default="auto", help="HTTP 协议解析实现")
+    serve_parser.add_argument("--graceful-timeout", type=int, help="停机时等待进行中请求完成的最长时间(秒)")
+    serve_parser.add_argument("--access-log", action="store_true", help="输出 uvicorn 访问日志")
+    serve_parser.set_defaults(func=serve)
+
+    dev_parser = subparsers.add_parser("dev", help="开发模式：单进程，代码变更后自动重载")
+    dev_parser.add_argument("--host")
+    dev_parser.add_argument("--port", type=int)
+    dev_parser.set_defaults(func=dev)
+
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(["dev"])
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from typing import Any, Dict, Literal, Optional
+from typing import Any, Dict, List, Literal, Optional
 from pydantic import BaseModel, Field
 
 # 定义工具调用的Pydantic模型
@@ -12,6 +12,19 @@ class ChatRequest(BaseModel):
     message: str
     output_format: Literal["text", "json"] = Field(default="text", description="指定输出格式，可以是'text'或'json'.")
     metadata: Optional[Dict[str, Any]] = Field(default_factory=dict, description="附加的元数据，用于提供上下文信息.")
+    template_answer: Optional[bool] = Field(
+        default=None,
+        description="工具调用后是否直接按工具模板渲染回答，跳过第二次 LLM 调用；不传时 json 输出默认开启，text 输出跟随服务端配置.",
+    )
+
+# 定义批量聊天中单条请求的Pydantic模型
+class BatchChatItem(ChatRequest):
+    id: Optional[str] = Field(default=None, description="调用方自定义的条目 ID，在结果中原样返回.")
+
+# 定义批量聊天请求的Pydantic模型(JSON 格式；JSONL 格式每行一个 BatchChatItem)
+class BatchChatRequest(BaseModel):
+    requests: List[Dict[str, Any]] = Field(description="批量处理的聊天请求，每项的格式同 BatchChatItem.")
+    concurrency: Optional[int] = Field(default=None, description="并发处理的请求数，不超过服务端配置的上限.")
 
 # 定义聊天响应的Pydantic模型
 class ChatResponse(BaseModel):
@@ -24,4 +37,8 @@ class ChatResponse(BaseModel):
 class HistoryResponse(BaseModel):
     session_id: str
     messages: list[Dict[str, Any]]
+    offset: int = Field(default=0, description="messages 中第一条消息的绝对序号(从 0 开始，按会话累计消息数计).")
+    total: int = Field(default=0, description="会话累计消息数，超出最大历史条数的早期消息已不再保存.")
+    next_cursor: Optional[int] = Field(default=None, description="还有更早的消息时，作为 cursor 参数获取上一页.")
+    next_since: int = Field(default=0, description="作为 since 参数获取本页之后的新消息.")
 
@@ -1,65 +1,648 @@
+import asyncio
 import json
 import time
-from typing import Any, Dict, Optional, cast
+from collections import OrderedDict
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-try:
-    import redis
-except Exception:
-    redis = None
+from config.settings import settings
+from utils.logger import get_logger
+from utils.tracing import span
 
+logger = get_logger(__name__)
+
+# 后台清理每处理多少个会话让出一次事件循环
+SWEEP_BATCH_SIZE = 10000
+
+# 原子追加一轮对话：校验版本号 -> 累计消息数 += 条数 -> RPUSH/LTRIM -> HSET -> 版本号 +1 -> 刷新过期时间
+# KEYS: messages, meta
+# ARGV: 期望版本号('' 表示不校验), ttl, 最大消息数, 消息条数, 消息..., 字段/值...
+# 返回: {新版本号, 累计消息数}，版本冲突时返回 {-1, 0}
+APPEND_TURN_SCRIPT = """
+local stored = redis.call('HGET', KEYS[2], 'version')
+local current = tonumber(stored or '0')
+-- 会话已过期或被删除时没有可覆盖的并发写入，不算冲突
+if stored and ARGV[1] ~= '' and current ~= tonumber(ARGV[1]) then
+    return {-1, 0}
+end
+local count = tonumber(ARGV[4])
+local index = 5
+-- 累计消息数只在这里递增，不信任调用方按可能过期的状态算出的值；旧会话没有该字段时以现有条数为起点
+if redis.call('HEXISTS', KEYS[2], 'message_count') == 0 then
+    redis.call('HSET', KEYS[2], 'message_count', redis.call('LLEN', KEYS[1]))
+end
+local total = redis.call('HINCRBY', KEYS[2], 'message_count', count)
+if count > 0 then
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, index, index + count - 1))
+    if tonumber(ARGV[3]) > 0 then
+        redis.call('LTRIM', KEYS[1], -tonumber(ARGV[3]), -1)
+    end
+end
+index = index + count
+if #ARGV >= index then
+    redis.call('HSET', KEYS[2], unpack(ARGV, index, #ARGV))
+end
+local version = current + 1
+redis.call('HSET', KEYS[2], 'version', version)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return {version, total}
+"""
+
+# 按绝对序号读取一页历史消息，只 LRANGE 需要的区间，分页规则同 _page_bounds
+# KEYS: messages, meta
+# ARGV: since('' 表示不指定), before('' 表示不指定), limit
+# 返回: version, updated_at, message_count, 最早一条保留消息的绝对序号, 本页第一条的绝对序号, 消息列表
+HISTORY_PAGE_SCRIPT = """
+local length = redis.call('LLEN', KEYS[1])
+local meta = redis.call('HMGET', KEYS[2], 'version', 'updated_at', 'message_count')
+local total = math.max(tonumber(meta[3]) or length, length)
+local first = total - length
+local limit = tonumber(ARGV[3])
+local start, stop
+if ARGV[1] ~= '' then
+    start = math.max(tonumber(ARGV[1]), first)
+    stop = math.min(start + limit, total)
+else
+    stop = total
+    if ARGV[2] ~= '' then
+        stop = math.min(tonumber(ARGV[2]), total)
+    end
+    start = math.max(stop - limit, first)
+end
+local messages = {}
+if stop > start then
+    messages = redis.call('LRANGE', KEYS[1], start - first, stop - first - 1)
+end
+return {meta[1] or false, meta[2] or false, total, first, math.min(start, total), messages}
+"""
+
+
+@dataclass
+class HistoryPage:
+    """
+    一页历史消息
+
+    offset 为 messages[0] 的绝对序号，total 为会话累计消息数(含已截断的)，
+    first 为仍保存的最早一条消息的绝对序号
+    """
+
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    offset: int = 0
+    total: int = 0
+    first: int = 0
+    version: int = 0
+    updated_at: int = 0
+
+    @property
+    def exists(self) -> bool:
+        """会话是否存在：每次写入都会设置 updated_at"""
+        return bool(self.version or self.updated_at)
+
+
+def _page_bounds(total: int, length: int, since: Optional[int], before: Optional[int], limit: int) -> Tuple[int, int]:
+    """
+    计算一页消息的绝对序号区间 [start, stop)
+
+    最早的 total - length 条消息已被截断，不再返回：
+    - since: 序号 >= since 的消息，从旧到新取 limit 条(轮询新消息)
+    - before: 序号 < before 的最近 limit 条(向前翻页)
+    - 都不指定：最近的 limit 条
+    """
+    first = total - length
+    if since is not None:
+        start = max(since, first)
+        return min(start, total), min(start + limit, total)
+    stop = total if before is None else min(before, total)
+    return max(stop - limit, first), stop
+
+
+def _slice_page(state: Dict[str, Any], since: Optional[int], before: Optional[int], limit: int) -> HistoryPage:
+    """从完整的会话状态中截取一页"""
+    messages = state.get("messages", [])
+    total = max(state.get("message_count", len(messages)), len(messages))
+    first = total - len(messages)
+    start, stop = _page_bounds(total, len(messages), since, before, limit)
+    return HistoryPage(
+        messages=list(messages[start - first:max(stop, start) - first]),
+        offset=start,
+        total=total,
+        first=first,
+        version=state.get("version", 0),
+        updated_at=state.get("updated_at", 0),
+    )
+
+
+# 迁移完成后只在旧 key 的值未被改动时删除，迁移期间被改写的 key 保留
+# KEYS: 旧版 key  ARGV: 迁移时读到的值
+DELETE_IF_UNCHANGED_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SessionConflictError(Exception):
+    """同一会话存在并发写入，且当前策略不允许排队或合并"""
+
+
+class SessionLocks:
+    """
+    进程内的会话锁表，锁在没有持有者和等待者时自动回收
+
+    是否正忙按引用计数(持有者 + 等待者)判断，而不是 lock.locked()：
+    release() 把锁交给排队的等待者后、等待者被唤醒前，locked() 短暂为 False，
+    此时到达的请求仍应视为会话正忙。
+    """
 
-class InMemoryStore:
     def __init__(self) -> None:
-        self._store: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def hold(self, session_id: str, wait: bool, timeout: float) -> AsyncIterator[None]:
+        lock, refs = self._locks.get(session_id, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        busy = refs > 0
+        self._locks[session_id] = (lock, refs + 1)
+        try:
+            if busy and not wait:
+                raise SessionConflictError(f"会话 {session_id} 正在处理其他消息")
+            try:
+                with span("session.lock") if busy else nullcontext():
+                    await asyncio.wait_for(lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                raise SessionConflictError(f"会话 {session_id} 等待超时")
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            lock, refs = self._locks[session_id]
+            if refs <= 1:
+                del self._locks[session_id]
+            else:
+                self._locks[session_id] = (lock, refs - 1)
 
-    def get(self, key: str) -> Dict[str, Any]:
-        value = self._store.get(key, {})
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+def _estimate_size(value: Dict[str, Any]) -> int:
+    """按 JSON 序列化后的字节数估算会话占用的内存"""
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+class InMemoryStore:
+    """
+    有界、可过期的内存存储
+
+    - 读取时检查 _expires_at，过期即删除
+    - 按 LRU 顺序在会话数或总字节数超限时淘汰
+    - sweep() 供后台任务周期性清理过期会话
+    """
+
+    def __init__(self, max_sessions: int = 0, max_bytes: int = 0) -> None:
+        # 0 表示不限制
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._store: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _delete(self, key: str) -> None:
+        self._store.pop(key, None)
+        self._bytes -= self._sizes.pop(key, 0)
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """返回未过期的已存储状态(不复制)，并刷新 LRU 顺序"""
+        value = self._store.get(key)
+        if value is None:
+            return None
+        if value.get("_expires_at", 0) <= time.time():
+            self._delete(key)
+            self.expirations += 1
+            return None
+        self._store.move_to_end(key)
         return value
 
-    def set(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> None:
+    async def get(self, key: str) -> Dict[str, Any]:
+        value = self._lookup(key)
+        if value is None:
+            return {}
+        # 返回副本，调用方修改消息列表不会影响已存储的数据和容量统计
+        value = dict(value)
+        value.pop("_expires_at", None)
+        if "messages" in value:
+            value["messages"] = list(value["messages"])
+        return value
+
+    async def get_page(self, key: str, since: Optional[int], before: Optional[int], limit: int) -> HistoryPage:
+        """只复制请求的那一页消息"""
+        value = self._lookup(key)
+        if value is None:
+            return HistoryPage()
+        return _slice_page(value, since, before, limit)
+
+    async def set(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> None:
         # 复制一份，避免外部引用同一 dict 导致副作用
         value = dict(value)
-        # 记录过期时间戳，便于后续清理
+        # 记录过期时间戳，读取和后台清理时据此判断
         value["_expires_at"] = int(time.time()) + ttl_seconds
+        size = _estimate_size(value)
+
+        self._delete(key)
         self._store[key] = value
+        self._sizes[key] = size
+        self._bytes += size
+        self._evict()
+
+    async def append(
+        self,
+        key: str,
+        messages: List[Dict[str, Any]],
+        fields: Dict[str, Any],
+        ttl_seconds: int,
+        max_messages: int,
+        expected_version: Optional[int] = None,
+    ) -> Tuple[int, int]:
+        """
+        追加消息并更新标量字段，消息列表只保留最近 max_messages 条，返回新版本号与累计消息数
+
+        读取、计算与写入之间没有 await，在事件循环中不会与同一会话的其他追加交错。
+        """
+        value = self._store.get(key)
+        if value is None or value.get("_expires_at", 0) <= time.time():
+            value = {}
+        version = value.get("version", 0)
+        # 会话已过期或被淘汰时没有可覆盖的并发写入，不算冲突
+        if value and expected_version is not None and version != expected_version:
+            raise SessionConflictError(f"会话 {key} 版本冲突：期望 {expected_version}，实际 {version}")
+        stored = value.get("messages", [])
+        total = max(value.get("message_count", len(stored)), len(stored)) + len(messages)
+        new_value = dict(value)
+        new_value.update(fields)
+        new_value["messages"] = (list(stored) + list(messages))[-max_messages:]
+        new_value["message_count"] = total
+        new_value["version"] = version + 1
+        await self.set(key, new_value, ttl_seconds)
+        return version + 1, total
+
+    def _evict(self) -> None:
+        """淘汰最久未使用的会话，直到满足容量限制"""
+        while self._store and (
+            (self.max_sessions and len(self._store) > self.max_sessions)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            key = next(iter(self._store))
+            self._delete(key)
+            self.evictions += 1
+
+    async def sweep(self) -> int:
+        """清理所有过期会话，分批让出事件循环，返回清理数量"""
+        now = time.time()
+        removed = 0
+        keys = list(self._store.keys())
+        for i in range(0, len(keys), SWEEP_BATCH_SIZE):
+            for key in keys[i:i + SWEEP_BATCH_SIZE]:
+                value = self._store.get(key)
+                if value is not None and value.get("_expires_at", 0) <= now:
+                    self._delete(key)
+                    removed += 1
+            await asyncio.sleep(0)
+        self.expirations += removed
+        return removed
 
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "sessions": len(self._store),
+            "bytes": self._bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class AsyncRedisStore:
+    """
+    基于 redis.asyncio 的会话存储
+
+    每个会话拆成两个 key：
+    - session:{id}:messages  消息列表(每条一个 JSON)，RPUSH 追加 + LTRIM 截断
+    - session:{id}:meta      标量状态哈希(每个字段一个 JSON)
+    读取一轮状态、写入一轮状态各只需一次往返(pipeline)。
+    连接池大小、超时与断线重试均来自配置，连接断开时按指数退避重连。
+    旧版本以整段 JSON 字符串存在 {id} 下，读取时自动迁移。
+    """
+
+    KEY_PREFIX = "session:"
+    # 应用自己写入的 key 都带命名空间前缀(会话、上游限流)；旧版会话直接以会话 ID 为 key，
+    # 带这些前缀的 key 不会是旧版会话，不做迁移
+    NAMESPACED_PREFIXES = (KEY_PREFIX, "ratelimit:")
 
-class RedisStore:
     def __init__(self, redis_url: str) -> None:
-        if not redis:
-            raise RuntimeError("redis not installed")
-        self._client = redis.Redis.from_url(redis_url, decode_responses=True)
+        # redis 客户端只在配置了 REDIS_URL 时导入，内存存储的部署不承担其导入开销
+        try:
+            import redis.asyncio as aioredis
+            from redis.asyncio.retry import Retry
+            from redis.backoff import ExponentialBackoff
+            from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+        except ImportError as e:
+            raise RuntimeError("redis not installed") from e
+        app = settings.app
+        self._pool = aioredis.ConnectionPool.from_url(
+            redis_url,
+            decode_responses=True,
+            max_connections=app.redis_max_connections,
+            socket_timeout=app.redis_socket_timeout,
+            socket_connect_timeout=app.redis_socket_timeout,
+            health_check_interval=app.redis_health_check_interval,
+            retry=Retry(ExponentialBackoff(cap=app.redis_retry_backoff_cap, base=0.05), app.redis_retry_attempts),
+            retry_on_error=[RedisConnectionError, RedisTimeoutError],
+        )
+        self._client = aioredis.Redis(connection_pool=self._pool)
+        self._append_script = self._client.register_script(APPEND_TURN_SCRIPT)
+        self._page_script = self._client.register_script(HISTORY_PAGE_SCRIPT)
+        self._delete_if_unchanged = self._client.register_script(DELETE_IF_UNCHANGED_SCRIPT)
+
+    def _keys(self, key: str) -> tuple[str, str]:
+        return f"{self.KEY_PREFIX}{key}:messages", f"{self.KEY_PREFIX}{key}:meta"
 
-    def get(self, key: str) -> Dict[str, Any]:
-        # redis.get 返回类型标注不稳定，这里做类型断言
-        raw = cast(Optional[str], self._client.get(key))
+    async def get(self, key: str) -> Dict[str, Any]:
+        messages_key, meta_key = self._keys(key)
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.lrange(messages_key, 0, -1)
+            pipe.hgetall(meta_key)
+            pipe.type(key)
+            raw_messages, raw_meta, legacy_type = await pipe.execute()
+        if not raw_messages and not raw_meta:
+            if legacy_type == "string" and self._is_legacy_key(key):
+                return await self._migrate(key)
+            return {}
+        state: Dict[str, Any] = {name: json.loads(raw) for name, raw in raw_meta.items()}
+        state["messages"] = [json.loads(raw) for raw in raw_messages]
+        return state
+
+    async def get_page(self, key: str, since: Optional[int], before: Optional[int], limit: int) -> HistoryPage:
+        """通过 Lua 脚本一次往返读取元数据与请求的消息区间，不读取整段历史"""
+        args = ["" if since is None else since, "" if before is None else before, limit]
+        version, updated_at, total, first, offset, raw_messages = await self._page_script(
+            keys=list(self._keys(key)), args=args
+        )
+        if not total and version is None and updated_at is None:
+            # 会话不存在或仍是旧版结构：按完整状态读取(会触发迁移)后截取
+            state = await self.get(key)
+            return _slice_page(state, since, before, limit) if state else HistoryPage()
+        return HistoryPage(
+            messages=[json.loads(raw) for raw in raw_messages],
+            offset=int(offset),
+            total=int(total),
+            first=int(first),
+            version=json.loads(version) if version is not None else 0,
+            updated_at=json.loads(updated_at) if updated_at is not None else 0,
+        )
+
+    async def _write(
+        self, key: str, value: Dict[str, Any], ttl_seconds: int, replace: bool, max_messages: int = 0
+    ) -> None:
+        messages_key, meta_key = self._keys(key)
+        messages = value.get("messages", [])
+        fields = {name: json.dumps(field, ensure_ascii=False) for name, field in value.items() if name != "messages"}
+        # MULTI 包裹，所有命令在一次往返中原子执行
+        async with self._client.pipeline(transaction=True) as pipe:
+            if replace:
+                pipe.delete(messages_key, meta_key)
+            if messages:
+                pipe.rpush(messages_key, *(json.dumps(msg, ensure_ascii=False) for msg in messages))
+                if max_messages:
+                    pipe.ltrim(messages_key, -max_messages, -1)
+            if fields:
+                pipe.hset(meta_key, mapping=fields)
+            pipe.expire(messages_key, ttl_seconds)
+            pipe.expire(meta_key, ttl_seconds)
+            await pipe.execute()
+
+    def _is_legacy_key(self, key: str) -> bool:
+        return not key.startswith(self.NAMESPACED_PREFIXES)
+
+    @staticmethod
+    def _parse_legacy(raw: str) -> Optional[Dict[str, Any]]:
+        """旧版会话是包含 messages 列表的 JSON 对象，其他字符串(共享 DB 中的无关 key)返回 None"""
+        try:
+            state = json.loads(raw)
+        except ValueError:
+            return None
+        if not isinstance(state, dict) or not isinstance(state.get("messages"), list):
+            return None
+        return state
+
+    async def _migrate(self, key: str) -> Dict[str, Any]:
+        """把旧版整段 JSON 字符串迁移到列表 + 哈希结构；不是旧版会话的 key 保持原样"""
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.ttl(key)
+            raw, ttl = await pipe.execute()
         if not raw:
             return {}
-        return json.loads(raw)
+        state = self._parse_legacy(raw)
+        if state is None:
+            logger.warning("key %s 不是旧版会话数据，跳过迁移", key)
+            return {}
+        await self._write(key, state, ttl if ttl > 0 else settings.app.session_ttl, replace=True)
+        if not await self._delete_if_unchanged(keys=[key], args=[raw]):
+            logger.warning("旧版会话 %s 在迁移期间被改写，保留原 key", key)
+        logger.info("会话 %s 已迁移到新的 Redis 存储结构", key)
+        return state
+
+    async def migrate_legacy_keys(self, match: str = "*") -> int:
+        """批量迁移匹配 match 的旧版会话 key(不带命名空间前缀的字符串 key)，返回迁移数量"""
+        migrated = 0
+        async for key in self._client.scan_iter(match=match, _type="string"):
+            if not self._is_legacy_key(key):
+                continue
+            if await self._migrate(key):
+                migrated += 1
+        return migrated
+
+    async def set(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> None:
+        await self._write(key, value, ttl_seconds, replace=True)
 
-    def set(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> None:
-        # 统一序列化存储为 JSON 字符串
-        raw = json.dumps(value)
-        self._client.setex(key, ttl_seconds, raw)
+    async def append(
+        self,
+        key: str,
+        messages: List[Dict[str, Any]],
+        fields: Dict[str, Any],
+        ttl_seconds: int,
+        max_messages: int,
+        expected_version: Optional[int] = None,
+    ) -> Tuple[int, int]:
+        """通过 Lua 脚本原子地校验版本并追加，一次往返完成，返回新版本号与累计消息数"""
+        args: List[Any] = [
+            "" if expected_version is None else expected_version,
+            ttl_seconds,
+            max_messages,
+            len(messages),
+        ]
+        args.extend(json.dumps(msg, ensure_ascii=False) for msg in messages)
+        for name, field in fields.items():
+            args.extend([name, json.dumps(field, ensure_ascii=False)])
+        version, total = await self._append_script(keys=list(self._keys(key)), args=args)
+        if int(version) < 0:
+            raise SessionConflictError(f"会话 {key} 版本冲突：期望 {expected_version}")
+        return int(version), int(total)
+
+    async def ping(self) -> bool:
+        try:
+            return bool(await self._client.ping())
+        except Exception as e:
+            logger.warning("Redis 健康检查失败：%s", e)
+            return False
+
+    async def close(self) -> None:
+        await self._client.aclose()
+        await self._pool.disconnect()
+
+    async def sweep(self) -> int:
+        # Redis 通过 key 过期自行清理
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis",
+            "max_connections": self._pool.max_connections,
+        }
 
 
 class StateStore:
-    def __init__(self, redis_url: str = "", ttl_seconds: int = 3600) -> None:
-        self.ttl_seconds = ttl_seconds
-        if redis_url:
+    """
+    会话状态存储
+
+    同一会话的并发消息按 concurrency_policy 处理：
+    - queue: 进程内按会话排队串行执行；跨 worker 的写入冲突(Redis 版本号不一致)时退化为合并
+    - reject: 会话正忙或写入时版本冲突，直接抛出 SessionConflictError
+    - merge: 不加锁，各自追加本轮消息(追加式存储天然合并)
+    """
+
+    def __init__(
+        self, redis_url: str = "", ttl_seconds: Optional[int] = None, concurrency_policy: Optional[str] = None
+    ) -> None:
+        self.ttl_seconds = ttl_seconds or settings.app.session_ttl
+        self.concurrency_policy = concurrency_policy or settings.app.session_concurrency_policy
+        self._locks = SessionLocks()
+        self._sweeper: Optional["asyncio.Task[None]"] = None
+        # 配置了 Redis 就始终使用 Redis：连接在首次使用时建立，断线后按退避策略重连，
+        # 不再静默回退到各 worker 互不共享的内存存储
+        self._store: Any = AsyncRedisStore(redis_url) if redis_url else self._memory_store()
+
+    @staticmethod
+    def _memory_store() -> InMemoryStore:
+        return InMemoryStore(
+            max_sessions=settings.app.max_sessions,
+            max_bytes=settings.app.max_session_bytes,
+        )
+
+    def start_sweeper(self, interval: Optional[float] = None) -> None:
+        """启动后台清理任务，需在事件循环中调用"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval or settings.app.store_sweep_interval))
+
+    async def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
             try:
-                self._store = RedisStore(redis_url)
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self._store.sweep()
+                if removed:
+                    logger.info("清理过期会话 %d 个", removed)
             except Exception:
-                # Redis 连接失败时回退到内存存储
-                self._store = InMemoryStore()
-        else:
-            self._store = InMemoryStore()
+                logger.exception("清理过期会话失败")
+
+    async def ping(self) -> bool:
+        """检查存储后端是否可用"""
+        if isinstance(self._store, AsyncRedisStore):
+            return await self._store.ping()
+        return True
+
+    async def close(self) -> None:
+        await self.stop_sweeper()
+        if isinstance(self._store, AsyncRedisStore):
+            await self._store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._store.stats()
+        stats["concurrency_policy"] = self.concurrency_policy
+        stats["locked_sessions"] = len(self._locks)
+        return stats
+
+    async def get_state(self, session_id: str) -> Dict[str, Any]:
+        with span("store.get"):
+            return await self._store.get(session_id)
 
-    def get_state(self, session_id: str) -> Dict[str, Any]:
-        return self._store.get(session_id)
+    async def get_history(
+        self, session_id: str, limit: int, since: Optional[int] = None, before: Optional[int] = None
+    ) -> HistoryPage:
+        """按绝对序号读取一页历史消息，分页规则见 _page_bounds"""
+        with span("store.history"):
+            return await self._store.get_page(session_id, since, before, limit)
 
-    def set_state(self, session_id: str, state: Dict[str, Any]) -> None:
+    async def set_state(self, session_id: str, state: Dict[str, Any]) -> None:
         # 复制后更新，避免外部继续修改同一份状态
         state = dict(state)
         state["updated_at"] = int(time.time())
-        self._store.set(session_id, state, self.ttl_seconds)
+        await self._store.set(session_id, state, self.ttl_seconds)
+
+    @asynccontextmanager
+    async def session(self, session_id: str) -> AsyncIterator[None]:
+        """按并发策略包裹一轮对话的读-处理-写过程"""
+        if self.concurrency_policy == "merge":
+            yield
+            return
+        wait = self.concurrency_policy == "queue"
+        async with self._locks.hold(session_id, wait=wait, timeout=settings.app.session_lock_timeout):
+            yield
+
+    async def append_turn(
+        self,
+        session_id: str,
+        messages: List[Dict[str, Any]],
+        fields: Dict[str, Any],
+        max_messages: int,
+        expected_version: Optional[int] = None,
+    ) -> Dict[str, int]:
+        """
+        追加本轮新增的消息并更新标量状态，不重写整段历史，
+        返回写入后的 version、message_count 与 updated_at，供调用方合并到返回给客户端的状态
+
+        expected_version 为读取状态时的版本号，用于检测其他 worker 的并发写入。
+        累计消息数(message_count)由存储层在追加时原子递增，fields 中不应包含该字段。
+        """
+        fields = dict(fields)
+        fields.pop("message_count", None)
+        fields["updated_at"] = int(time.time())
+        if self.concurrency_policy == "merge":
+            expected_version = None
+        with span("store.append"):
+            try:
+                version, total = await self._store.append(
+                    session_id, messages, fields, self.ttl_seconds, max_messages, expected_version
+                )
+            except SessionConflictError:
+                if self.concurrency_policy != "queue":
+                    raise
+                logger.warning("会话 %s 存在跨 worker 并发写入，按合并方式追加", session_id)
+                version, total = await self._store.append(session_id, messages, fields, self.ttl_seconds, max_messages)
+        return {"version": version, "message_count": total, "updated_at": fields["updated_at"]}
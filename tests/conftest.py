@@ -0,0 +1,22 @@
+"""
+测试公共配置
+
+应用的上游地址指向本地桩服务(benchmarks/stub_server.py)，日志写到临时目录；
+settings 在导入时读取环境变量，因此需在导入任何应用模块之前完成设置。
+"""
+import pytest
+
+from benchmarks.stub_server import configure_env, start_stub_server
+
+# 与压测脚本默认的 18080 错开，压测运行时也能跑测试
+STUB_PORT = 18091
+
+configure_env(port=STUB_PORT)
+
+
+@pytest.fixture(scope="session")
+def stub_server():
+    """在后台线程启动桩服务，整个测试会话共用"""
+    server = start_stub_server(port=STUB_PORT)
+    yield server
+    server.should_exit = True
@@ -0,0 +1,83 @@
+"""
+准入控制的测试：批次按一个会话参与轮转，排队时取消的请求按放行时间归还名额
+"""
+import asyncio
+from typing import List
+
+from agents.admission import AdmissionController
+
+
+def make_controller(limit: int) -> AdmissionController:
+    return AdmissionController(
+        initial_limit=limit,
+        min_limit=limit,
+        max_limit=limit,
+        queue_size=64,
+        queue_timeout=5.0,
+        session_limit=2,
+        session_queue=4,
+        latency_tolerance=2.0,
+    )
+
+
+def test_batch_items_share_one_fairness_key():
+    async def run() -> None:
+        controller = make_controller(2)
+        order: List[str] = []
+        release = asyncio.Event()
+
+        async def item(key: str, name: str, session_limit=None) -> None:
+            slot = await controller.acquire(key, session_limit)
+            order.append(name)
+            await release.wait()
+            slot.release()
+
+        batch = [asyncio.create_task(item("batch:b1", f"batch-{i}", 8)) for i in range(8)]
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(item("user-1", "user-1"))
+        await asyncio.sleep(0.01)
+        assert controller.waiting == 7
+        release.set()
+        await asyncio.gather(*batch, interactive)
+        # 交互请求排在批次剩余的 6 个条目之前，而不是等所有条目处理完
+        assert order.index("user-1") <= 3
+        assert controller.in_flight == 0 and not controller._session_limits
+
+    asyncio.run(run())
+
+
+def test_batch_queue_is_bounded_by_batch_concurrency():
+    async def run() -> None:
+        controller = make_controller(1)
+        holder = await controller.acquire("batch:b1", 2)
+        waiters = [asyncio.create_task(controller.acquire("batch:b1", 2)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        results = [w for w in waiters if w.done()]
+        # 批次并发数为 2：最多 2 个条目排队，第 3 个被拒绝
+        assert len(results) == 1 and results[0].exception() is not None
+        assert controller.shed["session_queue_full"] == 1
+        holder.release()
+        for waiter in waiters:
+            if waiter not in results:
+                (await waiter).release()
+        assert controller.in_flight == 0 and not controller._session_limits
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_releases_granted_slot():
+    async def run() -> None:
+        controller = make_controller(1)
+        holder = await controller.acquire("s1")
+        waiter = asyncio.create_task(controller.acquire("s2"))
+        await asyncio.sleep(0.01)
+        future = controller._waiters["s2"][0]
+        holder.release()
+        # 放行后、等待者恢复前被取消；放行的名额已经处理了 5 秒
+        future.result().started -= 5
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.in_flight == 0
+        assert controller.service_time > 1.2
+
+    asyncio.run(run())
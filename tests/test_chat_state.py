@@ -0,0 +1,32 @@
+"""
+/chat 返回的会话状态与写入存储的一致
+"""
+import asyncio
+
+import httpx
+
+from agents.agent import model_registry
+from agents.route import get_default_store
+from api.main import app
+from utils.http_client import close_http_clients
+
+
+def test_response_state_matches_stored_state(stub_server):
+    async def run() -> None:
+        transport = httpx.ASGITransport(app=app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+                for turn in (1, 2):
+                    body = {"session_id": "chat-state", "message": f"第 {turn} 轮：介绍一下你自己", "metadata": {"cache": False}}
+                    response = await client.post("/chat", json=body)
+                    assert response.status_code == 200
+                    state = response.json()["state"]
+                    stored = await get_default_store().get_state("chat-state")
+                    assert state["updated_at"] == stored["updated_at"]
+                    assert state["version"] == stored["version"] == turn
+                    assert state["message_count"] == 2 * turn
+        finally:
+            await close_http_clients()
+            model_registry.clear()
+
+    asyncio.run(run())
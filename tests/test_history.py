@@ -0,0 +1,61 @@
+"""
+/history 条件请求的测试：ETag 区分分页参数，If-None-Match: * 只匹配存在的会话
+"""
+import asyncio
+from typing import Any, Dict, List
+
+import httpx
+
+from agents.route import get_default_store
+from api.main import app
+from config.settings import settings
+
+
+def turn(i: int) -> List[Dict[str, Any]]:
+    return [{"role": "user", "content": f"问题 {i}"}, {"role": "assistant", "content": f"回答 {i}"}]
+
+
+async def _get(path: str, **kwargs: Any) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.get(path, **kwargs)
+
+
+async def _seed(session_id: str, turns: int) -> None:
+    store = get_default_store()
+    for i in range(turns):
+        await store.append_turn(session_id, turn(i), {}, settings.app.max_conversation_history)
+
+
+def test_pages_have_distinct_etags():
+    async def run() -> None:
+        await _seed("history-etag", 5)
+        latest = await _get("/history/history-etag", params={"limit": 4})
+        older = await _get("/history/history-etag", params={"limit": 4, "cursor": latest.json()["next_cursor"]})
+        assert latest.headers["etag"] != older.headers["etag"]
+
+        # 用第一页的 ETag 重新验证第二页，应返回第二页的内容
+        revalidated = await _get(
+            "/history/history-etag",
+            params={"limit": 4, "cursor": latest.json()["next_cursor"]},
+            headers={"If-None-Match": latest.headers["etag"]},
+        )
+        assert revalidated.status_code == 200
+        assert revalidated.json()["messages"] == older.json()["messages"]
+
+        unchanged = await _get("/history/history-etag", params={"limit": 4}, headers={"If-None-Match": latest.headers["etag"]})
+        assert unchanged.status_code == 304
+
+    asyncio.run(run())
+
+
+def test_wildcard_matches_only_existing_session():
+    async def run() -> None:
+        missing = await _get("/history/history-missing", headers={"If-None-Match": "*"})
+        assert missing.status_code == 200
+        assert missing.json()["messages"] == []
+
+        await _seed("history-wildcard", 1)
+        existing = await _get("/history/history-wildcard", headers={"If-None-Match": "*"})
+        assert existing.status_code == 304
+
+    asyncio.run(run())
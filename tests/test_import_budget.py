@@ -0,0 +1,28 @@
+"""
+导入耗时预算的回归测试
+
+与 benchmarks/bench_import.py 使用同样的测量方式：在子进程中执行 python -X importtime -c "import api.main"，
+按生产配置(设置 REDIS_URL、开启 trace 导出)检查导入耗时、延迟导入的重依赖、后台线程与创建的文件。
+"""
+import statistics
+
+from benchmarks.bench_import import DEFAULT_BUDGET_MS, FORBIDDEN, app_env, import_side_effects, measure
+
+RUNS = 3
+
+
+def test_import_within_budget(tmp_path):
+    env = app_env(str(tmp_path))
+    totals = [measure(env)[0] for _ in range(RUNS)]
+    assert all(totals), "importtime 输出中没有 api.main"
+    median = statistics.median(totals)
+    assert median <= DEFAULT_BUDGET_MS, f"导入 api.main 耗时 {median:.1f}ms，超过预算 {DEFAULT_BUDGET_MS}ms"
+
+
+def test_import_has_no_side_effects(tmp_path):
+    env = app_env(str(tmp_path))
+    assert env["REDIS_URL"]
+    effects = import_side_effects(env, str(tmp_path))
+    assert effects["forbidden"] == [], f"导入 api.main 时加载了应延迟导入的模块(限制：{', '.join(FORBIDDEN)})"
+    assert effects["threads"] == [], "导入 api.main 时启动了后台线程"
+    assert effects["files"] == [], "导入 api.main 时创建了文件"
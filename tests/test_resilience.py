@@ -0,0 +1,269 @@
+"""
+上游弹性策略的测试
+
+- RetryBudget / CircuitBreaker / ResilientUpstream：用按脚本返回结果的假上游驱动，不发出网络请求
+- 陈旧数据兜底：在桩服务上注入故障，经 WeathorTool 走完整的请求路径
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks import stub_server as stub
+from tools.rate_limit import RATE_LIMITED
+from tools.resilience import CIRCUIT_OPEN, CircuitBreaker, ResilientUpstream, RetryBudget
+
+OK = {"success": True, "code": "200"}
+UNAVAILABLE = {"success": False, "code": "503"}
+NOT_FOUND = {"success": False, "code": "404"}
+LOCATION_ID = "101010100"
+
+
+class FakeAttempt:
+    """按顺序返回给定结果的上游调用；结果用完后重复最后一个"""
+
+    def __init__(self, *results: Dict[str, Any], delays: Optional[List[float]] = None) -> None:
+        self.results = list(results)
+        self.delays = delays or []
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self) -> Dict[str, Any]:
+        index = self.calls
+        self.calls += 1
+        delay = self.delays[index] if index < len(self.delays) else 0.0
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+        return self.results[min(index, len(self.results) - 1)]
+
+
+class FakeLimiter:
+    """denied 拒绝所有请求，hedge_denied 只拒绝不排队的对冲请求"""
+
+    def __init__(self, denied: Optional[str] = None, hedge_denied: Optional[str] = None) -> None:
+        self.denied = denied
+        self.hedge_denied = hedge_denied
+        self.calls: List[bool] = []
+
+    async def acquire(self, wait: bool = True) -> Optional[str]:
+        self.calls.append(wait)
+        return self.denied if wait else self.denied or self.hedge_denied
+
+
+def make_upstream(**overrides: Any) -> ResilientUpstream:
+    options: Dict[str, Any] = dict(
+        budget=RetryBudget(ratio=1.0, min_per_second=0),
+        max_retries=2,
+        backoff_base=0.001,
+        backoff_cap=0.001,
+        failure_threshold=3,
+        reset_timeout=60,
+    )
+    options.update(overrides)
+    return ResilientUpstream("test", **options)
+
+
+def hedging_upstream(**overrides: Any) -> ResilientUpstream:
+    upstream = make_upstream(hedge_enabled=True, hedge_min_delay=0.01, **overrides)
+    for _ in range(20):
+        upstream.latency.add(0.01)
+    return upstream
+
+
+def test_retry_budget_rejects_when_empty():
+    budget = RetryBudget(ratio=0.5, min_per_second=0)
+    assert all(budget.withdraw() for _ in range(int(budget.capacity)))
+    assert not budget.withdraw()
+    assert budget.rejected == 1
+    # 每个首次请求存入 ratio 个令牌，两次首次请求才换来一次重试
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_retry_budget_refills_over_time():
+    budget = RetryBudget(ratio=0, min_per_second=10)
+    budget.tokens = 0
+    budget._updated = time.monotonic() - 0.5
+    assert budget.withdraw()
+    assert budget.stats()["tokens"] >= 3
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["short_circuited"] == 1
+
+
+def test_breaker_half_open_allows_single_probe():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    breaker.opened_at -= 60
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    # 探测失败重新打开
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.opened_at -= 60
+    assert breaker.allow()
+    # 放行后未发出请求，下一个请求继续探测
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_retries_recoverable_errors_until_success():
+    upstream = make_upstream()
+    attempt = FakeAttempt(UNAVAILABLE, UNAVAILABLE, OK)
+    result = asyncio.run(upstream.call(attempt))
+    assert result == OK
+    assert attempt.calls == 3
+    assert upstream.retries == 2
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_gives_up_after_max_retries():
+    upstream = make_upstream(failure_threshold=10)
+    attempt = FakeAttempt(UNAVAILABLE)
+    result = asyncio.run(upstream.call(attempt))
+    assert result == UNAVAILABLE
+    assert attempt.calls == 3
+
+
+def test_business_errors_are_not_retried():
+    upstream = make_upstream()
+    attempt = FakeAttempt(NOT_FOUND)
+    result = asyncio.run(upstream.call(attempt))
+    assert result == NOT_FOUND
+    assert attempt.calls == 1
+    assert upstream.breaker.failures == 0
+
+
+def test_retry_budget_limits_retries():
+    budget = RetryBudget(ratio=0, min_per_second=0)
+    budget.tokens = 0
+    upstream = make_upstream(budget=budget, failure_threshold=10)
+    attempt = FakeAttempt(UNAVAILABLE)
+    asyncio.run(upstream.call(attempt))
+    assert attempt.calls == 1
+    assert budget.rejected == 1
+
+
+def test_open_breaker_fails_fast():
+    upstream = make_upstream(max_retries=5, failure_threshold=2)
+    attempt = FakeAttempt(UNAVAILABLE)
+
+    async def run() -> Dict[str, Any]:
+        await upstream.call(attempt)
+        return await upstream.call(attempt)
+
+    result = asyncio.run(run())
+    # 熔断器打开后不再重试，后续请求不调用上游
+    assert attempt.calls == 2
+    assert result["code"] == CIRCUIT_OPEN
+    assert upstream.breaker.state == CircuitBreaker.OPEN
+
+
+def test_rate_limited_request_is_not_sent_or_counted_as_failure():
+    upstream = make_upstream(limiter=FakeLimiter(RATE_LIMITED))
+    attempt = FakeAttempt(OK)
+    result = asyncio.run(upstream.call(attempt))
+    assert result["code"] == RATE_LIMITED
+    assert attempt.calls == 0
+    assert upstream.breaker.failures == 0
+
+
+def test_hedged_request_wins_over_slow_first_attempt():
+    upstream = hedging_upstream()
+    slow = {"success": True, "code": "200", "which": "first"}
+    fast = {"success": True, "code": "200", "which": "hedge"}
+    attempt = FakeAttempt(slow, fast, delays=[5.0, 0.0])
+    start = time.perf_counter()
+    result = asyncio.run(upstream.call(attempt))
+    assert result["which"] == "hedge"
+    assert time.perf_counter() - start < 1
+    assert upstream.hedges == 1 and upstream.hedge_wins == 1
+    # 较慢的第一个请求被取消
+    assert attempt.cancelled == 1
+
+
+def test_rate_limited_hedge_refunds_retry_budget():
+    upstream = hedging_upstream(limiter=FakeLimiter(hedge_denied=RATE_LIMITED))
+    budget = upstream.budget
+    attempt = FakeAttempt(OK, delays=[0.05])
+
+    async def run() -> Dict[str, Any]:
+        result = await upstream.call(attempt)
+        budget._refill()
+        return result
+
+    tokens = budget.tokens
+    assert asyncio.run(run()) == OK
+    assert attempt.calls == 1 and upstream.hedges == 0
+    # 首次请求存入 ratio 个令牌，被拒绝的对冲请求不消耗令牌
+    assert budget.tokens == min(budget.capacity, tokens + budget.ratio)
+
+
+def test_cancelled_caller_cancels_first_attempt():
+    upstream = hedging_upstream()
+    attempt = FakeAttempt(OK, delays=[5.0])
+
+    async def run() -> None:
+        call = asyncio.ensure_future(upstream.call(attempt))
+        await asyncio.sleep(0.005)
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+        await asyncio.sleep(0)
+        # 在事件循环结束前检查，asyncio.run 退出时会取消所有剩余任务
+        assert attempt.cancelled == 1
+
+    asyncio.run(run())
+    assert attempt.calls == 1
+
+
+def test_stale_fallback_while_breaker_open(stub_server, monkeypatch):
+    from tools.weathor_tool import WeathorTool
+    from utils.http_client import close_http_clients
+
+    async def run() -> None:
+        tool = WeathorTool()
+        tool.upstream.budget = RetryBudget(ratio=1.0, min_per_second=0)
+        tool.upstream.backoff_base = tool.upstream.backoff_cap = 0.001
+        try:
+            monkeypatch.setenv("STUB_FAULT_ERROR_RATE", "1")
+            tool.obs_cache.set(LOCATION_ID, {"obsTime": "2024-01-01T00:00+08:00", "temp": "20"}, expires_at=time.time() - 60)
+            stale = await tool.get_current_weather(LOCATION_ID)
+            assert stale is not None and stale["stale"] is True and stale["temp"] == "20"
+
+            while tool.upstream.breaker.state != CircuitBreaker.OPEN:
+                await tool.request("v7/weather/now", {"location": LOCATION_ID})
+            before = sum(stub.REQUEST_COUNTS.values())
+            stale = await tool.get_current_weather(LOCATION_ID)
+            assert stale is not None and stale["stale"] is True
+            assert sum(stub.REQUEST_COUNTS.values()) == before
+
+            # 上游恢复、冷却期结束后探测成功，熔断器关闭并返回新数据
+            monkeypatch.delenv("STUB_FAULT_ERROR_RATE")
+            tool.upstream.breaker.opened_at -= tool.upstream.breaker.reset_timeout
+            fresh = await tool.get_current_weather(LOCATION_ID)
+            assert fresh is not None and "stale" not in fresh and fresh["temp"] == "25"
+            assert tool.upstream.breaker.state == CircuitBreaker.CLOSED
+        finally:
+            await close_http_clients()
+
+    asyncio.run(run())
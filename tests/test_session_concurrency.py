@@ -0,0 +1,89 @@
+"""
+同一会话并发消息的测试：进程内会话锁与追加时的版本校验
+"""
+import asyncio
+
+import pytest
+
+from state.store import AsyncRedisStore, InMemoryStore, SessionConflictError, SessionLocks
+
+MESSAGES = [{"role": "user", "content": "你好"}, {"role": "assistant", "content": "你好！"}]
+
+
+async def _waiting(locks: SessionLocks, session_id: str, entered: asyncio.Event) -> None:
+    async with locks.hold(session_id, wait=True, timeout=1):
+        entered.set()
+
+
+def test_reject_while_lock_is_handed_to_waiter():
+    async def run() -> None:
+        locks = SessionLocks()
+        holder = locks.hold("s", wait=True, timeout=1)
+        await holder.__aenter__()
+        entered = asyncio.Event()
+        waiter = asyncio.create_task(_waiting(locks, "s", entered))
+        await asyncio.sleep(0.01)
+        # 释放后锁已交给等待者，但等待者尚未被唤醒
+        await holder.__aexit__(None, None, None)
+        with pytest.raises(SessionConflictError):
+            async with asyncio.timeout(1):
+                async with locks.hold("s", wait=False, timeout=1):
+                    pass
+        await waiter
+        assert entered.is_set()
+        assert len(locks) == 0
+
+    asyncio.run(run())
+
+
+def test_queue_timeout_applies_after_handoff():
+    async def run() -> None:
+        locks = SessionLocks()
+        holder = locks.hold("s", wait=True, timeout=1)
+        await holder.__aenter__()
+        release_waiter = asyncio.Event()
+
+        async def slow_waiter() -> None:
+            async with locks.hold("s", wait=True, timeout=1):
+                await release_waiter.wait()
+
+        waiter = asyncio.create_task(slow_waiter())
+        await asyncio.sleep(0.01)
+        await holder.__aexit__(None, None, None)
+        with pytest.raises(SessionConflictError):
+            async with asyncio.timeout(1):
+                async with locks.hold("s", wait=True, timeout=0.05):
+                    pass
+        release_waiter.set()
+        await waiter
+
+    asyncio.run(run())
+
+
+def test_missing_state_is_not_a_conflict():
+    async def run() -> None:
+        store = InMemoryStore()
+        # 读取时的版本为 3，写入前会话已过期或被淘汰
+        version, total = await store.append("s", MESSAGES, {}, 60, 20, expected_version=3)
+        assert (version, total) == (1, 2)
+        with pytest.raises(SessionConflictError):
+            await store.append("s", MESSAGES, {}, 60, 20, expected_version=0)
+
+    asyncio.run(run())
+
+
+def test_missing_redis_state_is_not_a_conflict(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    monkeypatch.setattr("redis.asyncio.Redis", lambda connection_pool: fakeredis.FakeAsyncRedis(decode_responses=True))
+
+    async def run() -> None:
+        store = AsyncRedisStore("redis://127.0.0.1:6399/15")
+        try:
+            version, total = await store.append("s", MESSAGES, {}, 60, 20, expected_version=3)
+            assert (version, total) == (1, 2)
+            with pytest.raises(SessionConflictError):
+                await store.append("s", MESSAGES, {}, 60, 20, expected_version=0)
+        finally:
+            await store.close()
+
+    asyncio.run(run())
@@ -3,9 +3,9 @@ from schemas.tool import WeatherInput, WeatherOutput, NewsInput, NewsOutput
 from tools.registry import weather_stub, news_stub
 
 @tool("weather", args_schema=WeatherInput, description="查询指定城市的天气信息。")
-def weather_tool(city: str, date: str = "今天") -> dict:
+async def weather_tool(city: str, date: str = "今天") -> dict:
     """查询指定城市的天气信息"""
-    weather_info = weather_stub(city, date)
+    weather_info = await weather_stub(city, date)
     if not weather_info or "error" in weather_info:
         return {"error": weather_info.get("error", "无法获取天气信息")}
     return WeatherOutput(
@@ -16,9 +16,9 @@ def weather_tool(city: str, date: str = "今天") -> dict:
     ).model_dump()
 
 @tool("news", args_schema=NewsInput, description="获取指定主题的最新新闻。")
-def news_tool(topic: str, source: str = "") -> dict:
+async def news_tool(topic: str, source: str = "") -> dict:
     """获取指定主题的最新新闻"""
-    news_info = news_stub(topic, source)
+    news_info = await news_stub(topic, source)
     if not news_info or "error" in news_info:
         return {"error": news_info.get("error", "无法获取相关新闻")}
     return NewsOutput(
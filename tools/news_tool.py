@@ -54,10 +54,15 @@
 
 """
 
-import requests
+import httpx
 from typing import Dict, Any, Optional
 from config.settings import settings
+from utils.cache import TTLCache
 from utils.logger import get_logger
+from utils.http_client import get_http_client
+from utils.tracing import span
+from utils.metrics import UPSTREAM_ERRORS
+from tools.resilience import build_upstream, is_unavailable
 
 logger = get_logger(__name__)
 
@@ -67,46 +72,72 @@ class NewsTool:
     def __init__(self) -> None:
         self.api_key = settings.api.tian_api_key
         self.base_url = settings.api.tian_api_base_url
-        logger.info(f"初始化天行数据新闻工具, base_url: {self.base_url}")
+        self.upstream = build_upstream("tianapi")
+        # 最近一次成功的新闻结果，不用于正常读取(ttl 为 0)，只在上游不可用时作为陈旧数据返回
+        api = settings.api
+        self.stale_fallback = api.upstream_stale_fallback
+        self.stale_cache = TTLCache(256, 0, name="news_stale", stale_ttl=api.upstream_stale_max_age)
+        logger.info("初始化天行数据新闻工具, base_url: %s", self.base_url)
 
-    def request(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
-        """发送请求到天行数据新闻 API"""
-        url = f"{self.base_url}/{endpoint}"
+    async def request(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """发送请求到天行数据新闻 API，可恢复的错误按弹性策略重试，熔断期间直接失败"""
         params["key"] = self.api_key
+        return await self.upstream.call(lambda: self._request_once(endpoint, params))
 
+    async def _request_once(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        url = f"{self.base_url}/{endpoint}"
         try:
-            logger.info(f"请求天行数据新闻 API，URL：{url}，参数：{params}")
+            logger.info("请求天行数据新闻 API，URL：%s，参数：%s", url, params)
 
-            response = requests.get(url, params=params)
+            client = get_http_client(self.base_url)
+            with span("upstream.tianapi", endpoint=endpoint):
+                response = await client.get(url, params=params)
+            if response.status_code >= 500 or response.status_code == 429:
+                code = str(response.status_code)
+                UPSTREAM_ERRORS.labels("tianapi", code).inc()
+                return {
+                    "success": False,
+                    "code": code,
+                    "error": f"获取信息失败: HTTP {code}",
+                }
             data = response.json()
-            logger.info(f"天行数据新闻 API 响应：{data}")
+            logger.debug("天行数据新闻 API 响应：%s", data)
             if data.get("code") == 200:
                 return {
                     "success": True,
                     "data": data,
                 }
             else:
+                code = str(data.get("code"))
+                UPSTREAM_ERRORS.labels("tianapi", code).inc()
                 return {
                     "success": False,
+                    "code": code,
                     "error": f"获取信息失败: {data.get('code')} - {data.get('msg')}",
                 }
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
+            UPSTREAM_ERRORS.labels("tianapi", "timeout").inc()
             return {
                 "success": False,
+                "code": "timeout",
                 "error": "请求超时，请稍后重试"
             }
-        except requests.exceptions.RequestException:
+        except httpx.HTTPError:
+            UPSTREAM_ERRORS.labels("tianapi", "network").inc()
             return {
                 "success": False,
+                "code": "network",
                 "error": "网络请求失败"
             }
         except Exception as e:
+            UPSTREAM_ERRORS.labels("tianapi", "exception").inc()
             return {
                 "success": False,
+                "code": "exception",
                 "error": f"获取信息失败: {str(e)}",
             }
 
-    def get_news(self, topic: str, source: str = "", num: int = 5, page: int = 1, rand: int = 0) -> Optional[Dict[str, Any]]:
+    async def get_news(self, topic: str, source: str = "", num: int = 5, page: int = 1, rand: int = 0) -> Optional[Dict[str, Any]]:
         """获取新闻信息"""
         params = {
             "word": topic,
@@ -115,15 +146,35 @@ class NewsTool:
             "page": page,
             "rand": rand,
         }
-        response = self.request("generalnews/index", params)
-        logger.info(f"获取新闻信息响应：{response}")
+        cache_key = (topic, source, num, page)
+        # 当日配额将尽时，有稍早获取的同主题新闻就不再调用上游
+        limiter = self.upstream.limiter
+        if self.stale_fallback and not rand and limiter is not None and limiter.quota_low():
+            stale = self.stale_cache.get_stale(cache_key)
+            if stale is not None:
+                limiter.record_degraded()
+                logger.info("天行数据当日配额将尽，返回主题 %s 的缓存新闻", topic)
+                return dict(stale, stale=True)
+        response = await self.request("generalnews/index", params)
+        logger.debug("获取新闻信息响应：%s", response)
         if response["success"]:
             data = response["data"]
             news_list = data.get("result", {}).get("newslist", [])
-            return {
+            result = {
                 "topic": topic,
                 "source": source,
                 "items": news_list,
             }
+            if self.stale_fallback and not rand:
+                self.stale_cache.set(cache_key, result)
+            return result
+
+        if self.stale_fallback and not rand and is_unavailable(response):
+            stale = self.stale_cache.get_stale(cache_key)
+            if stale is not None:
+                logger.warning("天行数据不可用(%s)，返回主题 %s 的陈旧新闻", response.get("code"), topic)
+                return dict(stale, stale=True)
+        return None
 
-        return None
\ No newline at end of file
+    def upstream_stats(self) -> Dict[str, Any]:
+        return {**self.upstream.stats(), "stale_cache": self.stale_cache.stats()}
\ No newline at end of file
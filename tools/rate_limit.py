@@ -0,0 +1,320 @@
+"""
+上游限流与每日配额
+
+和风天气与天行数据的密钥都有每秒请求数与每日请求数的限制，超出后上游直接返回错误。
+在发出请求前按配置在本地限流，避免把请求浪费在必然失败的调用上：
+
+- 令牌桶：每个上游一个，按 *_RATE_LIMIT 补充令牌，容量为 *_RATE_BURST；
+  配置了 REDIS_URL 时令牌桶保存在 Redis 中(Lua 脚本原子扣减)，所有 worker 共享同一个桶，
+  Redis 不可用时临时退回进程内的令牌桶
+- 令牌不足时：queue 模式排队等待，预计等待时间超过 UPSTREAM_RATE_LIMIT_MAX_WAIT 时直接失败；
+  fail_fast 模式直接失败。对冲请求总是不等待
+- 优先通道：批量请求(/chat/batch)不能使用桶中为交互请求保留的 UPSTREAM_RATE_LIMIT_RESERVE 部分，
+  夜间批量任务不会耗尽令牌、拖慢在线用户
+- 每日配额：按北京时间自然日计数(与上游配额的重置时间一致)，重试与对冲同样计数；
+  用量达到 UPSTREAM_QUOTA_DEGRADE_RATIO 后，有陈旧缓存数据的请求直接返回缓存，不再调用上游；
+  配额用尽后请求直接失败，由各工具按上游不可用处理(返回陈旧数据或错误)
+
+未配置 Redis 时每个 worker 独立计数，多 worker 部署时实际的限额是配置值乘以 worker 数。
+"""
+import asyncio
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from config.settings import settings
+from utils.logger import get_logger
+from utils.metrics import UPSTREAM_QUOTA_USED, UPSTREAM_THROTTLED
+
+logger = get_logger(__name__)
+
+RATE_LIMITED = "rate_limited"
+QUOTA_EXHAUSTED = "quota_exhausted"
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+
+# Redis 出错后多久内不再尝试，直接使用进程内的计数(秒)
+SHARED_RETRY_INTERVAL = 5.0
+
+_priority: ContextVar[str] = ContextVar("upstream_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def priority_scope(priority: str) -> Iterator[str]:
+    """在当前上下文(及其创建的子任务)中发出的上游请求使用指定的优先级"""
+    token = _priority.set(priority)
+    try:
+        yield priority
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+class LocalTokenBucket:
+    """进程内的令牌桶"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    async def take(self, floor: float) -> float:
+        """取走一个令牌，且取走后桶中至少还剩 floor 个；成功返回 0，否则返回预计还需等待的秒数"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens - 1 >= floor:
+            self.tokens -= 1
+            return 0.0
+        return (floor + 1 - self.tokens) / self.rate
+
+
+# 以 Redis 服务器时间计算补充的令牌，避免各 worker 之间的时钟偏差；返回值同 LocalTokenBucket.take
+_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local floor = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens - 1 >= floor then
+    tokens = tokens - 1
+else
+    wait = (floor + 1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket:
+    """多个 worker 共享的令牌桶"""
+
+    def __init__(self, client: Any, key: str, rate: float, capacity: float) -> None:
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self._script = client.register_script(_BUCKET_SCRIPT)
+
+    async def take(self, floor: float) -> float:
+        return float(await self._script(keys=[self.key], args=[self.rate, self.capacity, floor]))
+
+
+def _today() -> str:
+    # 上游配额按北京时间零点重置
+    return time.strftime("%Y%m%d", time.gmtime(time.time() + 8 * 3600))
+
+
+class DailyQuota:
+    """每日请求计数；配置了 Redis 时计数保存在 Redis 中，Redis 不可用时退回进程内计数"""
+
+    def __init__(self, name: str, limit: int, client: Any = None) -> None:
+        self.name = name
+        self.limit = limit
+        self.client = client
+        self.day = _today()
+        self.used = 0
+        self._local_used = 0
+        self._shared_down_until = 0.0
+        self._gauge = UPSTREAM_QUOTA_USED.labels(name)
+
+    async def _incr_shared(self, day: str) -> int:
+        key = f"ratelimit:quota:{self.name}:{day}"
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, 2 * 24 * 3600)
+            used, _ = await pipe.execute()
+        return int(used)
+
+    async def consume(self) -> bool:
+        """记一次请求，返回是否仍在配额内"""
+        day = _today()
+        if day != self.day:
+            self.day, self.used, self._local_used = day, 0, 0
+        self._local_used += 1
+        used = self._local_used
+        if self.client is not None and time.monotonic() >= self._shared_down_until:
+            try:
+                used = await self._incr_shared(day)
+            except Exception as e:
+                self._shared_down_until = time.monotonic() + SHARED_RETRY_INTERVAL
+                logger.warning("上游 %s 的共享配额计数不可用，暂时使用本进程计数：%r", self.name, e)
+        self.used = used
+        self._gauge.set(used)
+        return used <= self.limit
+
+    def ratio(self) -> float:
+        """最近一次记录的用量占配额的比例；跨天后归零"""
+        if _today() != self.day:
+            return 0.0
+        return self.used / self.limit
+
+
+class UpstreamLimiter:
+    """单个上游的令牌桶与每日配额"""
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        daily_quota: int,
+        mode: str = "queue",
+        max_wait: float = 1.0,
+        reserve: float = 0.2,
+        degrade_ratio: float = 0.9,
+        client: Any = None,
+    ) -> None:
+        self.name = name
+        self.mode = mode
+        self.max_wait = max_wait
+        self.degrade_ratio = degrade_ratio
+        self.local: Optional[LocalTokenBucket] = None
+        self.shared: Optional[RedisTokenBucket] = None
+        self.batch_floor = 0.0
+        if rate > 0:
+            capacity = float(burst or max(1, math.ceil(rate)))
+            self.local = LocalTokenBucket(rate, capacity)
+            if client is not None:
+                self.shared = RedisTokenBucket(client, f"ratelimit:bucket:{name}", rate, capacity)
+            # 保留的令牌至少留出 1 个给交互请求，但不能让批量请求永远拿不到令牌
+            self.batch_floor = min(capacity - 1, math.ceil(capacity * reserve)) if reserve > 0 else 0.0
+        self.quota = DailyQuota(name, daily_quota, client) if daily_quota > 0 else None
+        self._shared_down_until = 0.0
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self.quota_rejected = 0
+        self.degraded = 0
+
+    async def _take(self, floor: float) -> float:
+        if self.shared is not None and time.monotonic() >= self._shared_down_until:
+            try:
+                return await self.shared.take(floor)
+            except Exception as e:
+                self._shared_down_until = time.monotonic() + SHARED_RETRY_INTERVAL
+                logger.warning("上游 %s 的共享令牌桶不可用，暂时使用本进程令牌桶：%r", self.name, e)
+        return await self.local.take(floor)
+
+    async def _acquire_token(self, wait: bool) -> bool:
+        floor = self.batch_floor if current_priority() == PRIORITY_BATCH else 0.0
+        deadline = time.monotonic() + (self.max_wait if wait and self.mode == "queue" else 0)
+        waited = False
+        while True:
+            delay = await self._take(floor)
+            if delay <= 0:
+                if waited:
+                    self.waited += 1
+                    UPSTREAM_THROTTLED.labels(self.name, "waited").inc()
+                return True
+            if time.monotonic() + delay > deadline:
+                return False
+            waited = True
+            await asyncio.sleep(delay)
+
+    async def acquire(self, wait: bool = True) -> Optional[str]:
+        """放行返回 None，否则返回错误码(RATE_LIMITED / QUOTA_EXHAUSTED)；wait=False 时不排队"""
+        if self.local is not None and not await self._acquire_token(wait):
+            self.rejected += 1
+            UPSTREAM_THROTTLED.labels(self.name, RATE_LIMITED).inc()
+            return RATE_LIMITED
+        if self.quota is not None and not await self.quota.consume():
+            self.quota_rejected += 1
+            UPSTREAM_THROTTLED.labels(self.name, QUOTA_EXHAUSTED).inc()
+            return QUOTA_EXHAUSTED
+        self.admitted += 1
+        return None
+
+    def quota_low(self) -> bool:
+        """当日配额将尽，有缓存数据时应优先使用缓存"""
+        return self.quota is not None and self.quota.ratio() >= self.degrade_ratio
+
+    def record_degraded(self) -> None:
+        self.degraded += 1
+        UPSTREAM_THROTTLED.labels(self.name, "degraded").inc()
+
+    def stats(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {
+            "backend": "redis" if self.shared is not None else "local",
+            "mode": self.mode,
+            "admitted": self.admitted,
+            "waited": self.waited,
+            "rejected": self.rejected,
+            "quota_rejected": self.quota_rejected,
+            "degraded": self.degraded,
+        }
+        if self.local is not None:
+            result.update(rate=self.local.rate, burst=self.local.capacity, batch_floor=self.batch_floor)
+        if self.quota is not None:
+            result["quota"] = {"limit": self.quota.limit, "used": self.quota.used, "day": self.quota.day}
+        return result
+
+
+_client: Any = None
+
+
+def _shared_client() -> Any:
+    """限流使用的 Redis 客户端，与会话存储分开；未配置 REDIS_URL 时返回 None"""
+    global _client
+    app = settings.app
+    if _client is None and app.redis_url:
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            logger.warning("未安装 redis，上游限流只在本进程内生效")
+            return None
+        _client = aioredis.Redis.from_url(
+            app.redis_url,
+            socket_timeout=app.redis_socket_timeout,
+            socket_connect_timeout=app.redis_socket_timeout,
+        )
+    return _client
+
+
+def _limits(name: str) -> tuple:
+    api = settings.api
+    return {
+        "qweather": (api.qweather_rate_limit, api.qweather_rate_burst, api.qweather_daily_quota),
+        "tianapi": (api.tian_api_rate_limit, api.tian_api_rate_burst, api.tian_api_daily_quota),
+    }.get(name, (0, 0, 0))
+
+
+def build_limiter(name: str) -> Optional[UpstreamLimiter]:
+    """按 APISettings 创建上游的限流器，未配置限流与配额时返回 None"""
+    rate, burst, daily_quota = _limits(name)
+    if rate <= 0 and daily_quota <= 0:
+        return None
+    api = settings.api
+    limiter = UpstreamLimiter(
+        name,
+        rate=rate,
+        burst=burst,
+        daily_quota=daily_quota,
+        mode=api.upstream_rate_limit_mode,
+        max_wait=api.upstream_rate_limit_max_wait,
+        reserve=api.upstream_rate_limit_reserve,
+        degrade_ratio=api.upstream_quota_degrade_ratio,
+        client=_shared_client(),
+    )
+    logger.info("上游 %s 限流：%s", name, limiter.stats())
+    return limiter
+
+
+async def close_rate_limiters() -> None:
+    """关闭限流使用的 Redis 客户端，由 FastAPI lifespan 在退出时调用"""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
@@ -1,12 +1,89 @@
-from dataclasses import dataclass
-from typing import Dict, Callable, Any, Optional
+import copy
+import functools
+import inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Callable, Any, Iterator, List, Optional, Awaitable, Hashable
 from utils.logger import get_logger
+from utils.singleflight import SingleFlight
 from tools.weathor_tool import WeathorTool
 from tools.news_tool import NewsTool
 
 logger = get_logger(__name__)
-weather = WeathorTool()
-news = NewsTool()
+
+# 工具实例在首次使用时创建(或在启动预热时创建)，导入本模块不产生副作用
+_weather: Optional[WeathorTool] = None
+_news: Optional[NewsTool] = None
+
+
+def get_weather_tool() -> WeathorTool:
+    global _weather
+    if _weather is None:
+        _weather = WeathorTool()
+    return _weather
+
+
+def get_news_tool() -> NewsTool:
+    global _news
+    if _news is None:
+        _news = NewsTool()
+    return _news
+
+# 工具调用的请求合并，参数相同的并发调用共享一次上游请求
+tool_flight = SingleFlight()
+
+
+@dataclass
+class ToolMemo:
+    """批量请求内共享的工具结果：同一批次中参数相同的工具调用(不论是否并发)只请求一次上游"""
+    results: Dict[Hashable, Dict[str, Any]] = field(default_factory=dict)
+    hits: int = 0
+
+
+_tool_memo: ContextVar[Optional[ToolMemo]] = ContextVar("tool_memo", default=None)
+
+
+@contextmanager
+def tool_memo_scope(memo: ToolMemo) -> Iterator[ToolMemo]:
+    """在当前上下文(及其创建的子任务)中启用工具结果共享"""
+    token = _tool_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _tool_memo.reset(token)
+
+
+def _normalize_arg(value: Any) -> Any:
+    if isinstance(value, str):
+        return "".join(value.split()).casefold()
+    return value
+
+
+def coalesce(tool_name: str):
+    """按工具名 + 归一化后的参数合并并发调用"""
+    def decorator(func: Callable[..., Awaitable[Dict[str, Any]]]):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Dict[str, Any]:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key: Hashable = (tool_name,) + tuple(
+                (name, _normalize_arg(value)) for name, value in bound.arguments.items()
+            )
+            memo = _tool_memo.get()
+            if memo is not None and key in memo.results:
+                memo.hits += 1
+                return copy.deepcopy(memo.results[key])
+            result = await tool_flight.do(key, lambda: func(*args, **kwargs))
+            # 出错与陈旧的结果不共享，批次中后续的调用重新请求
+            if memo is not None and "error" not in result and not result.get("stale"):
+                memo.results[key] = copy.deepcopy(result)
+            return result
+
+        return wrapper
+    return decorator
 
 # 定义工具的数据结构
 @dataclass
@@ -14,34 +91,43 @@ class Tool:
     name: str
     description: str
     parameters: Dict[str, Any]
-    handler: Callable[..., Dict[str, Any]]
+    handler: Callable[..., Awaitable[Dict[str, Any]]]
+    # 把工具结果直接渲染为回答文本，不需要 LLM 再组织语言；为 None 时只能交给 LLM
+    renderer: Optional[Callable[[Dict[str, Any]], str]] = None
 
 
-def weather_stub(city: str, date: str = "今天") -> Dict[str, Any]:
-    logger.info(f"调用天气查询函数，城市：{city}，日期：{date}")
+@coalesce("weather")
+async def weather_stub(city: str, date: str = "今天") -> Dict[str, Any]:
+    logger.info("调用天气查询函数，城市：%s，日期：%s", city, date)
     # 这是一个模拟的天气查询函数
     # return {"city": city, "date": date, "temperature": "25°C", "condition": "晴朗"}
 
     # 使用 WeathorTool 获取实际天气信息
-    city_info = weather.search_city(city)
+    weather = get_weather_tool()
+    city_info = await weather.search_city(city)
     if not city_info:
         return {"error": "未找到该城市的信息"}
 
     location_id = city_info["id"]
-    weather_info = weather.get_current_weather(location_id)
+    weather_info = await weather.get_current_weather(location_id)
     if not weather_info:
         return {"error": "无法获取天气信息"}
 
-    return {
+    result = {
         "city": city,
         "date": date,
         "temperature": weather_info["temp"] + "°C",
         "condition": weather_info["text"],
     }
+    if weather_info.get("stale"):
+        # 上游不可用时返回的陈旧数据，告知观测时间
+        result.update(stale=True, observed_at=weather_info.get("obsTime", ""))
+    return result
 
 
-def news_stub(topic: str, source: str = "") -> Dict[str, Any]:
-    logger.info(f"调用新闻查询函数，主题：{topic}，来源：{source}")
+@coalesce("news")
+async def news_stub(topic: str, source: str = "") -> Dict[str, Any]:
+    logger.info("调用新闻查询函数，主题：%s，来源：%s", topic, source)
     # 这是一个模拟的新闻查询函数
     # return {
     #     "topic": topic,
@@ -56,15 +142,34 @@ def news_stub(topic: str, source: str = "") -> Dict[str, Any]:
     # }
 
     # 使用 NewsTool 获取实际新闻信息
-    news_info = news.get_news(topic, source=source)
-    logger.info(f"新闻查询结果：{news_info}")
+    news_info = await get_news_tool().get_news(topic, source=source)
+    logger.debug("新闻查询结果：%s", news_info)
     if not news_info:
         return {"error": "无法获取相关新闻"}
-    return {
+    result = {
         "topic": topic,
         "source": news_info.get("source", ""),
         "items": news_info.get("items", []),
     }
+    if news_info.get("stale"):
+        result["stale"] = True
+    return result
+
+
+def render_weather(result: Dict[str, Any]) -> str:
+    text = f"{result['city']}{result.get('date', '今天')}{result['condition']}，气温{result['temperature']}。"
+    if result.get("stale"):
+        text += f"（天气服务暂时不可用，以上为 {result.get('observed_at', '')} 的观测数据）"
+    return text
+
+
+def render_news(result: Dict[str, Any]) -> str:
+    items: List[Dict[str, Any]] = result.get("items", [])[:3]
+    if not items:
+        return f"暂时没有找到{result['topic']}相关的新闻。"
+    lines = [f"{i}. {item.get('title', '')}（{item.get('source', '')}，{item.get('ctime', '')}）" for i, item in enumerate(items, 1)]
+    note = "\n（新闻服务暂时不可用，以上为稍早获取的新闻）" if result.get("stale") else ""
+    return f"最新的{result['topic']}新闻：\n" + "\n".join(lines) + note
 
 
 # 注册可用工具
@@ -77,6 +182,7 @@ TOOLS: Dict[str, Tool] = {
             "date": {"type": "string", "description": "查询日期，默认为今天"},
         },
         handler=weather_stub,
+        renderer=render_weather,
     ),
     "news": Tool(
         name="news",
@@ -86,6 +192,7 @@ TOOLS: Dict[str, Tool] = {
             "source": {"type": "string", "description": "新闻来源，默认为随机抽取"},
         },
         handler=news_stub,
+        renderer=render_news,
     ),
 }
 
@@ -98,3 +205,15 @@ def get_tool(name: str) -> Optional[Tool]:
 # 列出所有可用工具
 def list_tools() -> Dict[str, Tool]:
     return TOOLS
+
+
+# 请求合并统计
+def tool_stats() -> Dict[str, Any]:
+    return {
+        "singleflight": tool_flight.stats(),
+        "weather_cache": get_weather_tool().cache_stats(),
+        "upstreams": {
+            "qweather": get_weather_tool().upstream_stats(),
+            "tianapi": get_news_tool().upstream_stats(),
+        },
+    }
@@ -0,0 +1,312 @@
+"""
+上游调用的弹性策略
+
+- 重试：只重试超时、网络错误、限流与 5xx 这类可恢复的错误码，退避时间为带全抖动的指数退避；
+  所有上游共享一个重试预算(令牌桶)，重试只能占首次请求的一定比例，上游整体故障时不会被重试放大流量
+- 熔断：每个上游一个熔断器，连续失败达到阈值后打开，冷却期内直接失败、不再等待上游；
+  冷却期结束后放行一个探测请求(半开)，成功则关闭，失败则重新打开
+- 对冲(可选)：请求超过该上游近期 p95 耗时仍未返回时再发一个相同的请求，取先成功的结果，
+  对冲请求同样消耗重试预算
+- 限流(可选)：每次发出请求(含重试与对冲)前先向该上游的限流器申请令牌与配额(见 tools/rate_limit.py)，
+  被本地限流的请求不计入熔断器的失败，也不重试
+- 熔断打开、重试耗尽或被本地限流时，由各工具用保留过期条目的缓存返回陈旧数据(见 TTLCache.get_stale)
+
+工具的 request() 约定返回 {"success": bool, "code": str, ...}，code 用于判断是否可重试。
+"""
+import asyncio
+import collections
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Optional
+
+from config.settings import settings
+from tools.rate_limit import QUOTA_EXHAUSTED, RATE_LIMITED, UpstreamLimiter, build_limiter
+from utils.logger import get_logger
+from utils.metrics import CIRCUIT_STATE, UPSTREAM_ERRORS, UPSTREAM_HEDGES, UPSTREAM_RETRIES
+
+logger = get_logger(__name__)
+
+# 可恢复的错误：超时、网络错误、限流与上游 5xx
+RETRYABLE_CODES: FrozenSet[str] = frozenset({"timeout", "network", "429", "500", "502", "503", "504"})
+CIRCUIT_OPEN = "circuit_open"
+
+Attempt = Callable[[], Awaitable[Dict[str, Any]]]
+
+
+def is_unavailable(result: Dict[str, Any]) -> bool:
+    """上游暂时不可用(熔断中、被本地限流或可恢复错误重试后仍失败)，此时可以返回陈旧数据"""
+    code = result.get("code")
+    return not result.get("success") and (code in RETRYABLE_CODES or code in (CIRCUIT_OPEN, RATE_LIMITED, QUOTA_EXHAUSTED))
+
+
+class RetryBudget:
+    """
+    重试预算：每个首次请求存入 ratio 个令牌，每次重试消耗 1 个；
+    另外每秒补充 min_per_second 个令牌，保证低流量时也能重试
+    """
+
+    def __init__(self, ratio: float, min_per_second: float) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = max(10.0, min_per_second * 10)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self.rejected = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.rejected += 1
+        return False
+
+    def refund(self) -> None:
+        """取出的令牌没有用于发出请求时退回"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {"tokens": round(self.tokens, 2), "capacity": self.capacity, "rejected": self.rejected}
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    _GAUGE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self.short_circuited = 0
+        self._probing = False
+        self._gauge = CIRCUIT_STATE.labels(name)
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning("上游 %s 熔断器状态：%s -> %s", self.name, self.state, state)
+            self.state = state
+            self._gauge.set(self._GAUGE_VALUES[state])
+
+    def allow(self) -> bool:
+        """是否放行请求；冷却期结束后只放行一个探测请求"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+            self._probing = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.short_circuited += 1
+        return False
+
+    def release(self) -> None:
+        """放行后请求并未发出(如被本地限流)，半开状态下允许下一个请求继续探测"""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._probing = False
+        self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.opened += 1
+            self._set_state(self.OPEN)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "short_circuited": self.short_circuited,
+        }
+
+
+class LatencyWindow:
+    """最近 size 次成功请求的耗时，用于计算对冲延迟"""
+
+    def __init__(self, size: int = 200) -> None:
+        self.samples: collections.deque = collections.deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        # 样本太少时分位数不可靠，不做对冲
+        if len(self.samples) < 20:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class ResilientUpstream:
+    """对单个上游的请求依次应用熔断、限流、重试与对冲"""
+
+    def __init__(
+        self,
+        name: str,
+        budget: RetryBudget,
+        max_retries: int,
+        backoff_base: float,
+        backoff_cap: float,
+        failure_threshold: int,
+        reset_timeout: float,
+        hedge_enabled: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_min_delay: float = 0.05,
+        retryable_codes: FrozenSet[str] = RETRYABLE_CODES,
+        limiter: Optional[UpstreamLimiter] = None,
+    ) -> None:
+        self.name = name
+        self.budget = budget
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.retryable_codes = retryable_codes
+        self.limiter = limiter
+        self.latency = LatencyWindow()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _backoff(self, retry: int) -> float:
+        """全抖动指数退避：[0, min(cap, base * 2^(n-1))] 内均匀取值"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** (retry - 1)))
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge_enabled:
+            return None
+        p = self.latency.percentile(self.hedge_percentile)
+        return None if p is None else max(p, self.hedge_min_delay)
+
+    async def _timed(self, attempt: Attempt) -> Dict[str, Any]:
+        start = time.perf_counter()
+        result = await attempt()
+        if result.get("success"):
+            self.latency.add(time.perf_counter() - start)
+        return result
+
+    async def _hedged(self, attempt: Attempt) -> Dict[str, Any]:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._timed(attempt)
+
+        first = asyncio.ensure_future(self._timed(attempt))
+        pending = {first}
+        # 调用方在任何等待处被取消时，取消仍在进行的请求，不留下孤立的任务
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done or not self.budget.withdraw():
+                return await first
+            # 对冲请求不排队等待令牌，拿不到就只等第一个请求，并退回已取出的重试预算
+            if self.limiter is not None and await self.limiter.acquire(wait=False) is not None:
+                self.budget.refund()
+                return await first
+
+            self.hedges += 1
+            UPSTREAM_HEDGES.labels(self.name).inc()
+            second = asyncio.ensure_future(self._timed(attempt))
+            pending = {first, second}
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 同时完成时优先取成功的结果；都失败则等待另一个请求
+                task = next((t for t in done if t.result().get("success")), None)
+                if task is not None or not pending:
+                    task = task or done.pop()
+                    if task is second:
+                        self.hedge_wins += 1
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def call(self, attempt: Attempt) -> Dict[str, Any]:
+        if not self.breaker.allow():
+            UPSTREAM_ERRORS.labels(self.name, CIRCUIT_OPEN).inc()
+            return {"success": False, "code": CIRCUIT_OPEN, "error": "服务暂时不可用，请稍后重试"}
+
+        self.budget.deposit()
+        retry = 0
+        while True:
+            denied = await self.limiter.acquire() if self.limiter is not None else None
+            if denied is not None:
+                self.breaker.release()
+                return {"success": False, "code": denied, "error": "请求过于频繁或已达到今日配额，请稍后重试"}
+            result = await self._hedged(attempt)
+            if result.get("success") or result.get("code") not in self.retryable_codes:
+                # 业务错误(如城市不存在、密钥错误)说明上游本身可用
+                self.breaker.record_success()
+                return result
+            self.breaker.record_failure()
+            if retry >= self.max_retries or self.breaker.state == CircuitBreaker.OPEN or not self.budget.withdraw():
+                return result
+            retry += 1
+            self.retries += 1
+            UPSTREAM_RETRIES.labels(self.name).inc()
+            logger.info("上游 %s 返回 %s，第 %d 次重试", self.name, result.get("code"), retry)
+            await asyncio.sleep(self._backoff(retry))
+
+    def stats(self) -> Dict[str, Any]:
+        p = self.latency.percentile(self.hedge_percentile)
+        return {
+            "breaker": self.breaker.stats(),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency_p95_ms": round(p * 1000, 2) if p is not None else None,
+            "rate_limit": self.limiter.stats() if self.limiter is not None else None,
+        }
+
+
+_budget: Optional[RetryBudget] = None
+
+
+def get_retry_budget() -> RetryBudget:
+    """所有上游共享的重试预算"""
+    global _budget
+    if _budget is None:
+        api = settings.api
+        _budget = RetryBudget(api.upstream_retry_budget_ratio, api.upstream_retry_min_per_second)
+    return _budget
+
+
+def build_upstream(name: str) -> ResilientUpstream:
+    """按 APISettings 创建上游的弹性策略"""
+    api = settings.api
+    return ResilientUpstream(
+        name,
+        budget=get_retry_budget(),
+        max_retries=api.upstream_max_retries,
+        backoff_base=api.upstream_retry_backoff,
+        backoff_cap=api.upstream_retry_backoff_cap,
+        failure_threshold=api.upstream_breaker_failures,
+        reset_timeout=api.upstream_breaker_reset_timeout,
+        hedge_enabled=api.upstream_hedge_enabled,
+        hedge_percentile=api.upstream_hedge_percentile,
+        hedge_min_delay=api.upstream_hedge_min_delay,
+        limiter=build_limiter(name),
+    )
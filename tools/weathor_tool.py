@@ -74,83 +74,267 @@
     }
 }
 """
-import requests
-from typing import Dict, Any, Optional
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+import httpx
+from typing import Dict, Any, List, Optional
 from config.settings import settings
+from utils.cache import TTLCache
 from utils.logger import get_logger
+from utils.http_client import get_http_client
+from utils.tracing import span
+from utils.metrics import UPSTREAM_ERRORS
+from tools.resilience import build_upstream, is_unavailable
 
 logger = get_logger(__name__)
 
+# 热门城市的 ID 预置到索引中，热路径上不再需要城市搜索请求
+SEED_CITIES: Dict[str, Dict[str, Any]] = {
+    "北京": {"name": "北京", "id": "101010100", "adm2": "北京", "adm1": "北京市", "country": "中国"},
+    "上海": {"name": "上海", "id": "101020100", "adm2": "上海", "adm1": "上海市", "country": "中国"},
+    "广州": {"name": "广州", "id": "101280101", "adm2": "广州", "adm1": "广东省", "country": "中国"},
+    "深圳": {"name": "深圳", "id": "101280601", "adm2": "深圳", "adm1": "广东省", "country": "中国"},
+    "杭州": {"name": "杭州", "id": "101210101", "adm2": "杭州", "adm1": "浙江省", "country": "中国"},
+}
+
+# obsTime 已经超过刷新间隔时(上游数据延迟)，最短多久后重新拉取
+MIN_OBS_TTL = 60
+
+
+def normalize_city(location: str) -> str:
+    """城市名归一化：去除空白并统一大小写(兼容拼音输入)"""
+    return "".join(location.split()).casefold()
+
+
+def parse_obs_time(obs_time: str) -> Optional[float]:
+    """解析和风天气的 obsTime(如 2024-06-10T14:00+08:00)为时间戳"""
+    try:
+        return datetime.fromisoformat(obs_time).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
 class WeathorTool:
     """和风天气工具类"""
 
     def __init__(self):
         self.api_key = settings.api.qweather_api_key
         self.base_url = settings.api.qweather_base_url
+        app = settings.app
+        # 一级缓存：城市名 -> 城市信息，几乎不变，可持久化到磁盘
+        self.city_cache = TTLCache(app.weather_city_cache_size, app.weather_city_cache_ttl, name="weather_city")
+        self.city_cache_path = app.weather_city_cache_path
+        # 新城市写入时递增版本号；写盘串行执行，已被其他线程写入的版本不再重复写
+        self._city_index_lock = threading.Lock()
+        self._city_index_version = 0
+        self._city_index_saved = 0
+        # 二级缓存：城市 ID -> 天气实况，按 obsTime 计算过期时间；
+        # 过期条目保留一段时间，上游不可用时作为陈旧数据返回
+        api = settings.api
+        self.stale_fallback = api.upstream_stale_fallback
+        self.obs_cache = TTLCache(
+            app.weather_obs_cache_size, app.weather_obs_ttl, name="weather_obs",
+            stale_ttl=api.upstream_stale_max_age if self.stale_fallback else 0,
+        )
+        self.obs_ttl = app.weather_obs_ttl
+        self.upstream = build_upstream("qweather")
+        self._load_city_index()
         logger.info("初始化和风天气工具, base_url: %s", self.base_url)
 
+    def _load_city_index(self) -> None:
+        """加载预置城市与磁盘上持久化的城市索引"""
+        for name, info in SEED_CITIES.items():
+            self.city_cache.set((normalize_city(name), "cn"), info)
+        if not self.city_cache_path or not os.path.exists(self.city_cache_path):
+            return
+        try:
+            with open(self.city_cache_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("加载城市索引失败：%s", e)
+            return
+        if not isinstance(entries, list):
+            logger.warning("城市索引 %s 格式错误，已忽略", self.city_cache_path)
+            return
+        now = time.time()
+        skipped = 0
+        for entry in entries:
+            try:
+                if entry["expires_at"] > now:
+                    self.city_cache.set((entry["name"], entry["range"]), entry["info"], expires_at=entry["expires_at"])
+            except (KeyError, TypeError):
+                skipped += 1
+        if skipped:
+            logger.warning("城市索引中有 %d 条格式错误的条目，已跳过", skipped)
+        logger.info("从 %s 加载城市索引 %d 条", self.city_cache_path, len(self.city_cache))
+
+    def _save_city_index(self) -> None:
+        """把城市索引写回磁盘，先写同目录下的临时文件再替换，避免写入中断导致文件损坏"""
+        with self._city_index_lock:
+            version = self._city_index_version
+            if version == self._city_index_saved:
+                return
+            entries = [
+                {"name": name, "range": location_range, "expires_at": expires_at, "info": info}
+                for (name, location_range), expires_at, info in self.city_cache.items()
+            ]
+            directory, filename = os.path.split(self.city_cache_path)
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(prefix=f"{filename}.", suffix=".tmp", dir=directory or ".")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.city_cache_path)
+                self._city_index_saved = version
+            except OSError as e:
+                logger.warning("保存城市索引失败：%s", e)
+                if tmp_path:
+                    with contextlib.suppress(OSError):
+                        os.unlink(tmp_path)
+
+    def _obs_expires_at(self, obs_time: str) -> float:
+        """实况数据在 obsTime + 刷新间隔后过期，最长不超过一个刷新间隔"""
+        now = time.time()
+        observed_at = parse_obs_time(obs_time)
+        if observed_at is None:
+            return now + self.obs_ttl
+        expires_at = observed_at + self.obs_ttl
+        if expires_at <= now:
+            return now + min(MIN_OBS_TTL, self.obs_ttl)
+        return min(expires_at, now + self.obs_ttl)
+
+    def known_cities(self) -> List[str]:
+        """城市索引中已知的城市名(已归一化)"""
+        return [name for (name, _), _, _ in self.city_cache.items()]
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            "city": self.city_cache.stats(),
+            "observation": self.obs_cache.stats(),
+        }
+
+    def upstream_stats(self) -> Dict[str, Any]:
+        return self.upstream.stats()
+
     # 定义一个统一的请求方法，可以统一处理和风天气的异常情况
-    def request(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
-        """发送请求到和风天气 API"""
-        url = f"{self.base_url}/{endpoint}"
+    async def request(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """发送请求到和风天气 API，可恢复的错误按弹性策略重试，熔断期间直接失败"""
         params["key"] = self.api_key
+        return await self.upstream.call(lambda: self._request_once(endpoint, params))
+
+    async def _request_once(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        url = f"{self.base_url}/{endpoint}"
         try:
-            logger.info(f"请求和风天气 API，URL：{url}，参数：{params}")
+            logger.info("请求和风天气 API，URL：%s，参数：%s", url, params)
 
-            response = requests.get(url, params=params)
+            client = get_http_client(self.base_url)
+            with span("upstream.qweather", endpoint=endpoint):
+                response = await client.get(url, params=params)
+            if response.status_code >= 500 or response.status_code == 429:
+                code = str(response.status_code)
+                UPSTREAM_ERRORS.labels("qweather", code).inc()
+                return {
+                    "success": False,
+                    "code": code,
+                    "error": f"获取信息失败: HTTP {code}",
+                }
             data = response.json()
-            logger.info(f"和风天气 API 响应：{data}")
+            logger.debug("和风天气 API 响应：%s", data)
             if data.get("code") == "200":
                 return {
                     "success": True,
                     "data": data,
                 }
             else:
+                code = str(data.get("code"))
+                UPSTREAM_ERRORS.labels("qweather", code).inc()
                 return {
                     "success": False,
+                    "code": code,
                     "error": f"获取信息失败: {data.get('code')} - {data.get('message')}",
                 }
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
+            UPSTREAM_ERRORS.labels("qweather", "timeout").inc()
             return {
                 "success": False,
+                "code": "timeout",
                 "error": "请求超时，请稍后重试"
             }
-        except requests.exceptions.RequestException:
+        except httpx.HTTPError:
+            UPSTREAM_ERRORS.labels("qweather", "network").inc()
             return {
                 "success": False,
+                "code": "network",
                 "error": "网络请求失败"
             }
         except Exception as e:
+            UPSTREAM_ERRORS.labels("qweather", "exception").inc()
             return {
                 "success": False,
+                "code": "exception",
                 "error": f"获取信息失败: {str(e)}",
             }
 
 
-    def search_city(self, location: str, location_range: str = "cn") -> Optional[Dict[str, Any]]:
+    async def search_city(self, location: str, location_range: str = "cn") -> Optional[Dict[str, Any]]:
         """根据城市名称搜索城市信息"""
-        logger.info(f"搜索城市：{location}，范围：{location_range}")
+        cache_key = (normalize_city(location), location_range)
+        cached = self.city_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        logger.info("搜索城市：%s，范围：%s", location, location_range)
         params = {
             "location": location,
             "range": location_range,
         }
-        response = self.request("geo/v2/city/lookup", params)
-        logger.info(f"城市搜索响应：{response}")
+        response = await self.request("geo/v2/city/lookup", params)
+        logger.debug("城市搜索响应：%s", response)
         if response["success"]:
             locations = response["data"].get("location", [])
             if locations:
-                return locations[0]  # 返回第一个匹配的城市
+                city = locations[0]  # 返回第一个匹配的城市
+                self.city_cache.set(cache_key, city)
+                if self.city_cache_path:
+                    self._city_index_version += 1
+                    await asyncio.to_thread(self._save_city_index)
+                return city
         return None
 
-    def get_current_weather(self, location_id: str) -> Optional[Dict[str, Any]]:
+    async def get_current_weather(self, location_id: str) -> Optional[Dict[str, Any]]:
         """获取指定城市的当前天气实况"""
-        logger.info(f"获取城市ID为 {location_id} 的当前天气实况")
+        cached = self.obs_cache.get(location_id)
+        if cached is not None:
+            return cached
+        # 当日配额将尽时，刚过期的实况仍可用就不再调用上游
+        limiter = self.upstream.limiter
+        if self.stale_fallback and limiter is not None and limiter.quota_low():
+            stale = self.obs_cache.get_stale(location_id)
+            if stale is not None:
+                limiter.record_degraded()
+                logger.info("和风天气当日配额将尽，返回城市 %s 的缓存实况", location_id)
+                return dict(stale, stale=True)
+
+        logger.info("获取城市ID为 %s 的当前天气实况", location_id)
         params = {
             "location": location_id,
         }
-        response = self.request("v7/weather/now", params)
+        response = await self.request("v7/weather/now", params)
         if response["success"]:
             data = response["data"]
             if data.get("code") == "200" and data.get("now"):
-                return data["now"]
+                now = data["now"]
+                self.obs_cache.set(location_id, now, expires_at=self._obs_expires_at(now.get("obsTime", "")))
+                return now
+        elif self.stale_fallback and is_unavailable(response):
+            stale = self.obs_cache.get_stale(location_id)
+            if stale is not None:
+                logger.warning("和风天气不可用(%s)，返回城市 %s 的陈旧实况", response.get("code"), location_id)
+                return dict(stale, stale=True)
         return None
\ No newline at end of file
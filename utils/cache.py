@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterator, Optional, Tuple
+
+from utils.metrics import CACHE_REQUESTS
+
+
+class TTLCache:
+    """
+    带过期时间的 LRU 缓存
+
+    - 容量达到 maxsize 时淘汰最久未使用的条目
+    - 每个条目可单独指定过期时间，读取时惰性清理过期条目
+    - 记录命中、未命中、淘汰、过期等统计信息；指定 name 时同时计入 Prometheus 指标
+    - stale_ttl > 0 时过期条目再保留 stale_ttl 秒，get 视为未命中，get_stale 仍可取到，
+      用于上游不可用时返回陈旧数据
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str = "", stale_ttl: float = 0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+        self._hit_metric = CACHE_REQUESTS.labels(name, "hit") if name else None
+        self._miss_metric = CACHE_REQUESTS.labels(name, "miss") if name else None
+        self._stale_metric = CACHE_REQUESTS.labels(name, "stale") if name else None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                self._record(self._miss_metric)
+                return default
+            expires_at, value = item
+            now = time.time()
+            if expires_at <= now:
+                if expires_at + self.stale_ttl <= now:
+                    del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                self._record(self._miss_metric)
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            self._record(self._hit_metric)
+            return value
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        """读取条目，已过期但仍在 stale_ttl 保留期内的条目同样返回"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] + self.stale_ttl <= time.time():
+                return default
+            self.stale_hits += 1
+            self._record(self._stale_metric)
+            return item[1]
+
+    @staticmethod
+    def _record(metric: Any) -> None:
+        if metric is not None:
+            metric.inc()
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, expires_at: Optional[float] = None) -> None:
+        """写入缓存；expires_at 为绝对时间戳，优先于 ttl"""
+        if expires_at is None:
+            expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[1]
+
+    def items(self) -> Iterator[Tuple[Hashable, float, Any]]:
+        """遍历未过期条目，返回 (key, expires_at, value)"""
+        now = time.time()
+        with self._lock:
+            snapshot = list(self._data.items())
+        for key, (expires_at, value) in snapshot:
+            if expires_at > now:
+                yield key, expires_at, value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            **({"stale_hits": self.stale_hits} if self.stale_ttl else {}),
+        }
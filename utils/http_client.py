@@ -0,0 +1,59 @@
+import importlib.util
+from typing import Dict
+
+import httpx
+
+from config.settings import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 按上游主机(scheme://host:port)缓存的共享客户端，每个主机独立的连接池
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_available() -> bool:
+    """HTTP/2 依赖 h2 包，未安装时自动降级为 HTTP/1.1"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def _origin(base_url: str) -> str:
+    url = httpx.URL(base_url)
+    port = f":{url.port}" if url.port else ""
+    return f"{url.scheme}://{url.host}{port}"
+
+
+def _build_client() -> httpx.AsyncClient:
+    api = settings.api
+    http2 = api.http2_enabled
+    if http2 and not _http2_available():
+        logger.warning("已开启 HTTP/2 但未安装 h2，回退为 HTTP/1.1")
+        http2 = False
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(api.http_read_timeout, connect=api.http_connect_timeout),
+        limits=httpx.Limits(
+            max_connections=api.http_max_connections,
+            max_keepalive_connections=api.http_max_keepalive_connections,
+            keepalive_expiry=api.http_keepalive_expiry,
+        ),
+        http2=http2,
+    )
+
+
+def get_http_client(base_url: str) -> httpx.AsyncClient:
+    """获取指定上游共享的 HTTP 客户端，复用 DNS/TCP/TLS 连接"""
+    origin = _origin(base_url)
+    client = _clients.get(origin)
+    if client is None or client.is_closed:
+        client = _build_client()
+        _clients[origin] = client
+        logger.info("创建上游 HTTP 连接池：%s", origin)
+    return client
+
+
+async def close_http_clients() -> None:
+    """关闭所有共享客户端，由 FastAPI lifespan 在退出时调用"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
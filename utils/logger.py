@@ -1,15 +1,262 @@
+"""
+异步日志
+
+业务代码只把日志记录放入内存队列(QueueHandler)，格式化为 JSON 与写盘由后台线程
+(QueueListener + RotatingFileHandler)完成，事件循环中不再有磁盘 I/O。
+后台线程按固定间隔批量取出日志，避免每条日志都唤醒线程、与事件循环争抢 GIL。
+
+- 参数按 %s 延迟格式化；入队前用 reprlib 截断，超大的 dict/list/字符串只格式化前面一部分
+- INFO 及以下级别可按比例采样，WARNING 及以上始终保留
+- 队列有界(LOG_QUEUE_SIZE)，突发日志写盘跟不上时丢弃最旧的记录，丢弃数由后台线程补记一条 WARNING
+- 日志级别、文件路径、轮转与截断长度均来自 AppSettings
+- 后台线程在第一条日志入队时才启动、日志文件在第一次写入时才打开，仅导入模块没有副作用
+"""
+import atexit
+import collections
 import logging
 import os
+import random
+import reprlib
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Optional
 
-def get_logger(name: str) -> logging.Logger:
-    """创建并返回一个日志记录器"""
+try:
+    import orjson
+
+    def _dumps(data: Any) -> str:
+        return orjson.dumps(data, default=str).decode("utf-8")
+except ImportError:  # pragma: no cover - orjson 为可选依赖
+    import json
+
+    def _dumps(data: Any) -> str:
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+_listener: Optional[QueueListener] = None
+_listener_lock = threading.Lock()
+_started = False
+_configured = False
+
+# LogRecord 的标准属性，其余属性视为 extra 字段输出
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+_SCALARS = (int, float, bool)
+
+
+class TruncatingRepr(reprlib.Repr):
+    """限制格式化的深度与长度，超大对象的格式化开销与其大小无关"""
+
+    def __init__(self, max_length: int) -> None:
+        super().__init__()
+        self.maxstring = max_length
+        self.maxother = max_length
+        self.maxlevel = 3
+        self.maxdict = self.maxlist = self.maxtuple = self.maxset = 10
+
+    def format_arg(self, arg: Any) -> Any:
+        """标量与只含短标量的小容器直接交给 %s(C 实现更快)，其余走截断格式化"""
+        if isinstance(arg, str):
+            # 顶层字符串参数按原样输出(不加引号)，只截断长度；容器内的字符串保留引号
+            return arg if len(arg) <= self.maxstring else arg[:self.maxstring] + "..."
+        if arg is None or isinstance(arg, _SCALARS):
+            return arg
+        if isinstance(arg, (dict, list, tuple)) and len(arg) <= self.maxlist:
+            values = arg.values() if isinstance(arg, dict) else arg
+            if all(v is None or isinstance(v, _SCALARS) or (isinstance(v, str) and len(v) <= 64) for v in values):
+                return arg
+        return self.repr(arg)
+
+
+class LogQueue(collections.deque):
+    """
+    deque.append 无锁且不唤醒消费线程，由 BatchQueueListener 定时轮询
+
+    队列满时 append 丢弃最旧的记录(停止监听的哨兵总能入队)；dropped 为累计丢弃数，多线程下为近似值
+    """
+
+    def __init__(self, maxlen: int) -> None:
+        super().__init__((), maxlen)
+        self.dropped = 0
+
+    def put_nowait(self, item: Any) -> None:
+        if len(self) >= self.maxlen:
+            self.dropped += 1
+        self.append(item)
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """
+    每条日志只格式化一次、不逐条 flush，由监听线程在一批日志写完后统一 flush；
+    文件大小在内存中累计，不再每条日志 seek/tell 一次
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int) -> None:
+        # delay=True：由监听线程在第一次写入时创建目录并打开文件
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self._size = 0
+
+    def _open(self) -> Any:
+        os.makedirs(os.path.dirname(self.baseFilename) or ".", exist_ok=True)
+        stream = super()._open()
+        self._size = os.path.getsize(self.baseFilename)
+        return stream
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = self.format(record) + self.terminator
+            size = len(data.encode("utf-8"))
+            if self._size + size > self.maxBytes > 0:
+                self.doRollover()
+                self._size = 0
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(data)
+            self._size += size
+        except Exception:
+            self.handleError(record)
+
+
+class BatchQueueListener(QueueListener):
+    def __init__(self, log_queue: LogQueue, *handlers: logging.Handler, interval: float = 0.05) -> None:
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.interval = interval
+        self._reported_drops = 0
 
-    os.makedirs("logs", exist_ok=True)
+    def _report_drops(self) -> None:
+        dropped = self.queue.dropped - self._reported_drops
+        if dropped > 0:
+            self._reported_drops += dropped
+            self.handle(logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0, "日志队列已满，丢弃了 %d 条日志", (dropped,), None
+            ))
 
-    logging.basicConfig(
-        filename=os.path.join("logs", "app.log"),
-        level=logging.INFO,
-        format='%(asctime)s | %(levelname)s | %(name)s | %(message)s',
-    )
+    def stop(self) -> None:
+        super().stop()
+        # 后台线程退出前最后一批之后的丢弃数
+        self._report_drops()
+        for handler in self.handlers:
+            handler.flush()
 
-    return logging.getLogger(name)
\ No newline at end of file
+    def dequeue(self, block: bool) -> Any:
+        while True:
+            try:
+                return self.queue.popleft()
+            except IndexError:
+                # 队列取空说明一批日志已写完，补记丢弃数并统一 flush 后再休眠
+                self._report_drops()
+                for handler in self.handlers:
+                    handler.flush()
+                time.sleep(self.interval)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """入队前完成截断与采样，JSON 序列化留给后台线程"""
+
+    def __init__(self, log_queue: LogQueue, max_length: int, sample_rate: float) -> None:
+        super().__init__(log_queue)
+        self.repr = TruncatingRepr(max_length)
+        self.max_length = max_length
+        self.sample_rate = sample_rate
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        super().enqueue(record)
+        if not _started:
+            _start_listener()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.sample_rate < 1.0 and record.levelno < logging.WARNING and random.random() >= self.sample_rate:
+            return False
+        return super().filter(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 参数可能在入队后被修改(如会话状态)，这里生成截断后的消息文本，不保留原对象引用；
+        # 根日志器只挂了这一个处理器，直接修改记录，省去一次拷贝
+        message = str(record.msg)
+        if record.args:
+            args = record.args if isinstance(record.args, tuple) else (record.args,)
+            try:
+                message = message % tuple(self.repr.format_arg(arg) for arg in args)
+            except (TypeError, ValueError):
+                message = f"{message} {args!r}"
+        if len(message) > self.max_length * 4:
+            message = message[:self.max_length * 4] + "..."
+        record.msg = message
+        record.args = None
+        if record.exc_info:
+            # 异常堆栈在当前线程格式化，后台线程拿不到 traceback 对象的上下文
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                data[key] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return _dumps(data)
+
+
+def setup_logging() -> None:
+    """配置根日志器，只执行一次"""
+    global _listener, _configured
+    if _configured:
+        return
+    _configured = True
+    # 延迟导入，避免与配置模块互相依赖
+    from config.settings import settings
+
+    app = settings.app
+    file_handler = BatchRotatingFileHandler(app.log_file, app.log_max_bytes, app.log_backup_count)
+    if app.log_json:
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s"))
+
+    log_queue = LogQueue(app.log_queue_size)
+    root = logging.getLogger()
+    root.setLevel(app.log_level)
+    root.addHandler(AsyncQueueHandler(log_queue, app.log_max_field_length, app.log_sample_rate))
+
+    _listener = BatchQueueListener(log_queue, file_handler)
+
+
+def _start_listener() -> None:
+    """第一条日志入队时启动后台线程"""
+    global _started
+    with _listener_lock:
+        if _started or _listener is None:
+            return
+        _started = True
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """停止后台线程，队列中剩余的日志会先写完"""
+    global _listener
+    with _listener_lock:
+        listener, _listener = _listener, None
+        if listener is not None and _started:
+            listener.stop()
+
+
+def logging_stats() -> Dict[str, Any]:
+    """日志队列的积压与累计丢弃数，供 /stats 使用"""
+    if _listener is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": len(_listener.queue), "dropped": _listener.queue.dropped}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """创建并返回一个日志记录器"""
+    setup_logging()
+    return logging.getLogger(name)
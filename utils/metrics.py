@@ -0,0 +1,135 @@
+"""
+Prometheus 指标
+
+- 依赖 prometheus_client(可选)，未安装时所有指标为空操作，/metrics 返回 503
+- 设置 PROMETHEUS_MULTIPROC_DIR 环境变量即进入多进程模式：每个 uvicorn worker
+  把指标写入该目录下的 mmap 文件，/metrics 由任一 worker 汇总全部进程的数据；
+  该目录需在启动前创建并清空
+- 各阶段耗时直接复用链路追踪的 span(见 utils.tracing)，不在业务代码中重复埋点；
+  计数类指标(工具错误码、缓存命中、token 数)在对应位置显式记录
+"""
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from utils.tracing import add_span_listener
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        REGISTRY,
+        CollectorRegistry,
+        Counter,
+        Gauge,
+        Histogram,
+        generate_latest,
+        multiprocess,
+    )
+    PROMETHEUS_AVAILABLE = True
+except ImportError:  # pragma: no cover - prometheus_client 为可选依赖
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+# LLM 调用为秒级，存储与缓存为亚毫秒级，分别使用不同的分桶
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class _NoopMetric:
+    def labels(self, *args: Any, **kwargs: Any) -> "_NoopMetric":
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+    def observe(self, amount: float) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+
+def _histogram(name: str, doc: str, labels: Tuple[str, ...], buckets: Tuple[float, ...]) -> Any:
+    return Histogram(name, doc, labels, buckets=buckets) if PROMETHEUS_AVAILABLE else _NoopMetric()
+
+
+def _counter(name: str, doc: str, labels: Tuple[str, ...]) -> Any:
+    return Counter(name, doc, labels) if PROMETHEUS_AVAILABLE else _NoopMetric()
+
+
+def _gauge(name: str, doc: str, labels: Tuple[str, ...], mode: str = "livesum") -> Any:
+    # 多进程模式下默认对在线 worker 的值求和
+    return Gauge(name, doc, labels, multiprocess_mode=mode) if PROMETHEUS_AVAILABLE else _NoopMetric()
+
+
+REQUEST_LATENCY = _histogram(
+    "chat_request_duration_seconds", "聊天请求端到端耗时", ("endpoint", "route"), LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = _gauge("chat_requests_in_flight", "正在处理的聊天请求数", ("endpoint",))
+LLM_LATENCY = _histogram("llm_call_duration_seconds", "单次 LLM 调用耗时", ("kind",), LATENCY_BUCKETS)
+LLM_TOKENS = _counter("llm_tokens_total", "LLM 消耗的 token 数", ("model", "type"))
+TOOL_LATENCY = _histogram("tool_call_duration_seconds", "工具调用耗时(含缓存命中)", ("tool",), LATENCY_BUCKETS)
+TOOL_CALLS = _counter("tool_calls_total", "工具调用次数", ("tool", "outcome"))
+UPSTREAM_LATENCY = _histogram(
+    "upstream_request_duration_seconds", "上游 API 请求耗时", ("upstream", "endpoint"), LATENCY_BUCKETS
+)
+UPSTREAM_ERRORS = _counter("upstream_errors_total", "上游 API 错误次数", ("upstream", "code"))
+UPSTREAM_RETRIES = _counter("upstream_retries_total", "上游 API 重试次数", ("upstream",))
+UPSTREAM_HEDGES = _counter("upstream_hedged_requests_total", "上游 API 对冲请求次数", ("upstream",))
+# 0 关闭、1 半开、2 打开；多进程模式下取各 worker 中最严重的状态
+CIRCUIT_STATE = _gauge("upstream_circuit_state", "上游熔断器状态", ("upstream",), mode="livemax")
+# outcome：waited 排队等到了令牌、rate_limited 令牌不足被拒绝、quota_exhausted 当日配额用尽、degraded 配额将尽改用缓存
+UPSTREAM_THROTTLED = _counter("upstream_throttled_total", "上游请求被本地限流的次数", ("upstream", "outcome"))
+# 配置了 Redis 时各 worker 看到的是同一个计数，取最大值
+UPSTREAM_QUOTA_USED = _gauge("upstream_daily_quota_used", "上游当日已使用的请求配额", ("upstream",), mode="livemax")
+STORE_LATENCY = _histogram("state_store_duration_seconds", "会话存储操作耗时", ("op",), FAST_BUCKETS)
+CACHE_REQUESTS = _counter("cache_requests_total", "缓存查找次数", ("cache", "result"))
+ADMISSION_LIMIT = _gauge("admission_concurrency_limit", "聊天请求的自适应并发上限", ())
+ADMISSION_QUEUE_DEPTH = _gauge("admission_queue_depth", "排队等待处理的聊天请求数", ())
+ADMISSION_QUEUE_WAIT = _histogram("admission_queue_wait_seconds", "聊天请求的排队耗时", (), LATENCY_BUCKETS)
+# reason：queue_full 排队已满、session_queue_full 会话排队已满、deadline 预计等不到、timeout 排队超时
+ADMISSION_SHED = _counter("admission_shed_total", "被准入控制拒绝(429)的聊天请求数", ("reason",))
+
+
+def _observe_span(name: str, seconds: float, attributes: Dict[str, Any], error: Optional[str]) -> None:
+    if name.startswith("llm"):
+        LLM_LATENCY.labels(name).observe(seconds)
+    elif name.startswith("tool."):
+        TOOL_LATENCY.labels(name[5:]).observe(seconds)
+    elif name.startswith("upstream."):
+        UPSTREAM_LATENCY.labels(name[9:], attributes.get("endpoint", "")).observe(seconds)
+    elif name.startswith("store.") or name == "session.lock":
+        STORE_LATENCY.labels(name).observe(seconds)
+
+
+if PROMETHEUS_AVAILABLE:
+    add_span_listener(_observe_span)
+
+
+def observe_llm_usage(message: Any) -> None:
+    """记录 LangChain AIMessage 上的 token 用量"""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    model = (getattr(message, "response_metadata", None) or {}).get("model_name", "")
+    LLM_TOKENS.labels(model, "input").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(model, "output").inc(usage.get("output_tokens", 0))
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """返回 /metrics 的响应体与 Content-Type"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """worker 退出时清理其 livesum 仪表数据"""
+    if PROMETHEUS_AVAILABLE and MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
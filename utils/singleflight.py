@@ -0,0 +1,41 @@
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    请求合并(single-flight)
+
+    相同 key 的并发调用只会真正执行一次，其余调用方等待同一个结果。
+    上游任务独立于调用方运行，某个调用方被取消不会影响其他等待者。
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            return await asyncio.shield(task)
+
+        self.coalesced += 1
+        result = await asyncio.shield(task)
+        # 等待者拿到独立副本，避免多个会话修改同一份结果
+        return copy.deepcopy(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
@@ -0,0 +1,286 @@
+"""
+请求级链路追踪
+
+- 每个 HTTP 请求生成(或沿用客户端传入的) X-Request-ID，作为一次 trace
+- 业务代码用 `with span("llm"):` 记录耗时，父子关系通过 contextvars 传递，
+  asyncio.gather 创建的子任务会继承当前 span
+- 请求结束时：
+  1. 按 span 名称汇总耗时，写入 Server-Timing 响应头(浏览器开发者工具可直接查看)
+  2. 可选地把 trace 以 OTLP JSON 格式追加写入本地文件，
+     可被 OpenTelemetry Collector 的 otlpjsonfile receiver 读取
+
+没有进行中的 trace 时(如压测脚本直接调用 handle_message)，span 不会写入 trace，
+只把耗时交给注册的监听器(如 Prometheus 指标)。
+"""
+import os
+import queue
+import secrets
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+
+    def _dumps(data: Any) -> bytes:
+        return orjson.dumps(data)
+except ImportError:  # pragma: no cover - orjson 为可选依赖
+    import json
+
+    def _dumps(data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+REQUEST_ID_HEADER = "x-request-id"
+
+
+@dataclass
+class Span:
+    name: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    def __init__(self, request_id: str) -> None:
+        self.request_id = request_id
+        # OTLP 要求 16 字节的 trace ID；请求 ID 不符合时另行生成
+        self.trace_id = request_id if _is_hex(request_id, 32) else secrets.token_hex(16)
+        self.start_ns = time.perf_counter_ns()
+        self.start_unix_ns = time.time_ns()
+        self.spans: List[Span] = []
+
+    def breakdown(self) -> Dict[str, Tuple[float, int]]:
+        """按 span 名称汇总：名称 -> (总耗时毫秒, 次数)"""
+        result: Dict[str, Tuple[float, int]] = {}
+        for item in self.spans:
+            total, count = result.get(item.name, (0.0, 0))
+            result[item.name] = (total + item.duration_ms, count + 1)
+        return result
+
+    def server_timing(self) -> str:
+        parts = []
+        for name, (total, count) in self.breakdown().items():
+            desc = f';desc="x{count}"' if count > 1 else ""
+            parts.append(f"{name};dur={total:.1f}{desc}")
+        return ", ".join(parts)
+
+    def timings(self) -> Dict[str, Any]:
+        """响应中返回的耗时明细，start_ms 为相对请求开始的偏移"""
+        return {
+            "request_id": self.request_id,
+            "elapsed_ms": round((time.perf_counter_ns() - self.start_ns) / 1e6, 2),
+            "breakdown": {name: round(total, 2) for name, (total, _) in self.breakdown().items()},
+            "spans": [
+                {
+                    "name": item.name,
+                    "start_ms": round((item.start_ns - self.start_ns) / 1e6, 2),
+                    "duration_ms": round(item.duration_ms, 2),
+                    **({"attributes": item.attributes} if item.attributes else {}),
+                }
+                for item in sorted(self.spans, key=lambda s: s.start_ns)
+            ],
+        }
+
+    def to_otlp(self, service_name: str) -> Dict[str, Any]:
+        """转换为 OTLP/JSON 的 ExportTraceServiceRequest"""
+        offset = self.start_unix_ns - self.start_ns
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attr("service.name", service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [
+                        {
+                            "traceId": self.trace_id,
+                            "spanId": item.span_id,
+                            **({"parentSpanId": item.parent_id} if item.parent_id else {}),
+                            "name": item.name,
+                            "kind": 2 if item.parent_id is None else 1,
+                            "startTimeUnixNano": str(item.start_ns + offset),
+                            "endTimeUnixNano": str(item.end_ns + offset),
+                            "attributes": [_otlp_attr(k, v) for k, v in item.attributes.items()],
+                        }
+                        for item in self.spans
+                    ],
+                }],
+            }]
+        }
+
+
+def _is_hex(value: str, length: int) -> bool:
+    if len(value) != length:
+        return False
+    try:
+        int(value, 16)
+    except ValueError:
+        return False
+    return True
+
+
+def _otlp_attr(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+# span 结束时的回调：(名称, 耗时秒, 属性, 异常类型名)
+SpanListener = Callable[[str, float, Dict[str, Any], Optional[str]], None]
+_listeners: List[SpanListener] = []
+
+
+def add_span_listener(listener: SpanListener) -> None:
+    _listeners.append(listener)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+class span:
+    """记录一段耗时；用作同步或异步代码中的 with 语句"""
+
+    __slots__ = ("name", "attributes", "_start_ns", "_span", "_token")
+
+    def __init__(self, name: str, **attributes: Any) -> None:
+        self.name = name
+        self.attributes = attributes
+        self._start_ns = 0
+        self._span: Optional[Span] = None
+        self._token = None
+
+    def __enter__(self) -> Optional[Span]:
+        self._start_ns = time.perf_counter_ns()
+        trace = _current_trace.get()
+        if trace is None:
+            return None
+        parent = _current_span.get()
+        self._span = Span(
+            name=self.name,
+            span_id=secrets.token_hex(8),
+            parent_id=parent.span_id if parent else None,
+            start_ns=self._start_ns,
+            attributes=self.attributes,
+        )
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        end_ns = time.perf_counter_ns()
+        error = exc_type.__name__ if exc_type is not None else None
+        for listener in _listeners:
+            listener(self.name, (end_ns - self._start_ns) / 1e9, self.attributes, error)
+        if self._span is None:
+            return
+        self._span.end_ns = end_ns
+        if error is not None:
+            self._span.attributes["error"] = error
+        _current_span.reset(self._token)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append(self._span)
+
+
+class FileSpanExporter:
+    """
+    后台线程把 trace 以 OTLP JSON 逐行追加写入文件，请求处理中只做入队
+
+    线程在第一次导出时才启动，创建导出器(导入 api.main)不会启动线程或打开文件。
+    """
+
+    def __init__(self, path: str, service_name: str) -> None:
+        self.path = path
+        self.service_name = service_name
+        self._queue: "queue.SimpleQueue[Optional[Trace]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        self._queue.put(trace)
+
+    def _run(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            while True:
+                trace = self._queue.get()
+                if trace is None:
+                    break
+                f.write(_dumps(trace.to_otlp(self.service_name)) + b"\n")
+                # 队列暂时为空时再刷盘，批量写入
+                if self._queue.empty():
+                    f.flush()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=5)
+
+
+class TracingMiddleware:
+    """
+    纯 ASGI 中间件：为每个 HTTP 请求建立 trace，在响应头中加入
+    X-Request-ID 与 Server-Timing，并在请求结束后交给导出器。
+    流式响应的响应头先于正文发送，Server-Timing 只包含发送响应头之前的耗时。
+    """
+
+    def __init__(self, app: Any, exporter: Optional[FileSpanExporter] = None) -> None:
+        self.app = app
+        self.exporter = exporter
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = ""
+        for key, value in scope.get("headers", []):
+            if key == REQUEST_ID_HEADER.encode():
+                request_id = value.decode("latin-1")[:64]
+                break
+        trace = Trace(request_id or secrets.token_hex(16))
+        trace_token = _current_trace.set(trace)
+        root = span("request", method=scope.get("method", ""), path=scope.get("path", ""))
+        root.__enter__()
+
+        async def send_with_headers(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                root.attributes["status"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.encode(), trace.request_id.encode("latin-1")))
+                elapsed = (time.perf_counter_ns() - trace.start_ns) / 1e6
+                timing = ", ".join(filter(None, [f"total;dur={elapsed:.1f}", trace.server_timing()]))
+                headers.append((b"server-timing", timing.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            root.__exit__(None, None, None)
+            _current_trace.reset(trace_token)
+            if self.exporter is not None:
+                self.exporter.export(trace)